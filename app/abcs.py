@@ -12,6 +12,11 @@ class AbstractProcessingBackend(ABC):
         """The main processing pipeline for a single source URL."""
         pass
 
+    @classmethod
+    def parallelism(cls) -> int:
+        """Number of items the backend can usefully process at the same time."""
+        return 1
+
     @classmethod
     @abstractmethod
     def save_extracted(cls, extracted, file: typing.Optional[os.PathLike] = None, *args, **kwargs) -> os.PathLike:
@@ -29,4 +34,17 @@ class AbstractProcessingBackend(ABC):
     def save_normalized(cls, normalized, file: typing.Optional[os.PathLike] = None, *args, **kwargs) -> os.PathLike:
         """Write out the results of normalize_item to a file."""
 
+    @classmethod
+    def normalize_to_file(
+        cls,
+        extracted,
+        file: typing.Optional[os.PathLike] = None,
+        compact: bool = False,
+        *args,
+        **kwargs
+    ) -> os.PathLike:
+        """normalize_item() followed by save_normalized(); backends can do both in one pass instead."""
+        normalized = cls.normalize_item(extracted, *args, **kwargs)
+        return cls.save_normalized(normalized, file=file, compact=compact)
+
 
@@ -9,6 +9,11 @@ CONFIG_DIR = os.path.join(ROOT_DIR, 'config')
 OUTPUT_DIR = os.path.join(ROOT_DIR, 'results')
 BASE_DIR = os.path.dirname(ROOT_DIR)
 LOG_DIR = os.path.join(BASE_DIR, 'logs')
+CACHE_DIR = os.path.join(BASE_DIR, 'cache')
+SEARCH_CACHE_DIR = os.path.join(CACHE_DIR, 'search')
+FTP_LISTING_CACHE_DIR = os.path.join(CACHE_DIR, 'ftp_listings')
+BLOB_CACHE_DIR = os.path.join(CACHE_DIR, 'downloads')
+STATE_DIR = os.path.join(BASE_DIR, 'state')
 
 ENV_DEFAULT_TO_BASIC_CLI = "GDUCK_USE_CLI_FALLBACK"
 
@@ -33,6 +38,50 @@ DEFAULT_CONFIG_FILENAME = 'config.yaml'
 DEFAULT_QUERY_INCREMENT = 1
 DEFAULT_SEARCH_INCREMENT = 1
 
+DEFAULT_SEARCH_CONCURRENCY = 1
+DEFAULT_SEARCH_PREFETCH = 0
+DEFAULT_ADAPTIVE_MIN_BATCH_SIZE = 1
+DEFAULT_ADAPTIVE_MAX_BATCH_SIZE = 10000
+DEFAULT_ADAPTIVE_TARGET_LATENCY = 5.0
+DEFAULT_ADAPTIVE_MAX_PAGE_BYTES = 16 * 1024 * 1024
+DEFAULT_SEARCH_CACHE_TTL = 24 * 60 * 60
+DEFAULT_SEARCH_CACHE_MAX_BYTES = 512 * 1024 * 1024
+DEFAULT_QUERY_ENV_MAX_AGE = 3 * 60 * 60
+
+ESEARCH_MAX_RETMAX = 10000
+DEFAULT_BULK_SUMMARY_BATCH_SIZE = 500
+
+NCBI_DATE_FORMAT = '%Y/%m/%d'
+DEFAULT_INCREMENTAL_DATETYPE = 'pdat'
+# Date fields that move when a record is updated, so a seen UID showing up again means an update
+INCREMENTAL_UPDATE_DATETYPES = ('mdat',)
+
+DEFAULT_HTTP_CONNECT_TIMEOUT = 10
+DEFAULT_HTTP_READ_TIMEOUT = 60
+DEFAULT_HTTP_RETRIES = 5
+DEFAULT_HTTP_BACKOFF = 0.5
+DEFAULT_HTTP_POOL_SIZE = 10
+DEFAULT_HTTP_CHUNK_SIZE = 64 * 1024
+HTTP_RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# FTP client defaults
+DEFAULT_FTP_HOST = 'ftp.ncbi.nlm.nih.gov'
+DEFAULT_FTP_TIMEOUT = 60
+DEFAULT_FTP_POOL_SIZE = 4
+DEFAULT_FTP_IDLE_TIMEOUT = 60
+DEFAULT_FTP_HEALTH_CHECK_AFTER = 5
+DEFAULT_FTP_GOVERNOR_INITIAL_LIMIT = 2
+DEFAULT_FTP_TRANSFER_RETRIES = 3
+DEFAULT_FTP_RETRY_BACKOFF = 1.0
+DEFAULT_DOWNLOAD_WORKERS = 1
+DEFAULT_BLOB_CACHE_MAX_BYTES = 4 * 1024 * 1024 * 1024
+DEFAULT_FTP_LISTING_TTL = 3600
+DEFAULT_FTP_LISTING_MAX_ENTRIES = 10000
+
+# NCBI E-utilities request rate ceilings, in requests per second
+NCBI_RATE_LIMIT = 3
+NCBI_RATE_LIMIT_WITH_KEY = 10
+
 DEFAULT_INTERFACE_REGISTRY_KEY = 'interface'
 DEFAULT_BACKEND_REGISTRY_KEY = 'backends'
 DEFAULT_PARSER_REGISTRY_KEY = 'parsers'
@@ -52,6 +101,30 @@ MAINARG_PROCESSING_BACKEND = 'processing_backend'
 MAINARG_DRY_RUN = 'dry_run'
 MAINARG_SAVE_DOWNLOADED = 'save_downloaded'
 MAINARG_SAVE_NORMALIZED = 'save_normalized'
+MAINARG_HTTP_OPTIONS = 'http_options'
+MAINARG_NCBI_OPTIONS = 'ncbi_options'
+MAINARG_SEARCH_CONCURRENCY = 'search_concurrency'
+MAINARG_SEARCH_ORDERED = 'search_ordered'
+MAINARG_SEARCH_PREFETCH = 'search_prefetch'
+MAINARG_SEARCH_CACHE_OPTIONS = 'search_cache_options'
+MAINARG_SEARCH_MODE = 'search_mode'
+MAINARG_SUMMARY_BATCH_SIZE = 'summary_batch_size'
+MAINARG_DERIVE_LINKS = 'derive_links'
+MAINARG_INCREMENTAL = 'incremental'
+MAINARG_INCREMENTAL_DATETYPE = 'incremental_datetype'
+MAINARG_STATE_DIR = 'state_dir'
+MAINARG_SEARCH_STREAMING = 'search_streaming'
+MAINARG_ADAPTIVE_BATCHING = 'adaptive_batching'
+MAINARG_FTP_OPTIONS = 'ftp_options'
+MAINARG_DOWNLOAD_WORKERS = 'download_workers'
+MAINARG_DOWNLOAD_STREAMING = 'download_streaming'
+MAINARG_METADATA_ONLY = 'metadata_only'
+MAINARG_NORMALIZE_OPTIONS = 'normalize_options'
+MAINARG_COMPACT_OUTPUT = 'compact_output'
+MAINARG_PROCESS_POOL_OPTIONS = 'process_pool_options'
+MAINARG_FTP_LISTING_CACHE_OPTIONS = 'ftp_listing_cache_options'
+MAINARG_FTP_GOVERNOR_OPTIONS = 'ftp_governor_options'
+MAINARG_BLOB_CACHE_OPTIONS = 'blob_cache_options'
 
 INTERFACE_NONE = 'none'
 INTERFACE_CLI = 'cli'
@@ -59,8 +132,13 @@ INTERFACE_INVOKE = 'invoke'
 
 BACKEND_LOCAL = 'local'
 BACKEND_SPARK = 'pyspark'
+BACKEND_PROCESS_POOL = 'process_pool'
 
 PARSER_GENERIC = 'generic'
+PARSER_SERIES_MATRIX = 'series_matrix'
+
+SEARCH_MODE_PAGED = 'paged'
+SEARCH_MODE_BULK = 'bulk'
 
 BASE_NCBI_QUERY_URL = "https://eutils.ncbi.nlm.nih.gov/entrez/eutils/esearch.fcgi"
 NCBI_QUERY_URL_TEMPLATE = "{query_base}?{params}"
@@ -70,9 +148,49 @@ NCBI_SUMMARY_URL_TEMPLATE = "{search_base}?{params}"
 
 FTP_LINK_FIELD = 'ftplink'
 
+# Series matrix files hold the !Series_/!Sample_ metadata rows first, then the expression table between these
+SERIES_MATRIX_TABLE_BEGIN = '!series_matrix_table_begin'
+SERIES_MATRIX_TABLE_END = '!series_matrix_table_end'
+
+# Expression table values standing for a missing measurement
+SERIES_MATRIX_NULL = 'null'
+SERIES_MATRIX_NULL_VALUES = frozenset(('', 'null', 'NULL', 'NA', 'NaN', 'nan'))
+
+# NumPy dtype of the expression values in the columnar normalized representation
+DEFAULT_COLUMNAR_DTYPE = 'float32'
+
+# Metadata rows with a larger share of distinct values than this are not worth dictionary-encoding
+DEFAULT_ENCODING_MAX_DISTINCT_RATIO = 0.5
+
+# Worker processes of the process pool backend; None means one per CPU
+DEFAULT_PROCESS_POOL_WORKERS = None
+# Results with less binary data than this come back from the workers along with the pickle, not in shared memory
+DEFAULT_SHARED_MEMORY_MIN_BYTES = 1024 * 1024
+
+GEO_FTP_ROOT = 'ftp://ftp.ncbi.nlm.nih.gov/'
+GEO_SERIES_PREFIX = 'GSE'
+
+# GDS UIDs encode the record type in their leading digit; Series are 2xxxxxxxx, i.e. 200000000 + GSE number
+GDS_SERIES_UID_OFFSET = 200000000
+GDS_SERIES_UID_LIMIT = 300000000
+
 QUERY_RESULT_FIELD = 'esearchresult'
 QUERY_WEBENV_FIELD = 'webenv'
 QUERY_QRYKEY_FIELD = 'querykey'
+QUERY_COUNT_FIELD = 'count'
+QUERY_IDLIST_FIELD = 'idlist'
 
 SEARCH_RESULT_FIELD = 'result'
 SEARCH_UIDS_FIELD = 'uids'
+SEARCH_ERROR_FIELDS = ('error', 'esummaryresult')
+# Summary fields the downstream pipeline needs; everything else can be dropped while parsing
+DEFAULT_SEARCH_FIELDS = (FTP_LINK_FIELD,)
+
+# Lowercased fragments of the errors the remote returns for an expired/unknown History server session.
+# Only the messages about the session itself - a malformed WebEnv or query_key parameter is not an expiry,
+# and re-establishing the session would not fix it.
+QUERY_ENV_EXPIRED_MARKERS = (
+    'unable to obtain query',
+    'cannot retrieve query',
+    'cannot retrieve history',
+)
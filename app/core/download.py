@@ -0,0 +1,102 @@
+import itertools
+import time
+import typing
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+import app.constants as const
+from app.utils.logs import logger
+
+
+class DownloadResult(typing.NamedTuple):
+    """The outcome of extracting a single source item."""
+    addr: str
+    fname: str
+    extracted: typing.Any = None
+    error: typing.Optional[BaseException] = None
+    elapsed: float = 0.0
+
+
+def iter_sources(fetcher: typing.Iterator[typing.Mapping]) -> typing.Iterator[typing.Tuple[str, str]]:
+    """Flattens the batches yielded by a search fetcher into (FTP directory, filename) pairs."""
+    batch = next(fetcher, None)
+
+    while batch is not None:
+        for (addr, fname) in batch.values():
+            yield addr, fname
+        batch = next(fetcher, None)
+
+
+class DownloadEngine:
+    """Runs the extraction (download) stage of the pipeline on a pool of worker threads.
+
+    The downloads are I/O-bound, so threads are enough to overlap them; each worker checks
+    its own connection out of the FTP pool. Results are yielded as the downloads complete
+    (not in submission order), so the caller can normalize one while the others are in flight.
+
+    The source iterable is consumed lazily, at most `window` items ahead of the completed ones,
+    so a slow consumer does not make the engine buffer the whole search.
+    """
+
+    def __init__(
+        self,
+        extract: typing.Callable[[str, str], typing.Any],
+        workers: int = const.DEFAULT_DOWNLOAD_WORKERS,
+        window: typing.Optional[int] = None,
+    ):
+        """
+        :param extract: Callable downloading a single item given its FTP directory and filename,
+                        e.g. a bound backend extract_item.
+        :param workers: Optional; number of downloads running at the same time.
+        :param window: Optional; max number of submitted, not yet consumed items. Defaults to twice the workers.
+        """
+        self.extract = extract
+        self.workers = max(int(workers), 1)
+        self.window = max(int(window or 2 * self.workers), self.workers)
+
+        self.completed = 0
+        self.failed = 0
+
+    def _run_one(self, addr: str, fname: str) -> DownloadResult:
+        started_at = time.monotonic()
+        try:
+            extracted = self.extract(addr, fname)
+        except Exception as E:
+            logger.exception(E)
+            return DownloadResult(addr=addr, fname=fname, error=E, elapsed=time.monotonic() - started_at)
+
+        return DownloadResult(addr=addr, fname=fname, extracted=extracted, elapsed=time.monotonic() - started_at)
+
+    def run(self, sources: typing.Iterable[typing.Tuple[str, str]]) -> typing.Iterator[DownloadResult]:
+        """Downloads the items concurrently, yielding the results in completion order.
+
+        :param sources: Iterable of (FTP directory, filename) pairs.
+        """
+        source_iter = iter(sources)
+        in_flight: typing.Set[Future] = set()
+
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="download") as executor:
+
+            def _submit_pending():
+                free_slots = self.window - len(in_flight)
+                for (addr, fname) in itertools.islice(source_iter, max(free_slots, 0)):
+                    in_flight.add(executor.submit(self._run_one, addr, fname))
+
+            _submit_pending()
+
+            while in_flight:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+
+                for future in done:
+                    in_flight.discard(future)
+                    result = future.result()
+
+                    if result.error is None:
+                        self.completed += 1
+                    else:
+                        self.failed += 1
+
+                    yield result
+
+                _submit_pending()
+
+        logger.info(f"Download engine: {self.completed} items downloaded, {self.failed} failed")
@@ -0,0 +1,158 @@
+import typing
+
+import app.constants as const
+from app.utils.logs import logger
+
+
+class BatchSizeController:
+    """An AIMD (additive increase, multiplicative decrease) controller for the search page size.
+
+    Starts in a 'slow start' phase where the size doubles after every page that came back
+    within the latency target, like TCP does. After the first page over the target it
+    switches to growing the size by a fixed step per fast page and halving it per slow one.
+
+    The payload size of the pages caps the page size as well: from the bytes per item seen so far,
+    the size is kept to what fits into `max_page_bytes`.
+    """
+
+    def __init__(
+        self,
+        initial_size: int = const.DEFAULT_SEARCH_INCREMENT,
+        min_size: int = const.DEFAULT_ADAPTIVE_MIN_BATCH_SIZE,
+        max_size: int = const.DEFAULT_ADAPTIVE_MAX_BATCH_SIZE,
+        target_latency: float = const.DEFAULT_ADAPTIVE_TARGET_LATENCY,
+        increase_step: typing.Optional[int] = None,
+        decrease_factor: float = 0.5,
+        max_page_bytes: typing.Optional[int] = const.DEFAULT_ADAPTIVE_MAX_PAGE_BYTES,
+    ):
+        """
+        :param initial_size: Optional; page size to start with.
+        :param min_size: Optional; lower bound of the page size.
+        :param max_size: Optional; upper bound of the page size.
+        :param target_latency: Optional; max acceptable time to fetch a single page, in seconds.
+        :param increase_step: Optional; additive increase per fast page. Defaults to a 20th of the size range.
+        :param decrease_factor: Optional; multiplicative decrease per slow page.
+        :param max_page_bytes: Optional; max acceptable payload size of a single page, in bytes. None means unbounded.
+        """
+        self.min_size = max(int(min_size), 1)
+        self.max_size = max(int(max_size), self.min_size)
+        self.target_latency = target_latency
+        self.increase_step = increase_step or max((self.max_size - self.min_size) // 20, 1)
+        self.decrease_factor = min(max(decrease_factor, 0.0), 1.0)
+        self.max_page_bytes = max_page_bytes
+
+        self.size = self._clamp(initial_size)
+        self.slow_start = True
+        self.pages_observed = 0
+        self.items_observed = 0
+        self.time_observed = 0.0
+        self.bytes_observed = 0
+        self.bytes_per_item = None
+
+    def _clamp(self, size: float) -> int:
+        return int(min(max(size, self.min_size), self.max_size))
+
+    def reset(self, size: int) -> int:
+        """Overrides the current page size, e.g. when the consumer requests a specific one."""
+        self.size = self._clamp(size)
+        return self.size
+
+    def observe(
+        self,
+        latency: float,
+        item_count: int,
+        requested_size: typing.Optional[int] = None,
+        nbytes: typing.Optional[int] = None,
+    ) -> int:
+        """Records the outcome of fetching a page and computes the size of the next one.
+
+        :param latency: Time it took to fetch the page, in seconds.
+        :param item_count: Number of items the remote returned for the page.
+        :param requested_size: Optional; page size that was requested. Defaults to the current size.
+        :param nbytes: Optional; payload size of the page, in bytes, if known.
+
+        :returns: The page size to request next.
+        """
+        _requested_size = requested_size or self.size
+
+        self.pages_observed += 1
+        self.items_observed += item_count
+        self.time_observed += latency
+
+        if nbytes is not None:
+            self.bytes_observed += nbytes
+            if item_count:
+                self.bytes_per_item = nbytes / item_count
+
+        if latency > self.target_latency:
+            self.slow_start = False
+            self.size = self._clamp(_requested_size * self.decrease_factor)
+
+        elif item_count >= _requested_size:
+            # Only grow on full pages - a short one is the end of the results, not a signal
+            if self.slow_start:
+                self.size = self._clamp(_requested_size * 2)
+            else:
+                self.size = self._clamp(_requested_size + self.increase_step)
+
+        if self.max_page_bytes and self.bytes_per_item:
+            # Pages over the payload budget shrink to fit it, and the growth stops short of it
+            if nbytes is not None and nbytes > self.max_page_bytes:
+                self.slow_start = False
+            self.size = min(self.size, self._clamp(self.max_page_bytes // self.bytes_per_item))
+
+        return self.size
+
+    @property
+    def throughput(self) -> float:
+        """Average number of items fetched per second so far."""
+        return (self.items_observed / self.time_observed) if self.time_observed else 0.0
+
+
+def adaptive_batches(fetcher: typing.Generator, controller: BatchSizeController):
+    """Wraps a batch coroutine (such as the one created by fetch_all()) and .send()-s it
+    the page size the controller settles on.
+
+    The controller is fed the latency the fetcher measured around its own requests (see SearchBatch),
+    rather than the time it takes the wrapped coroutine to yield - with concurrent pages, that is
+    the wait for the next one to complete, and in bulk mode, it includes the ESearch paging as well.
+    Batches that took no request to fetch, e.g. the cached ones, leave the page size as it is.
+
+    Values .send()-ed to this coroutine override the controller's current size.
+
+    :param fetcher: Source coroutine yielding batches of search results as SearchBatch-es;
+                    must accept a new size via .send(). Its initial batch size should match the controller's initial size.
+    :param controller: Page size controller.
+    """
+    requested_size = controller.size
+    next_size = None
+    started = False
+
+    while True:
+        try:
+            batch = fetcher.send(next_size) if started else next(fetcher)
+        except StopIteration:
+            break
+        started = True
+
+        latency = getattr(batch, "latency", None)
+        if latency is not None:
+            next_size = controller.observe(
+                latency=latency,
+                # The raw number of UIDs in the page; the batch itself lacks the ones without a download link
+                item_count=getattr(batch, "uid_count", len(batch)),
+                # Pages fetched concurrently may have been requested before the last size change
+                requested_size=getattr(batch, "requested", None) or requested_size,
+                nbytes=getattr(batch, "nbytes", None)
+            )
+            requested_size = next_size
+
+        override = yield batch
+        if override is not None:
+            requested_size = next_size = controller.reset(override)
+
+    logger.info(
+        f"Adaptive batching: final page size {controller.size}, "
+        f"{controller.throughput:.1f} items/s over {controller.pages_observed} pages, "
+        f"{controller.bytes_observed} bytes in total"
+    )
@@ -1,6 +1,42 @@
+import itertools
+import typing
+
 import app.constants as const
 from app.core.search import esummary, esearch
-from app.utils.ftp import extract_ftp_links, build_matrix_ftp_url
+from app.core.search.cache import get_response_cache
+from app.core.search.client import timed_requests
+from app.core.search.history import get_query_env_manager
+from app.utils.ftp import extract_ftp_links, build_matrix_ftp_url, build_series_ftp_link
+from app.utils.logs import logger
+
+
+class SearchBatch(dict):
+    """A batch of search results - a dictionary of <identifier>: <download URL> - along with the size
+    of the search response it was built from and the time the request took, e.g. for tuning the page size
+    (see adaptive_batches()).
+    """
+
+    def __init__(
+        self,
+        download_links: typing.Mapping,
+        uid_count: int,
+        nbytes: typing.Optional[int] = None,
+        latency: typing.Optional[float] = None,
+        requested: typing.Optional[int] = None
+    ):
+        """
+        :param download_links: The results, as a dictionary of <identifier>: <download URL>.
+        :param uid_count: Number of UIDs in the response - including the ones without a download link.
+        :param nbytes: Optional; payload size of the response, in bytes. None if unknown (or there was no request).
+        :param latency: Optional; time the requests for the batch spent on the wire, in seconds.
+                        None if there was no request, e.g. the batch came from the cache.
+        :param requested: Optional; page size the batch was requested with.
+        """
+        super().__init__(download_links)
+        self.uid_count = uid_count
+        self.nbytes = nbytes
+        self.latency = latency
+        self.requested = requested
 
 
 def fetch_from_pos(
@@ -8,66 +44,406 @@ def fetch_from_pos(
     term: str,
     db=const.DEFAULT_DB_VALUE,
     batch_size=const.DEFAULT_SEARCH_INCREMENT,
-    query_env=None
+    query_env=None,
+    use_cache=True,
+    date_filter=None,
+    streaming=False
 ) -> dict:
     """Fetches a single batch of search results from the remote.
 
-    :param position: Page offset of the current query
+    :param position: Offset of the first record of the page in the current query (0-based, as ESummary's retstart)
     :param term: Query term for the current search.
     :param db: Optional; overrides the NCBI database to search.
     :param batch_size: Optional; max number of items to fetch in the current batch
-    :param query_env: Optional; GEO query env, as provided by the remote search response. Re-requested if None.
+    :param query_env: Optional; GEO query env, as provided by the remote search response.
+                      If None, a shared session for the term is reused, or established if there is none yet.
+    :param use_cache: Optional; if False, skips the search response cache entirely.
+    :param date_filter: Optional; restricts the search to a date range (see esearch.DateFilter).
+    :param streaming: Optional; if True, the response is parsed incrementally as it arrives,
+                      keeping only the fields needed downstream - memory use stays flat for large pages.
 
-    :returns: A dictionary of <identifier>: <download URL>
+    :returns: A dictionary of <identifier>: <download URL>, as a SearchBatch
     """
 
-    _position = max(position, 1)
+    _position = max(position, 0)
     _maxsize = max(batch_size, 1)
 
-    webenv, qkey = query_env if query_env else esearch.get_query_env(term=term, db=db)
+    cache = get_response_cache() if use_cache else None
+    cache_key = cache.build_key("esummary", term, db, _position, _maxsize, date_filter) if cache else None
+    raw_search_results = cache.get(cache_key) if cache else None
+    search_results = esummary.parse_search_response(raw_search_results) if raw_search_results else None
+    nbytes = len(raw_search_results) if search_results else None
+    latency = None
+
+    if not search_results:
+        env_manager = get_query_env_manager()
+        webenv, qkey = (query_env or env_manager.get(term=term, db=db, date_filter=date_filter))[:2]
+
+        search_url = esummary.build_search_url(webenv=webenv, query_key=qkey, retstart=_position, retmax=_maxsize)
+        search_results, raw_search_results, expired, nbytes, latency = _request_summaries(
+            search_url,
+            streaming=streaming
+        )
+
+        if expired:
+            # The History server dropped our session - re-establish it and resume from the same offset:
+            logger.warning(f"Search session expired at position {_position}; refreshing.")
+            webenv, qkey = env_manager.refresh(
+                term=term,
+                db=db,
+                stale_webenv=webenv,
+                date_filter=date_filter
+            )[:2]
+
+            search_url = esummary.build_search_url(webenv=webenv, query_key=qkey, retstart=_position, retmax=_maxsize)
+            search_results, raw_search_results, _, nbytes, latency = _request_summaries(
+                search_url,
+                streaming=streaming
+            )
+
+        if cache and search_results:
+            # Only the well-formed, non-empty pages are worth keeping around
+            cache.put(cache_key, raw_search_results)
+
+    download_links = build_download_links(search_results)
+    return SearchBatch(
+        download_links,
+        uid_count=len(search_results or ()),
+        nbytes=nbytes,
+        latency=latency,
+        requested=_maxsize
+    )
+
+
+def _request_summaries(search_url, form_data=None, streaming=False) -> tuple:
+    """Runs an ESummary request, either buffered or streamed.
+
+    :returns: A tuple of (parsed search results, response text worth caching, whether the session has expired,
+              payload size of the response in bytes, time the request spent on the wire in seconds)
+    """
+    with timed_requests() as timer:
+        search_results, cacheable_response, expired, nbytes = _run_summary_request(
+            search_url,
+            form_data=form_data,
+            streaming=streaming
+        )
+
+    return search_results, cacheable_response, expired, nbytes, timer.elapsed
+
+
+def _run_summary_request(search_url, form_data=None, streaming=False) -> tuple:
+    if streaming:
+        parser = esummary.SearchStreamParser()
+        nbytes = 0
+
+        def _counted(chunks):
+            nonlocal nbytes
+            for chunk in chunks:
+                nbytes += len(chunk)
+                yield chunk
+
+        search_results = parser.parse(_counted(esummary.stream_search_results(search_url, form_data=form_data)))
+        # The raw stream is never held in full - cache a compact rendition of what we kept instead:
+        cacheable = search_results and parser.complete
+        cacheable_response = esummary.build_compact_response(search_results) if cacheable else None
+        return search_results, cacheable_response, parser.is_query_env_expired(), nbytes
+
+    if form_data is not None:
+        raw_search_results = esummary.get_search_results_by_post(search_url, form_data)
+    else:
+        raw_search_results = esummary.get_search_results(search_url)
 
-    search_url = esummary.build_search_url(webenv=webenv, query_key=qkey, retstart=_position, retmax=_maxsize)
-    raw_search_results = esummary.get_search_results(search_url)
     search_results = esummary.parse_search_response(raw_search_results)
+    nbytes = len(raw_search_results.encode("utf8")) if raw_search_results else 0
+    return search_results, raw_search_results, esummary.is_query_env_expired(raw_search_results), nbytes
+
+
+def build_download_links(search_results: dict) -> dict:
+    """Translates parsed ESummary results into download locations.
 
+    :param search_results: A dictionary of <identifier>: <summary data>, as parsed from an ESummary response
+
+    :returns: A dictionary of <identifier>: <download URL>
+    """
     raw_links = extract_ftp_links(search_results)
     download_links = {
         data_id: build_matrix_ftp_url(raw_link)
         for (data_id, raw_link)
         in raw_links.items()
     }
-
     return download_links
 
 
-def fetch_all(term: str, db=const.DEFAULT_DB_VALUE, batch_size=None):
+def fetch_by_ids(
+    uids: typing.Sequence[str],
+    db=const.DEFAULT_DB_VALUE,
+    use_cache=True,
+    streaming=False
+) -> dict:
+    """Fetches the search results for an explicit list of UIDs from the remote, in a single POST request.
+
+    :param uids: UIDs to fetch the summaries for.
+    :param db: Optional; overrides the NCBI database to search.
+    :param use_cache: Optional; if False, skips the search response cache entirely.
+    :param streaming: Optional; if True, the response is parsed incrementally as it arrives,
+                      keeping only the fields needed downstream - memory use stays flat for large pages.
+
+    :returns: A dictionary of <identifier>: <download URL>, as a SearchBatch
+    """
+    if not uids:
+        return SearchBatch({}, uid_count=0)
+
+    cache = get_response_cache() if use_cache else None
+    cache_key = cache.build_key("esummary-ids", "", db, ",".join(uids)) if cache else None
+    raw_search_results = cache.get(cache_key) if cache else None
+    search_results = esummary.parse_search_response(raw_search_results) if raw_search_results else None
+    nbytes = len(raw_search_results) if search_results else None
+    latency = None
+
+    if not search_results:
+        summary_url, form_data = esummary.build_summary_post(uids=uids, database=db)
+        search_results, raw_search_results, _, nbytes, latency = _request_summaries(
+            summary_url,
+            form_data,
+            streaming=streaming
+        )
+
+        if cache and search_results:
+            cache.put(cache_key, raw_search_results)
+
+    download_links = build_download_links(search_results)
+    return SearchBatch(
+        download_links,
+        uid_count=len(search_results or ()),
+        nbytes=nbytes,
+        latency=latency,
+        requested=len(uids)
+    )
+
+
+def fetch_all(term: str, db=const.DEFAULT_DB_VALUE, batch_size=None, date_filter=None, streaming=False):
     """Creates an iterable coroutine over all search results in GEO.
 
     :param term: Query term for the current search.
     :param db: Optional; overrides the NCBI database to search.
     :param batch_size: Optional; max number of items to fetch in the current batch.
                        Can be dynamically changed by .send()-ing to the coroutine.
+    :param date_filter: Optional; restricts the search to a date range (see esearch.DateFilter).
+    :param streaming: Optional; if True, the response is parsed incrementally as it arrives,
+                      keeping only the fields needed downstream - memory use stays flat for large pages.
     """
     result = None
     remaining_data = True
-    query_env = esearch.get_query_env(term=term, db=db)
 
     curr_batch_size = const.DEFAULT_SEARCH_INCREMENT if batch_size is None else max(batch_size, 1)
     new_batch_size = None
 
-    curr_pos = 1
+    curr_pos = 0
 
     while remaining_data:
         curr_batch_size = curr_batch_size if new_batch_size is None else max(new_batch_size, 1)
+        # No explicit query_env - the pages share a managed session, re-established if it expires mid-crawl
         result = fetch_from_pos(
             curr_pos,
             term=term,
             db=db,
             batch_size=curr_batch_size,
-            query_env=query_env
+            date_filter=date_filter,
+            streaming=streaming
         )
-        if not result: remaining_data = False
-        curr_pos += batch_size
+        # A page can lack download links for all its UIDs; only one without UIDs is the end of the results
+        if not result.uid_count: remaining_data = False
+        curr_pos += curr_batch_size
         new_batch_size = yield result
 
     return result
+
+
+def fetch_all_concurrent(
+    term: str,
+    db=const.DEFAULT_DB_VALUE,
+    batch_size=None,
+    concurrency=const.DEFAULT_SEARCH_CONCURRENCY,
+    ordered=True,
+    date_filter=None,
+    streaming=False
+):
+    """Creates an iterable coroutine over all search results in GEO, fetching the pages concurrently.
+
+    Unlike fetch_all(), this captures the total result count from the initial search,
+    so that all the page requests can go out at once instead of one after another.
+    The throughput is still bounded by the shared E-utilities rate limiter.
+
+    :param term: Query term for the current search.
+    :param db: Optional; overrides the NCBI database to search.
+    :param batch_size: Optional; max number of items to fetch in the current batch.
+                       Can be dynamically changed by .send()-ing to the coroutine;
+                       the new size applies to the pages that have not been requested yet.
+    :param concurrency: Optional; max number of page requests in flight at the same time.
+    :param ordered: Optional; if True (default), the batches are yielded in page order,
+                    otherwise - in the order they complete.
+    :param date_filter: Optional; restricts the search to a date range (see esearch.DateFilter).
+    :param streaming: Optional; if True, the response is parsed incrementally as it arrives,
+                      keeping only the fields needed downstream - memory use stays flat for large pages.
+    """
+    from collections import deque
+    from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+    count = get_query_env_manager().get(term=term, db=db, date_filter=date_filter).count
+
+    curr_batch_size = const.DEFAULT_SEARCH_INCREMENT if batch_size is None else max(batch_size, 1)
+    max_in_flight = max(concurrency or 1, 1)
+    result = None
+
+    if not count:
+        return result
+
+    # retstart is 0-based - the last page starts at count - 1 at the latest
+    next_pos = 0
+    in_flight = deque()
+
+    with ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="esummary") as executor:
+
+        def _submit_pending():
+            nonlocal next_pos
+            while next_pos < count and len(in_flight) < max_in_flight:
+                future = executor.submit(
+                    fetch_from_pos,
+                    next_pos,
+                    term=term,
+                    db=db,
+                    batch_size=curr_batch_size,
+                    date_filter=date_filter,
+                    streaming=streaming
+                )
+                in_flight.append(future)
+                next_pos += curr_batch_size
+
+        _submit_pending()
+
+        while in_flight:
+            if ordered:
+                done_future = in_flight.popleft()
+            else:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                done_future = next(iter(done))
+                in_flight.remove(done_future)
+
+            result = done_future.result()
+            new_batch_size = yield result
+
+            if new_batch_size is not None:
+                curr_batch_size = max(new_batch_size, 1)
+
+            _submit_pending()
+
+    return result
+
+
+def uid_to_series_accession(uid, db=const.DEFAULT_DB_VALUE) -> typing.Optional[str]:
+    """Decodes the GEO Series accession from a GDS UID, e.g. 200012345 -> GSE12345.
+
+    :param uid: UID, as returned by ESearch.
+    :param db: Optional; NCBI database the UID comes from. Only GDS UIDs can be decoded.
+
+    :returns: The Series accession, or None if the UID is not a recognized Series UID.
+    """
+    if db != const.NcbiDbs.DataSets.value:
+        return None
+
+    try:
+        numeric_uid = int(uid)
+    except (TypeError, ValueError):
+        return None
+
+    if not (const.GDS_SERIES_UID_OFFSET < numeric_uid < const.GDS_SERIES_UID_LIMIT):
+        return None
+
+    return f"{const.GEO_SERIES_PREFIX}{numeric_uid - const.GDS_SERIES_UID_OFFSET}"
+
+
+def derive_download_links(
+    uids: typing.Iterable[str],
+    db=const.DEFAULT_DB_VALUE
+) -> typing.Tuple[dict, list]:
+    """Builds the download locations straight from the UIDs, without asking ESummary,
+    for all the UIDs that encode a Series accession.
+
+    :param uids: UIDs, as returned by ESearch.
+    :param db: Optional; NCBI database the UIDs come from.
+
+    :returns: A tuple of (a dictionary of <identifier>: <download URL>, a list of UIDs that could not be decoded)
+    """
+    download_links = {}
+    unresolved = []
+
+    for uid in uids:
+        accession = uid_to_series_accession(uid, db=db)
+        if accession is None:
+            unresolved.append(uid)
+            continue
+
+        download_links[uid] = build_matrix_ftp_url(build_series_ftp_link(accession))
+
+    return download_links, unresolved
+
+
+def fetch_bulk(
+    term: str,
+    db=const.DEFAULT_DB_VALUE,
+    batch_size=const.DEFAULT_BULK_SUMMARY_BATCH_SIZE,
+    uid_page_size=const.ESEARCH_MAX_RETMAX,
+    derive_links=False,
+    date_filter=None,
+    streaming=False
+):
+    """Creates an iterable coroutine over all search results in GEO, optimized for large result sets.
+
+    Rather than paging through ESummary over a History server session, this harvests the full
+    UID list from ESearch at its max page size first, then POSTs the UIDs to ESummary in large batches.
+    A query matching 50k records takes a few dozen requests this way.
+
+    :param term: Query term for the current search.
+    :param db: Optional; overrides the NCBI database to search.
+    :param batch_size: Optional; number of UIDs summarized per ESummary request.
+                       Can be dynamically changed by .send()-ing to the coroutine.
+    :param uid_page_size: Optional; number of UIDs requested per ESearch call; the remote caps it at 10000.
+    :param derive_links: Optional; if True, Series UIDs are turned into download locations directly,
+                         skipping ESummary; only the UIDs that cannot be decoded are summarized.
+    :param date_filter: Optional; restricts the search to a date range (see esearch.DateFilter).
+    :param streaming: Optional; if True, the response is parsed incrementally as it arrives,
+                      keeping only the fields needed downstream - memory use stays flat for large pages.
+    """
+    result = None
+    curr_batch_size = const.DEFAULT_BULK_SUMMARY_BATCH_SIZE if batch_size is None else max(batch_size, 1)
+    uid_stream = esearch.iter_uids(term=term, db=db, page_size=uid_page_size, date_filter=date_filter)
+
+    while True:
+        uid_batch = list(itertools.islice(uid_stream, curr_batch_size))
+        if not uid_batch:
+            break
+
+        # Only the summary requests are timed in the batches; the ESearch paging for the UIDs is left out
+
+        if derive_links:
+            derived, unresolved = derive_download_links(uid_batch, db=db)
+            summarized = fetch_by_ids(unresolved, db=db, streaming=streaming)
+            derived.update(summarized)
+            result = SearchBatch(
+                derived,
+                uid_count=len(uid_batch),
+                nbytes=summarized.nbytes,
+                latency=summarized.latency,
+                requested=len(uid_batch)
+            )
+        else:
+            result = fetch_by_ids(uid_batch, db=db, streaming=streaming)
+            # The page is the UIDs asked for, whether ESummary had a record for each or not
+            result.uid_count = len(uid_batch)
+
+        new_batch_size = yield result
+
+        if new_batch_size is not None:
+            curr_batch_size = max(new_batch_size, 1)
+
+    return result
@@ -0,0 +1,182 @@
+import datetime
+import hashlib
+import json
+import os
+import tempfile
+import typing
+
+import app.constants as const
+from app.core.search.cache import normalize_term
+from app.core.search.esearch import DateFilter
+from app.utils.logs import logger
+
+
+class QueryWatermark:
+    """The persisted progress of an incremental search - the date of the last completed run
+    and the UIDs seen so far, stored in a small per-query state file.
+
+    A result only counts as seen once it has been processed: the results handed out by the search are
+    pending until the consumer acknowledges them, and the ones never acknowledged are left out of the commit.
+    """
+
+    def __init__(
+        self,
+        term: str,
+        db=const.DEFAULT_DB_VALUE,
+        datetype: str = const.DEFAULT_INCREMENTAL_DATETYPE,
+        state_dir: typing.Optional[str] = None,
+    ):
+        """
+        :param term: Query term of the search.
+        :param db: Optional; NCBI database searched.
+        :param datetype: Optional; the date field the watermark applies to, e.g. 'pdat' (publication date).
+        :param state_dir: Optional; directory holding the state files. Defaults to the app state dir.
+        """
+        self.term = term
+        self.db = db or const.DEFAULT_DB_VALUE
+        self.datetype = datetype or const.DEFAULT_INCREMENTAL_DATETYPE
+        self.state_dir = state_dir or const.STATE_DIR
+
+        self.last_date: typing.Optional[str] = None
+        self.seen_uids: typing.Set[str] = set()
+        # UIDs handed out for processing and not acknowledged yet, by their download location
+        self.pending: typing.Dict[tuple, typing.Set[str]] = {}
+
+    @property
+    def path(self) -> str:
+        raw_key = json.dumps([normalize_term(self.term), self.db, self.datetype])
+        query_id = hashlib.sha256(raw_key.encode("utf8")).hexdigest()[:16]
+        return os.path.join(self.state_dir, f"watermark-{query_id}.json")
+
+    def load(self) -> "QueryWatermark":
+        """Reads the persisted state, if any. A missing or unreadable state file means a full run."""
+        try:
+            with open(self.path, "r", encoding="utf8") as state_file:
+                state = json.load(state_file)
+
+        except FileNotFoundError:
+            return self
+
+        except (OSError, ValueError) as Err:
+            logger.warning(f"Ignoring unreadable watermark at {self.path}: {Err}")
+            return self
+
+        self.last_date = state.get("last_date")
+        self.seen_uids = set(state.get("seen_uids") or ())
+        return self
+
+    def date_filter(self, run_date: typing.Optional[datetime.date] = None) -> typing.Optional[DateFilter]:
+        """Builds the date range restriction for the next search; None if there was no completed run yet.
+
+        The range starts on the day of the last run (inclusive), so records published later
+        that day are not missed; the ones already seen are filtered out by UID instead.
+        """
+        if not self.last_date:
+            return None
+
+        _run_date = run_date or datetime.date.today()
+        return DateFilter(
+            mindate=self.last_date,
+            maxdate=_run_date.strftime(const.NCBI_DATE_FORMAT),
+            datetype=self.datetype
+        )
+
+    @property
+    def tracks_updates(self) -> bool:
+        """If True, the date field tracks modifications, so already seen UIDs may come back as updates."""
+        return self.datetype in const.INCREMENTAL_UPDATE_DATETYPES
+
+    def is_new(self, uid: str) -> bool:
+        return self.tracks_updates or str(uid) not in self.seen_uids
+
+    def mark_seen(self, uids: typing.Iterable[str]) -> None:
+        self.seen_uids.update(str(uid) for uid in uids)
+
+    def mark_pending(self, batch: typing.Mapping[str, typing.Sequence[str]]) -> None:
+        """Records the results handed out for processing; see acknowledge().
+
+        :param batch: A dictionary of <identifier>: <download location>, as yielded by the search.
+        """
+        for (uid, location) in batch.items():
+            self.pending.setdefault(tuple(location), set()).add(str(uid))
+
+    def acknowledge(self, location: typing.Sequence[str]) -> None:
+        """Marks the results at a download location as processed, so that later runs skip them.
+
+        :param location: The download location of the results, as (FTP directory, filename).
+        """
+        self.mark_seen(self.pending.pop(tuple(location), ()))
+
+    def commit(self, run_date: typing.Optional[datetime.date] = None) -> str:
+        """Atomically persists the state, moving the watermark to the date of the current run.
+
+        If some of the results were never acknowledged (e.g. their downloads failed), the watermark stays
+        at its previous date instead, so that the next run gets them again - the UIDs seen already
+        still spare it the rest.
+
+        :returns: Path to the state file.
+        """
+        _run_date = run_date or datetime.date.today()
+
+        if self.pending:
+            failed = sum(len(uids) for uids in self.pending.values())
+            logger.warning(f"Incremental search: {failed} results were not processed; keeping the watermark date")
+        else:
+            self.last_date = _run_date.strftime(const.NCBI_DATE_FORMAT)
+
+        state = dict(
+            term=self.term,
+            db=self.db,
+            datetype=self.datetype,
+            last_date=self.last_date,
+            seen_uids=sorted(self.seen_uids),
+        )
+
+        os.makedirs(self.state_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.state_dir, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf8") as tmp_file:
+            json.dump(state, tmp_file)
+        os.replace(tmp_path, self.path)
+
+        return self.path
+
+
+def load_watermark(
+    term: str,
+    db=const.DEFAULT_DB_VALUE,
+    datetype: str = const.DEFAULT_INCREMENTAL_DATETYPE,
+    state_dir: typing.Optional[str] = None,
+) -> QueryWatermark:
+    """Loads the persisted watermark of an incremental search (or a blank one for a first run)."""
+    watermark = QueryWatermark(term=term, db=db, datetype=datetype, state_dir=state_dir)
+    return watermark.load()
+
+
+def only_new(fetcher: typing.Generator, watermark: QueryWatermark):
+    """Wraps a batch coroutine, passing through only the results not delivered by the previous runs.
+
+    The results passed through are pending in the watermark; the consumer acknowledges each one once it is
+    processed, and commits the watermark at the end of the run - so an interrupted run is re-done in full next time.
+    Supports .send()-ing a new batch size, which is forwarded to the source coroutine.
+
+    :param fetcher: Source coroutine yielding batches of <identifier>: <download URL> dicts.
+    :param watermark: The state of the incremental search.
+    """
+    new_batch_size = None
+    started = False
+    skipped = 0
+
+    while True:
+        try:
+            batch = fetcher.send(new_batch_size) if started else next(fetcher)
+        except StopIteration:
+            break
+
+        started = True
+        fresh = {uid: location for (uid, location) in batch.items() if watermark.is_new(uid)}
+        skipped += len(batch) - len(fresh)
+        watermark.mark_pending(fresh)
+
+        new_batch_size = yield fresh
+
+    logger.info(f"Incremental search: skipped {skipped} already seen results")
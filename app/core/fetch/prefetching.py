@@ -0,0 +1,141 @@
+import queue
+import threading
+import typing
+
+from app.utils.logs import logger
+
+_EXHAUSTED = object()
+
+
+class _FetchError:
+    """Wraps an exception raised by the source coroutine, to re-raise it on the consumer side."""
+
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+class PrefetchingFetcher:
+    """Wraps a batch coroutine (such as the one created by fetch_all()) and keeps
+    pulling the next batches from it in a background thread, so that the search
+    requests overlap with the processing of the batches already received.
+
+    Supports the same protocol as the wrapped coroutine - iteration, next() and .send()-ing
+    a new batch size. Since up to `depth` batches may already be in flight when a new
+    size is sent, the new size applies to the batches requested from that point on.
+
+    Used as a context manager, it stops the background fetching on exit (see close()).
+    """
+
+    def __init__(self, fetcher: typing.Generator, depth: int = 1):
+        """
+        :param fetcher: Source coroutine yielding batches of search results.
+        :param depth: Max number of batches fetched ahead of the consumer.
+        """
+        self.fetcher = fetcher
+        self.depth = max(depth, 1)
+
+        self._batches = queue.Queue(maxsize=self.depth)
+        self._size_lock = threading.Lock()
+        self._pending_size = None
+        self._stopped = threading.Event()
+        self._finished = False
+
+        # Started lazily on the first request, to match the laziness of the wrapped coroutine:
+        self._worker = threading.Thread(
+            target=self._prefetch,
+            name="prefetcher",
+            daemon=True
+        )
+
+    def _put(self, item) -> bool:
+        """Blocks until the item fits in the queue or the prefetcher is stopped."""
+        while not self._stopped.is_set():
+            try:
+                self._batches.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _prefetch(self) -> None:
+        started = False
+
+        try:
+            while not self._stopped.is_set():
+                with self._size_lock:
+                    new_size, self._pending_size = self._pending_size, None
+
+                # A just-started generator only accepts a None send:
+                batch = self.fetcher.send(new_size) if started else next(self.fetcher)
+                started = True
+
+                if not self._put(batch):
+                    break
+
+        except StopIteration:
+            self._put(_EXHAUSTED)
+
+        except Exception as E:
+            logger.exception(E)
+            self._put(_FetchError(E))
+
+        finally:
+            self.fetcher.close()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._finished:
+            raise StopIteration
+
+        if self._worker.ident is None:
+            self._worker.start()
+
+        item = self._batches.get()
+
+        if item is _EXHAUSTED:
+            self._finished = True
+            raise StopIteration
+
+        if isinstance(item, _FetchError):
+            self._finished = True
+            raise item.error
+
+        return item
+
+    def send(self, value: typing.Optional[int]):
+        """Requests a new batch size for the batches not fetched yet and returns the next batch.
+
+        :param value: New max number of items per batch; None keeps the current size.
+        """
+        if value is not None:
+            with self._size_lock:
+                self._pending_size = value
+        return next(self)
+
+    def close(self) -> None:
+        """Stops the background fetching; batches already fetched are discarded."""
+        self._stopped.set()
+        self._finished = True
+        if self._worker.ident is not None:
+            self._worker.join()
+        else:
+            # Never started - the worker is not there to close the source
+            self.fetcher.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+def prefetch(fetcher: typing.Generator, depth: int = 1) -> PrefetchingFetcher:
+    """Wraps a batch coroutine in a look-ahead prefetcher fetching up to `depth` batches in the background.
+
+    :param fetcher: Source coroutine yielding batches of search results.
+    :param depth: Max number of batches fetched ahead of the consumer.
+    """
+    return PrefetchingFetcher(fetcher=fetcher, depth=depth)
@@ -1,9 +1,20 @@
+import contextlib
 import os
 import typing
 
 import app.constants as const
-from app.core.fetch.fetching import fetch_all
+from app.core.download import DownloadEngine, iter_sources
+from app.core.fetch.adaptive import BatchSizeController, adaptive_batches
+from app.core.fetch.fetching import fetch_all, fetch_all_concurrent, fetch_bulk
+from app.core.fetch.incremental import QueryWatermark, load_watermark, only_new
+from app.core.fetch.prefetching import prefetch
+from app.core.search.cache import configure_cache, get_response_cache
+from app.core.search.client import configure_session, configure_identity
 from app.processing_backends import get_backend
+from app.utils.blob_cache import configure_blob_cache
+from app.utils.ftp_governor import configure_ftp_governor
+from app.utils.ftp_listing import configure_listing_cache
+from app.utils.ftp_pool import configure_ftp_pool
 from app.utils.logs import logger
 
 
@@ -67,12 +78,88 @@ def parse_app_args(config: object = None, ui_args: dict = None) -> dict:
     )
     batch_size = const.DEFAULT_SEARCH_INCREMENT if increment is None else max(increment, 1)
 
+    search_cfg = (cfg.get("search", None) or {}) if cfg else {}
+
+    # Number of esummary pages requested at the same time; 1 means sequential paging
+    search_concurrency = (
+        _app_args.get(const.MAINARG_SEARCH_CONCURRENCY)
+        or search_cfg.get("concurrency", None)
+        or const.DEFAULT_SEARCH_CONCURRENCY
+    )
+
+    # Whether concurrently fetched pages are yielded in page order or as they complete
+    search_ordered = _app_args.get(const.MAINARG_SEARCH_ORDERED)
+    if search_ordered is None:
+        search_ordered = search_cfg.get("ordered", True)
+
+    # Search strategy: 'paged' walks ESummary pages over a History session,
+    # 'bulk' harvests the UIDs first and summarizes them in large POST batches
+    search_mode = (
+        _app_args.get(const.MAINARG_SEARCH_MODE)
+        or search_cfg.get("mode", None)
+        or const.SEARCH_MODE_PAGED
+    )
+    summary_batch_size = (
+        _app_args.get(const.MAINARG_SUMMARY_BATCH_SIZE)
+        or search_cfg.get("summary_batch_size", None)
+        or const.DEFAULT_BULK_SUMMARY_BATCH_SIZE
+    )
+    # In bulk mode, build the Series download locations from the UIDs and skip ESummary for them
+    derive_links = _app_args.get(const.MAINARG_DERIVE_LINKS)
+    if derive_links is None:
+        derive_links = search_cfg.get("derive_links", False)
+
+    # Parse the search responses incrementally as they stream in, keeping only the fields we need
+    search_streaming = _app_args.get(const.MAINARG_SEARCH_STREAMING)
+    if search_streaming is None:
+        search_streaming = search_cfg.get("streaming", False)
+
+    # Automatic page size tuning; the options are BatchSizeController parameters
+    adaptive_batching = (
+        _app_args.get(const.MAINARG_ADAPTIVE_BATCHING)
+        or dict(search_cfg.get("adaptive", None) or {})
+    )
+
+    # Number of search batches fetched ahead in the background; 0 disables prefetching
+    search_prefetch = _app_args.get(const.MAINARG_SEARCH_PREFETCH)
+    if search_prefetch is None:
+        search_prefetch = search_cfg.get("prefetch", const.DEFAULT_SEARCH_PREFETCH)
+
+    # Incremental mode: only pass on the results that are new since the last completed run
+    incremental_cfg = (cfg.get("incremental", None) or {}) if cfg else {}
+    incremental = _app_args.get(const.MAINARG_INCREMENTAL)
+    if incremental is None:
+        incremental = incremental_cfg.get("enabled", False)
+
     # Populating an output dict with standardized keys and defaulted values
     # This could probably be reworked into some object, but for now a dict does the trick
     results = dict()
     results[const.MAINARG_DATABASE] = (_app_args.get(const.MAINARG_DATABASE) or const.DEFAULT_DB_VALUE)
     results[const.MAINARG_QUERY] = qry_term
     results[const.MAINARG_BATCH_SIZE] = batch_size
+    results[const.MAINARG_SEARCH_CONCURRENCY] = max(int(search_concurrency), 1)
+    results[const.MAINARG_SEARCH_ORDERED] = bool(search_ordered)
+    results[const.MAINARG_SEARCH_PREFETCH] = max(int(search_prefetch or 0), 0)
+    results[const.MAINARG_SEARCH_MODE] = search_mode
+    results[const.MAINARG_SUMMARY_BATCH_SIZE] = max(int(summary_batch_size), 1)
+    results[const.MAINARG_DERIVE_LINKS] = bool(derive_links)
+    results[const.MAINARG_SEARCH_STREAMING] = bool(search_streaming)
+    results[const.MAINARG_ADAPTIVE_BATCHING] = adaptive_batching
+    results[const.MAINARG_INCREMENTAL] = bool(incremental)
+    results[const.MAINARG_INCREMENTAL_DATETYPE] = (
+        _app_args.get(const.MAINARG_INCREMENTAL_DATETYPE)
+        or incremental_cfg.get("datetype", None)
+        or const.DEFAULT_INCREMENTAL_DATETYPE
+    )
+    results[const.MAINARG_STATE_DIR] = (
+        _app_args.get(const.MAINARG_STATE_DIR)
+        or incremental_cfg.get("state_dir", None)
+        or const.STATE_DIR
+    )
+    results[const.MAINARG_SEARCH_CACHE_OPTIONS] = (
+        _app_args.get(const.MAINARG_SEARCH_CACHE_OPTIONS)
+        or dict(search_cfg.get("cache", None) or {})
+    )
     results[const.MAINARG_PROCESSING_BACKEND] = (
         _app_args.get(const.MAINARG_PROCESSING_BACKEND)
         or (cfg.get("backend")if cfg else None)
@@ -82,11 +169,100 @@ def parse_app_args(config: object = None, ui_args: dict = None) -> dict:
     results[const.MAINARG_DRY_RUN] = bool(cfg.get("dry_run")) if cfg else False
     results[const.MAINARG_SAVE_DOWNLOADED] = _app_args.get(const.MAINARG_SAVE_DOWNLOADED, False)
     results[const.MAINARG_SAVE_NORMALIZED] = _app_args.get(const.MAINARG_SAVE_NORMALIZED, False)
+    results[const.MAINARG_HTTP_OPTIONS] = (
+        _app_args.get(const.MAINARG_HTTP_OPTIONS)
+        or (dict(cfg.get("http", None) or {}) if cfg else {})
+    )
+    results[const.MAINARG_NCBI_OPTIONS] = (
+        _app_args.get(const.MAINARG_NCBI_OPTIONS)
+        or (dict(cfg.get("ncbi", None) or {}) if cfg else {})
+    )
+    # Number of items downloaded at the same time; 1 processes the items strictly one after another
+    download_cfg = (cfg.get("download", None) or {}) if cfg else {}
+    results[const.MAINARG_DOWNLOAD_WORKERS] = max(int(
+        _app_args.get(const.MAINARG_DOWNLOAD_WORKERS)
+        or download_cfg.get("workers", None)
+        or const.DEFAULT_DOWNLOAD_WORKERS
+    ), 1)
+
+    # Decompress and parse the downloads line by line while they transfer, instead of after
+    download_streaming = _app_args.get(const.MAINARG_DOWNLOAD_STREAMING)
+    if download_streaming is None:
+        download_streaming = download_cfg.get("streaming", False)
+    results[const.MAINARG_DOWNLOAD_STREAMING] = bool(download_streaming)
+
+    # Only extract the metadata rows of the series matrices, skipping the transfer of the expression tables
+    metadata_only = _app_args.get(const.MAINARG_METADATA_ONLY)
+    if metadata_only is None:
+        metadata_only = download_cfg.get("metadata_only", False)
+    results[const.MAINARG_METADATA_ONLY] = bool(metadata_only)
+
+    # Local cache of the downloaded files, validated against their remote size and modification time
+    results[const.MAINARG_BLOB_CACHE_OPTIONS] = (
+        _app_args.get(const.MAINARG_BLOB_CACHE_OPTIONS)
+        or dict(download_cfg.get("cache", None) or {})
+    )
+
+    # Options of the backend normalize_item(), e.g. the columnar representation of the expression tables
+    normalize_cfg = dict((cfg.get("normalize", None) or {}) if cfg else {})
+    # Write the dictionary-encoded rows out in their compact form, rather than as plain lists
+    cfg_compact_output = normalize_cfg.pop("compact_output", False)
+    compact_output = _app_args.get(const.MAINARG_COMPACT_OUTPUT)
+    if compact_output is None:
+        compact_output = cfg_compact_output
+    results[const.MAINARG_COMPACT_OUTPUT] = bool(compact_output)
+    results[const.MAINARG_NORMALIZE_OPTIONS] = _app_args.get(const.MAINARG_NORMALIZE_OPTIONS) or normalize_cfg
+
+    # Worker processes of the process pool backend; the options are ProcessPool parameters
+    results[const.MAINARG_PROCESS_POOL_OPTIONS] = (
+        _app_args.get(const.MAINARG_PROCESS_POOL_OPTIONS)
+        or (dict(cfg.get("process_pool", None) or {}) if cfg else {})
+    )
+
+    ftp_cfg = dict((cfg.get("ftp", None) or {}) if cfg else {})
+    ftp_listing_cfg = dict(ftp_cfg.pop("listing_cache", None) or {})
+    ftp_governor_cfg = dict(ftp_cfg.pop("governor", None) or {})
+    results[const.MAINARG_FTP_OPTIONS] = _app_args.get(const.MAINARG_FTP_OPTIONS) or ftp_cfg
+    results[const.MAINARG_FTP_LISTING_CACHE_OPTIONS] = (
+        _app_args.get(const.MAINARG_FTP_LISTING_CACHE_OPTIONS)
+        or ftp_listing_cfg
+    )
+    # Adaptive limit on the parallel FTP transfers; the options are FtpConcurrencyGovernor parameters
+    results[const.MAINARG_FTP_GOVERNOR_OPTIONS] = (
+        _app_args.get(const.MAINARG_FTP_GOVERNOR_OPTIONS)
+        or ftp_governor_cfg
+    )
 
     return results
 
 
-def get_fetcher(app_args: dict) -> typing.Iterable[typing.Mapping]:
+def get_watermark(app_args: dict) -> typing.Optional[QueryWatermark]:
+    """Loads the state of the incremental search, if the run is one; None otherwise."""
+    if app_args.get(const.MAINARG_PRECALCULATED_SOURCES) or not app_args.get(const.MAINARG_INCREMENTAL):
+        return None
+
+    watermark = load_watermark(
+        term=app_args[const.MAINARG_QUERY],
+        db=app_args[const.MAINARG_DATABASE],
+        datetype=app_args.get(const.MAINARG_INCREMENTAL_DATETYPE),
+        state_dir=app_args.get(const.MAINARG_STATE_DIR)
+    )
+    return watermark
+
+
+def get_fetcher(
+    app_args: dict,
+    watermark: typing.Optional[QueryWatermark] = None,
+    exit_stack: typing.Optional[contextlib.ExitStack] = None
+) -> typing.Iterable[typing.Mapping]:
+    """Builds the search fetcher for a run: the paging coroutine, wrapped in the batch size controller,
+    the prefetcher and the incremental filter, as configured.
+
+    :param app_args: App arguments, as returned by parse_app_args().
+    :param watermark: Optional; the state of the incremental search, if the run is one.
+    :param exit_stack: Optional; the background prefetching is stopped as this stack unwinds.
+                       Without one, close() the fetcher when stopping early.
+    """
     fetcher = None  # null object
 
     precalculated_sources = app_args.get(const.MAINARG_PRECALCULATED_SOURCES)
@@ -102,8 +278,62 @@ def get_fetcher(app_args: dict) -> typing.Iterable[typing.Mapping]:
         db = app_args[const.MAINARG_DATABASE]
         term = app_args[const.MAINARG_QUERY]
         batch_size = app_args[const.MAINARG_BATCH_SIZE]
-
-        fetcher = fetch_all(term=term, db=db, batch_size=batch_size)
+        concurrency = app_args.get(const.MAINARG_SEARCH_CONCURRENCY, const.DEFAULT_SEARCH_CONCURRENCY)
+        streaming = app_args.get(const.MAINARG_SEARCH_STREAMING, False)
+
+        date_filter = watermark.date_filter() if watermark is not None else None
+
+        if app_args.get(const.MAINARG_SEARCH_MODE) == const.SEARCH_MODE_BULK:
+            fetcher = fetch_bulk(
+                term=term,
+                db=db,
+                batch_size=app_args.get(const.MAINARG_SUMMARY_BATCH_SIZE, const.DEFAULT_BULK_SUMMARY_BATCH_SIZE),
+                derive_links=app_args.get(const.MAINARG_DERIVE_LINKS, False),
+                date_filter=date_filter,
+                streaming=streaming
+            )
+
+        elif concurrency > 1:
+            fetcher = fetch_all_concurrent(
+                term=term,
+                db=db,
+                batch_size=batch_size,
+                concurrency=concurrency,
+                ordered=app_args.get(const.MAINARG_SEARCH_ORDERED, True),
+                date_filter=date_filter,
+                streaming=streaming
+            )
+
+        else:
+            fetcher = fetch_all(
+                term=term,
+                db=db,
+                batch_size=batch_size,
+                date_filter=date_filter,
+                streaming=streaming
+            )
+
+        adaptive_options = dict(app_args.get(const.MAINARG_ADAPTIVE_BATCHING) or {})
+        if adaptive_options.pop("enabled", False):
+            # The fetchers time their own requests (see SearchBatch), so neither the concurrent pages
+            # nor the prefetcher and the consumer in front of it skew the latencies
+            is_bulk = app_args.get(const.MAINARG_SEARCH_MODE) == const.SEARCH_MODE_BULK
+            controller = BatchSizeController(
+                initial_size=app_args.get(const.MAINARG_SUMMARY_BATCH_SIZE) if is_bulk else batch_size,
+                **adaptive_options
+            )
+            fetcher = adaptive_batches(fetcher, controller=controller)
+
+        prefetch_depth = app_args.get(const.MAINARG_SEARCH_PREFETCH, 0)
+        if prefetch_depth:
+            # Keep the next batches coming in while the current one is being processed
+            fetcher = prefetch(fetcher, depth=prefetch_depth)
+            if exit_stack is not None:
+                exit_stack.enter_context(fetcher)
+
+        if watermark is not None:
+            # Wrapped last, so that only the results actually handed out are pending in the watermark
+            fetcher = only_new(fetcher, watermark=watermark)
 
     return fetcher
 
@@ -113,15 +343,43 @@ def process_item(
     fname,
     backend,
     save_downloaded=False,
-    save_normalized=False
+    save_normalized=False,
+    streaming=False,
+    metadata_only=False,
+    normalize_options=None,
+    compact_output=False
 ):
     # Download:
     extracted = backend.extract_item(
         backend_key=backend,
         addr=addr,
-        fname=fname
+        fname=fname,
+        streaming=streaming,
+        metadata_only=metadata_only,
+        normalize_options=normalize_options
+    )
+
+    return finish_item(
+        extracted=extracted,
+        fname=fname,
+        backend=backend,
+        save_downloaded=save_downloaded,
+        save_normalized=save_normalized,
+        normalize_options=normalize_options,
+        compact_output=compact_output
     )
 
+
+def finish_item(
+    extracted,
+    fname,
+    backend,
+    save_downloaded=False,
+    save_normalized=False,
+    normalize_options=None,
+    compact_output=False
+):
+    """Runs the post-download stages of the pipeline for a single item - saving and/or normalizing it."""
     if save_downloaded:
         in_savedir = os.path.join(
             const.BASE_DIR,
@@ -139,11 +397,6 @@ def process_item(
         logger.info(f"Extracted data saved to {extracted_savepath} successfully.")
         return extracted_savepath
 
-    # Transform:
-    normalized = backend.normalize_item(
-        extracted=extracted,
-    )
-
     if save_normalized:
         in_savedir = os.path.join(
             const.BASE_DIR,
@@ -153,14 +406,23 @@ def process_item(
         os.makedirs(in_savedir, exist_ok=True)
         in_savepath = os.path.join(in_savedir, f"{fname}.json")
 
-        normalized_savepath = backend.save_normalized(
-            normalized=normalized,
-            file=in_savepath
+        # Transform and save in one go, so that the backend can write the rows out as it normalizes them:
+        normalized_savepath = backend.normalize_to_file(
+            extracted=extracted,
+            file=in_savepath,
+            compact=compact_output,
+            **(normalize_options or {})
         )
 
         logger.info(f"Normalized data saved to {normalized_savepath} successfully.")
         return normalized_savepath
 
+    # Transform:
+    normalized = backend.normalize_item(
+        extracted=extracted,
+        **(normalize_options or {})
+    )
+
     return normalized
 
 
@@ -177,27 +439,132 @@ def coreloop(cfg=None, **kwargs):
     dry_run = app_args.get(const.MAINARG_DRY_RUN, False)
     save_downloaded = app_args.get(const.MAINARG_SAVE_DOWNLOADED, False)
     save_normalized = app_args.get(const.MAINARG_SAVE_NORMALIZED, False)
+    download_streaming = app_args.get(const.MAINARG_DOWNLOAD_STREAMING, False)
+    metadata_only = app_args.get(const.MAINARG_METADATA_ONLY, False)
+    normalize_options = app_args.get(const.MAINARG_NORMALIZE_OPTIONS) or {}
+    compact_output = app_args.get(const.MAINARG_COMPACT_OUTPUT, False)
     batch = 'not started'
 
-    fetcher = get_fetcher(app_args=app_args)
-
-    if not dry_run:
-        backend = get_backend(backend_key=backend_key)
+    configure_session(**app_args.get(const.MAINARG_HTTP_OPTIONS, {}))
+    configure_identity(**app_args.get(const.MAINARG_NCBI_OPTIONS, {}))
+    configure_cache(**app_args.get(const.MAINARG_SEARCH_CACHE_OPTIONS, {}))
+    download_workers = app_args.get(const.MAINARG_DOWNLOAD_WORKERS, const.DEFAULT_DOWNLOAD_WORKERS)
+
+    # Every download worker holds an FTP connection, so the pool has to be at least as large:
+    ftp_options = dict(app_args.get(const.MAINARG_FTP_OPTIONS, {}))
+    ftp_options.setdefault("size", max(const.DEFAULT_FTP_POOL_SIZE, download_workers))
+    if ftp_options["size"] < download_workers:
+        logger.warning(
+            f"FTP pool size ({ftp_options['size']}) is smaller than the number of download workers "
+            f"({download_workers}); the extra workers will wait for connections."
+        )
 
-        while batch:
-            batch = next(fetcher, None)
+    # Closes the pools and stops the background fetching however the run ends,
+    # including the consumer stopping early or an error bubbling up
+    with contextlib.ExitStack() as exit_stack:
+        ftp_pool = configure_ftp_pool(**ftp_options)
+        exit_stack.callback(ftp_pool.close)
+        governor_options = dict(app_args.get(const.MAINARG_FTP_GOVERNOR_OPTIONS, {}))
+        if not governor_options.get("max_limit"):
+            governor_options["max_limit"] = ftp_pool.size
+        ftp_governor = configure_ftp_governor(**governor_options)
+
+        blob_cache = configure_blob_cache(
+            host=ftp_pool.host,
+            **app_args.get(const.MAINARG_BLOB_CACHE_OPTIONS, {})
+        )
 
-            for randaddr, randfile in batch.values():
-                output = process_item(
-                    addr=randaddr,
-                    fname=randfile,
-                    backend=backend,
-                    save_downloaded=save_downloaded,
-                    save_normalized=save_normalized
+        listing_cache = configure_listing_cache(
+            host=ftp_pool.host,
+            **app_args.get(const.MAINARG_FTP_LISTING_CACHE_OPTIONS, {})
+        )
+        process_pool = None
+        if backend_key == const.BACKEND_PROCESS_POOL:
+            # Only needed by this backend (and only fully supported on Python 3.8+)
+            from app.utils.process_pool import configure_process_pool
+            process_pool = configure_process_pool(**app_args.get(const.MAINARG_PROCESS_POOL_OPTIONS, {}))
+            exit_stack.callback(process_pool.close)
+
+        watermark = get_watermark(app_args=app_args)
+        fetcher = get_fetcher(app_args=app_args, watermark=watermark, exit_stack=exit_stack)
+
+        if not dry_run:
+            backend = get_backend(backend_key=backend_key)
+            # Backends processing several items at once are fed from the download engine threads:
+            engine_workers = max(download_workers, backend.parallelism())
+
+            if engine_workers > 1:
+                # Download concurrently, normalizing the items here as their downloads complete
+                engine = DownloadEngine(
+                    extract=lambda addr, fname: backend.extract_item(
+                        backend_key=backend,
+                        addr=addr,
+                        fname=fname,
+                        streaming=download_streaming,
+                        metadata_only=metadata_only,
+                        normalize_options=normalize_options
+                    ),
+                    workers=engine_workers
                 )
-                yield output
 
-    else: logger.warn("Dry Run!")
+                results = exit_stack.enter_context(contextlib.closing(engine.run(iter_sources(fetcher))))
+
+                for result in results:
+                    if result.error is not None:
+                        continue
+
+                    output = finish_item(
+                        extracted=result.extracted,
+                        fname=result.fname,
+                        backend=backend,
+                        save_downloaded=save_downloaded,
+                        save_normalized=save_normalized,
+                        normalize_options=normalize_options,
+                        compact_output=compact_output
+                    )
+                    if watermark is not None and result.extracted:
+                        # Items that failed to download are not acknowledged, so the next incremental run retries them
+                        watermark.acknowledge((result.addr, result.fname))
+                    yield output
+
+            else:
+                for randaddr, randfile in iter_sources(fetcher):
+                    extracted = backend.extract_item(
+                        backend_key=backend,
+                        addr=randaddr,
+                        fname=randfile,
+                        streaming=download_streaming,
+                        metadata_only=metadata_only,
+                        normalize_options=normalize_options
+                    )
+                    output = finish_item(
+                        extracted=extracted,
+                        fname=randfile,
+                        backend=backend,
+                        save_downloaded=save_downloaded,
+                        save_normalized=save_normalized,
+                        normalize_options=normalize_options,
+                        compact_output=compact_output
+                    )
+                    if watermark is not None and extracted:
+                        watermark.acknowledge((randaddr, randfile))
+                    yield output
+
+            if watermark is not None:
+                # Only once the run is through - an interrupted run is re-done in full next time
+                state_path = watermark.commit()
+                logger.info(f"Incremental search watermark saved to {state_path}")
+
+            logger.info(f"Search cache stats: {get_response_cache().stats()}")
+
+            logger.info(f"FTP connection pool stats: {ftp_pool.stats()}")
+            logger.info(f"FTP listing cache stats: {listing_cache.stats()}")
+            logger.info(f"Download cache stats: {blob_cache.stats()}")
+            if ftp_governor is not None:
+                logger.info(f"FTP concurrency governor stats: {ftp_governor.stats()}")
+
+        else: logger.warn("Dry Run!")
+
     return True
 
 
@@ -0,0 +1,95 @@
+import threading
+import typing
+from urllib.parse import unquote_plus
+
+import app.constants as const
+from app.utils.disk_cache import DiskCache
+
+
+def normalize_term(term: typing.Optional[str]) -> str:
+    """Normalizes a search term for use in cache keys, so that trivially different spellings
+    of the same query (URL-encoding, '+' vs spaces, extra whitespace, case) share entries.
+    """
+    if not term:
+        return ""
+    decoded = unquote_plus(str(term))
+    return " ".join(decoded.split()).lower()
+
+
+class ResponseCache(DiskCache):
+    """A disk-backed cache of raw E-utilities responses.
+
+    Entries are keyed by the semantic parameters of a request (query term, db, offset, page size...)
+    rather than its URL, since the URLs embed a WebEnv which changes with every search session.
+    See DiskCache for the storage, expiry and eviction.
+    """
+
+    def __init__(
+        self,
+        cache_dir: typing.Optional[str] = None,
+        ttl: typing.Optional[float] = const.DEFAULT_SEARCH_CACHE_TTL,
+        max_bytes: typing.Optional[int] = const.DEFAULT_SEARCH_CACHE_MAX_BYTES,
+        enabled: bool = True,
+        bypass: bool = False,
+    ):
+        """
+        :param cache_dir: Optional; directory holding the cache entries. Defaults to the app search cache dir.
+        (See DiskCache for the other parameters.)
+        """
+        super().__init__(
+            cache_dir=cache_dir or const.SEARCH_CACHE_DIR,
+            ttl=ttl,
+            max_bytes=max_bytes,
+            enabled=enabled,
+            bypass=bypass,
+        )
+
+    @staticmethod
+    def build_key(kind: str, term: str, db: typing.Optional[str], *params) -> str:
+        """Builds a cache key for a request.
+
+        :param kind: Request type, e.g. 'esearch' or 'esummary'.
+        :param term: Query term; normalized before hashing.
+        :param db: Database queried.
+        :param params: Any other parameters identifying the response, e.g. offset and page size.
+        """
+        return DiskCache.hash_key(kind, normalize_term(term), db or const.DEFAULT_DB_VALUE, *params)
+
+
+_response_cache = None
+_response_cache_lock = threading.Lock()
+
+
+def configure_cache(
+    cache_dir: typing.Optional[str] = None,
+    ttl: typing.Optional[float] = const.DEFAULT_SEARCH_CACHE_TTL,
+    max_bytes: typing.Optional[int] = const.DEFAULT_SEARCH_CACHE_MAX_BYTES,
+    enabled: bool = True,
+    bypass: bool = False,
+) -> ResponseCache:
+    """Replaces the shared search response cache with one using the provided options.
+    See ResponseCache for the meaning of the parameters.
+    """
+    global _response_cache
+
+    with _response_cache_lock:
+        _response_cache = ResponseCache(
+            cache_dir=cache_dir,
+            ttl=ttl,
+            max_bytes=max_bytes,
+            enabled=enabled,
+            bypass=bypass,
+        )
+        return _response_cache
+
+
+def get_response_cache() -> ResponseCache:
+    """Returns the shared search response cache, building a default one on first use."""
+    global _response_cache
+
+    if _response_cache is None:
+        with _response_cache_lock:
+            if _response_cache is None:
+                _response_cache = ResponseCache()
+
+    return _response_cache
@@ -0,0 +1,398 @@
+import contextlib
+import threading
+import time
+import typing
+from urllib.parse import quote_plus
+
+import requests
+from requests.adapters import HTTPAdapter
+
+import app.constants as const
+from app.core.search.ratelimit import TokenBucket, build_eutils_limiter
+from app.utils.logs import logger
+
+_session = None
+_session_lock = threading.Lock()
+
+_session_options = dict(
+    connect_timeout=const.DEFAULT_HTTP_CONNECT_TIMEOUT,
+    timeout=const.DEFAULT_HTTP_READ_TIMEOUT,
+    retries=const.DEFAULT_HTTP_RETRIES,
+    backoff=const.DEFAULT_HTTP_BACKOFF,
+    pool_size=const.DEFAULT_HTTP_POOL_SIZE,
+)
+
+_limiter = None
+
+_request_timing = threading.local()
+
+_identity_options = dict(
+    api_key=None,
+    tool=const.APP_NAME,
+    email=None,
+    rate_limit=None,
+    burst=None,
+    lock_dir=None,
+)
+
+
+def build_session(pool_size: int = const.DEFAULT_HTTP_POOL_SIZE) -> requests.Session:
+    """Creates a keep-alive HTTP session with a connection pool for the E-utilities.
+
+    The session itself does not retry anything; the retries are made in _send() instead,
+    where each of them waits for the rate limiter like any other request.
+
+    :param pool_size: Max number of pooled connections kept alive per host.
+    """
+    adapter = HTTPAdapter(
+        pool_connections=pool_size,
+        pool_maxsize=pool_size,
+    )
+
+    session = requests.Session()
+    session.headers.update({"User-Agent": f"{const.APP_NAME}/requests"})
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def configure_session(
+    timeout: typing.Optional[float] = None,
+    connect_timeout: typing.Optional[float] = None,
+    retries: typing.Optional[int] = None,
+    backoff: typing.Optional[float] = None,
+    pool_size: typing.Optional[int] = None,
+) -> dict:
+    """Overrides the options of the shared E-utilities session.
+    Any options left as None keep their current values.
+
+    The shared session is rebuilt lazily on the next request if the options changed.
+
+    :param timeout: Read timeout for a single request, in seconds.
+    :param connect_timeout: Connection timeout for a single request, in seconds.
+    :param retries: Max number of retries for a single request.
+    :param backoff: Exponential backoff factor between the retries, in seconds.
+    :param pool_size: Max number of pooled connections kept alive per host.
+
+    :returns: The options now in effect, as a dict.
+    """
+    global _session
+
+    overrides = dict(
+        timeout=timeout,
+        connect_timeout=connect_timeout,
+        retries=retries,
+        backoff=backoff,
+        pool_size=pool_size,
+    )
+
+    with _session_lock:
+        changed = False
+        for (option, value) in overrides.items():
+            if value is not None and _session_options[option] != value:
+                _session_options[option] = value
+                changed = True
+
+        if changed and _session is not None:
+            _session.close()
+            _session = None
+
+        return dict(_session_options)
+
+
+def get_session() -> requests.Session:
+    """Returns the shared E-utilities session, building it on first use.
+
+    The session is shared between threads; the underlying urllib3 connection pool is thread-safe.
+    """
+    global _session
+
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = build_session(pool_size=_session_options["pool_size"])
+
+    return _session
+
+
+def configure_identity(
+    api_key: typing.Optional[str] = None,
+    tool: typing.Optional[str] = None,
+    email: typing.Optional[str] = None,
+    rate_limit: typing.Optional[float] = None,
+    burst: typing.Optional[float] = None,
+    lock_dir: typing.Optional[str] = None,
+) -> dict:
+    """Overrides the NCBI identity (API key, tool and email) sent along with the E-utilities requests
+    and the options of the rate limiter all of the requests go through.
+    Any options left as None keep their current values.
+
+    :param api_key: NCBI API key; raises the allowed rate from 3 to 10 requests per second.
+    :param tool: Name of the application making the requests, as registered with NCBI.
+    :param email: Contact email of the developer, as registered with NCBI.
+    :param rate_limit: Overrides the allowed request rate, in requests per second.
+    :param burst: Overrides the max number of requests allowed to go out back-to-back.
+    :param lock_dir: Directory holding the rate limiter state shared between processes on this host.
+
+    :returns: The options now in effect, as a dict.
+    """
+    global _limiter
+
+    overrides = dict(
+        api_key=api_key,
+        tool=tool,
+        email=email,
+        rate_limit=rate_limit,
+        burst=burst,
+        lock_dir=lock_dir,
+    )
+
+    with _session_lock:
+        for (option, value) in overrides.items():
+            if value is not None and _identity_options[option] != value:
+                _identity_options[option] = value
+                # The allowed rate depends on the API key, so we need a fresh limiter:
+                _limiter = None
+
+        return dict(_identity_options)
+
+
+def get_identity(
+    api_key: typing.Optional[str] = None,
+    tool: typing.Optional[str] = None,
+    email: typing.Optional[str] = None,
+) -> typing.Dict[str, str]:
+    """Resolves the NCBI identity for an E-utilities request.
+    Any values left as None are filled in from the configured identity.
+
+    :returns: A dict of the non-empty `api_key`, `tool` and `email` values.
+    """
+    identity = dict(
+        api_key=_identity_options["api_key"] if api_key is None else api_key,
+        tool=_identity_options["tool"] if tool is None else tool,
+        email=_identity_options["email"] if email is None else email,
+    )
+    return {name: value for (name, value) in identity.items() if value}
+
+
+def get_identity_params(
+    api_key: typing.Optional[str] = None,
+    tool: typing.Optional[str] = None,
+    email: typing.Optional[str] = None,
+) -> typing.Tuple[typing.Optional[str], ...]:
+    """Builds the identity URL parameters for an E-utilities request.
+    Any values left as None are filled in from the configured identity.
+
+    :returns: A tuple of formatted `api_key`, `tool` and `email` URL params; None for the missing ones.
+    """
+    identity = get_identity(api_key=api_key, tool=tool, email=email)
+    return tuple(
+        f"{name}={quote_plus(identity[name])}" if name in identity else None
+        for name in ("api_key", "tool", "email")
+    )
+
+
+def get_rate_limiter() -> TokenBucket:
+    """Returns the rate limiter all of the E-utilities requests go through, building it on first use."""
+    global _limiter
+
+    if _limiter is None:
+        with _session_lock:
+            if _limiter is None:
+                _limiter = build_eutils_limiter(
+                    api_key=_identity_options["api_key"],
+                    rate=_identity_options["rate_limit"],
+                    burst=_identity_options["burst"],
+                    lock_dir=_identity_options["lock_dir"],
+                )
+
+    return _limiter
+
+
+class RequestTimer:
+    """Total time the requests made within a timed_requests() block took, from sending them
+    to reading the last byte of the response. The waits for the rate limiter are left out.
+    """
+
+    def __init__(self):
+        self.elapsed = 0.0
+        self.requests = 0
+
+
+@contextlib.contextmanager
+def timed_requests() -> typing.Iterator[RequestTimer]:
+    """Times the requests the current thread makes within the block, e.g. for tuning the page size.
+
+    Only the time on the wire counts, so threads queueing up for the shared rate limiter
+    do not make the remote look any slower than it is.
+    """
+    timer = RequestTimer()
+    outer = getattr(_request_timing, "timer", None)
+    _request_timing.timer = timer
+
+    try:
+        yield timer
+
+    finally:
+        _request_timing.timer = outer
+        if outer is not None:
+            outer.elapsed += timer.elapsed
+            outer.requests += timer.requests
+
+
+def _record_request(started_at: float):
+    timer = getattr(_request_timing, "timer", None)
+    if timer is not None:
+        timer.elapsed += time.monotonic() - started_at
+        timer.requests += 1
+
+
+def _retry_delay(attempt: int, response: typing.Optional[requests.Response] = None) -> float:
+    """Time to wait before retrying a failed request, in seconds; honors the Retry-After header of a response."""
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.strip().isdigit():
+        return float(retry_after)
+    return _session_options["backoff"] * (2 ** attempt)
+
+
+def _send(
+    method: str,
+    url: str,
+    data: typing.Optional[typing.Mapping] = None,
+    timeout: typing.Optional[float] = None,
+    stream: bool = False,
+) -> typing.Tuple[requests.Response, float]:
+    """Runs a request over the shared session, retrying on connection errors, timeouts and the retryable statuses.
+
+    Every attempt, the retries included, waits for the shared rate limiter to let it through -
+    retrying a 429 straight away would only dig the hole deeper.
+
+    :returns: A tuple of (the successful response, the time its attempt started, as time.monotonic()).
+    :raises requests.HTTPError: if the response still has an error status once the retries are used up.
+    """
+    read_timeout = _session_options["timeout"] if timeout is None else timeout
+    retries = max(int(_session_options["retries"] or 0), 0)
+    session = get_session()
+
+    for attempt in range(retries + 1):
+        get_rate_limiter().acquire()
+        started_at = time.monotonic()
+
+        try:
+            response = session.request(
+                method,
+                url,
+                data=data,
+                stream=stream,
+                timeout=(_session_options["connect_timeout"], read_timeout)
+            )
+
+        except (requests.ConnectionError, requests.Timeout) as ReqErr:
+            _record_request(started_at)
+            if attempt >= retries:
+                logger.error(f"Request to {url} failed: {ReqErr}")
+                raise
+
+            delay = _retry_delay(attempt)
+            logger.warning(f"Request to {url} failed: {ReqErr}; retrying in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+
+        except requests.RequestException as ReqErr:
+            _record_request(started_at)
+            logger.error(f"Request to {url} failed: {ReqErr}")
+            raise
+
+        if response.status_code in const.HTTP_RETRY_STATUSES and attempt < retries:
+            _record_request(started_at)
+            delay = _retry_delay(attempt, response)
+            response.close()
+            logger.warning(f"Request to {url} returned {response.status_code}; retrying in {delay:.1f}s.")
+            time.sleep(delay)
+            continue
+
+        try:
+            response.raise_for_status()
+
+        except requests.HTTPError as HttpErr:
+            _record_request(started_at)
+            response.close()
+            logger.error(f"Request to {url} failed: {HttpErr}")
+            raise
+
+        return response, started_at
+
+
+def http_get(url: str, timeout: typing.Optional[float] = None) -> str:
+    """Runs a GET request against a specified URL over the shared session.
+    Blocks until the shared rate limiter lets the request through.
+
+    :param url: URL to query.
+    :param timeout: Optional; overrides the configured read timeout, in seconds.
+
+    :returns: remote response, as raw string text.
+    :raises requests.RequestException: if the request fails, or the remote responds with an error status.
+    """
+    response, started_at = _send("GET", url, timeout=timeout)
+
+    try:
+        return response.text
+
+    finally:
+        _record_request(started_at)
+
+
+def http_post(url: str, data: typing.Mapping, timeout: typing.Optional[float] = None) -> str:
+    """Runs a POST request with form-encoded data against a specified URL over the shared session.
+    Blocks until the shared rate limiter lets the request through.
+
+    NCBI recommends POST over GET for requests carrying long lists of UIDs.
+
+    :param url: URL to query.
+    :param data: Form parameters to send in the request body.
+    :param timeout: Optional; overrides the configured read timeout, in seconds.
+
+    :returns: remote response, as raw string text.
+    :raises requests.RequestException: if the request fails, or the remote responds with an error status.
+    """
+    response, started_at = _send("POST", url, data=data, timeout=timeout)
+
+    try:
+        return response.text
+
+    finally:
+        _record_request(started_at)
+
+
+def http_stream(
+    url: str,
+    data: typing.Optional[typing.Mapping] = None,
+    timeout: typing.Optional[float] = None,
+    chunk_size: int = const.DEFAULT_HTTP_CHUNK_SIZE,
+) -> typing.Iterator[bytes]:
+    """Runs a request against a specified URL over the shared session, yielding the response body
+    in chunks as it arrives instead of reading it into memory in full.
+    Sends a POST if `data` is provided, a GET otherwise.
+    Blocks until the shared rate limiter lets the request through.
+
+    Only establishing the response is retried; a body cut off midway raises.
+
+    :param url: URL to query.
+    :param data: Optional; form parameters to POST in the request body.
+    :param timeout: Optional; overrides the configured read timeout, in seconds.
+    :param chunk_size: Optional; max size of the yielded chunks, in bytes.
+    :raises requests.RequestException: if the request fails, or the remote responds with an error status.
+    """
+    method = "POST" if data is not None else "GET"
+    response, started_at = _send(method, url, data=data, timeout=timeout, stream=True)
+
+    try:
+        with response:
+            yield from response.iter_content(chunk_size=chunk_size)
+
+    except requests.RequestException as ReqErr:
+        logger.error(f"Request to {url} failed: {ReqErr}")
+        raise
+
+    finally:
+        _record_request(started_at)
@@ -1,11 +1,23 @@
 import json
-
-import requests
+import typing
 
 import app.constants as const
+from app.core.search.cache import get_response_cache
+from app.core.search.client import http_get, get_identity_params
 from app.utils.decorators import with_print, with_logging
 
 
+class DateFilter(typing.NamedTuple):
+    """An ESearch date range restriction; dates are NCBI-formatted, e.g. '2021/03/31'."""
+    mindate: str
+    maxdate: str
+    datetype: str = const.DEFAULT_INCREMENTAL_DATETYPE
+
+
+def _date_params(date_filter: typing.Optional[DateFilter]) -> dict:
+    return date_filter._asdict() if date_filter else {}
+
+
 @with_logging(pretty=False, disabled=True)
 @with_print(pretty=False, disabled=True)
 def build_query_url(
@@ -13,7 +25,13 @@ def build_query_url(
     database: str = None,
     retstart: int = 1,
     retmax: int = const.DEFAULT_QUERY_INCREMENT,
-    use_history: bool = True
+    use_history: bool = True,
+    api_key: str = None,
+    tool: str = None,
+    email: str = None,
+    mindate: str = None,
+    maxdate: str = None,
+    datetype: str = None,
     ) -> str:
     """Builds a NCBI search query URL based on the provided options:
 
@@ -24,15 +42,27 @@ def build_query_url(
     :param use_history: Controls query caching on the tool side.
                         Included for integration completeness' sake, but you almost certainly should
                         let it stay True if you want to reuse the search results downstream.
+    :param api_key: Optional; NCBI API key. Defaults to the configured one.
+    :param tool: Optional; tool name registered with NCBI. Defaults to the configured one.
+    :param email: Optional; developer contact email registered with NCBI. Defaults to the configured one.
+    :param mindate: Optional; start of the date range to restrict the search to, e.g. '2021/03/31'.
+                    The remote requires it to be paired with `maxdate`.
+    :param maxdate: Optional; end of the date range to restrict the search to.
+    :param datetype: Optional; the date field the range applies to, e.g. 'pdat' (publication date).
 
     :returns: NCBI search query URL, as a string
     """
 
     db_param = f"db={database}" if database else None
     term_param = f"term={term}" if term else None
-    retstart_param = f"retstart={max(1, retstart)}" if retstart else 1
+    retstart_param = f"retstart={max(0, retstart)}" if retstart is not None else None
     retmax_param = f"retmax={retmax}" if retmax else None
     fmt_param = f"retmode=json"
+    api_key_param, tool_param, email_param = get_identity_params(api_key=api_key, tool=tool, email=email)
+    has_date_range = bool(mindate and maxdate)
+    mindate_param = f"mindate={mindate}" if has_date_range else None
+    maxdate_param = f"maxdate={maxdate}" if has_date_range else None
+    datetype_param = f"datetype={datetype}" if has_date_range and datetype else None
     usehistory_param = (
         None if use_history is None
         else "usehistory={use_history}".format(
@@ -47,7 +77,13 @@ def build_query_url(
             usehistory_param,
             fmt_param,
             retstart_param,
-            retmax_param
+            retmax_param,
+            datetype_param,
+            mindate_param,
+            maxdate_param,
+            api_key_param,
+            tool_param,
+            email_param
         ) if p)
     )
 
@@ -67,9 +103,9 @@ def run_query(query_url: str) -> str:
     :param query_url: URL to query.
     :returns: remote response, as raw string text.
     """
-    # Thin wrapper, mostly for decoratability purposes,
-    # since Requests is just way too good like that.
-    result = requests.get(query_url).text
+    # Thin wrapper, mostly for decoratability purposes;
+    # the pooling, timeouts and retries live in the shared client.
+    result = http_get(query_url)
     return result
 
 
@@ -87,17 +123,114 @@ def parse_query_response(qry_response: str) -> dict:
     return search_result
 
 
-def get_query_env(term: str, db=const.DEFAULT_DB_VALUE) -> tuple:
+def get_query_info(term: str, db=const.DEFAULT_DB_VALUE, date_filter: typing.Optional[DateFilter] = None) -> tuple:
     """Builds and executes an ESearch query, retrieving the Webenv and Query Key parameters from the API
-    for use by the paginated queries downstream.
+    for use by the paginated queries downstream, along with the total number of matching records.
 
     :param term: Search term, e.g. 'cancer' or 'yeast[orgn]', as string.
     :param db: Optional. Database to query. Should be a valid Entrez database name, as string.
+    :param date_filter: Optional. Restricts the search to a date range.
+
+    :returns: A tuple of (webenv, query key, result count); the count is None if the remote did not report it.
     """
-    query_url = build_query_url(term=term, database=db, retstart=1, retmax=1)
+    query_url = build_query_url(term=term, database=db, retstart=1, retmax=1, **_date_params(date_filter))
     query_response = run_query(query_url=query_url)
 
     response_dict = parse_query_response(query_response)
     webenv = response_dict.get(const.QUERY_WEBENV_FIELD)
     qkey = response_dict.get(const.QUERY_QRYKEY_FIELD)
+    raw_count = response_dict.get(const.QUERY_COUNT_FIELD)
+    count = int(raw_count) if raw_count is not None else None
+    return webenv, qkey, count
+
+
+def get_query_env(term: str, db=const.DEFAULT_DB_VALUE) -> tuple:
+    """Builds and executes an ESearch query, retrieving the Webenv and Query Key parameters from the API
+    for use by the paginated queries downstream.
+
+    :param term: Search term, e.g. 'cancer' or 'yeast[orgn]', as string.
+    :param db: Optional. Database to query. Should be a valid Entrez database name, as string.
+    """
+    webenv, qkey, _ = get_query_info(term=term, db=db)
     return webenv, qkey
+
+
+def get_uid_page(
+    term: str,
+    db=const.DEFAULT_DB_VALUE,
+    retstart: int = 0,
+    retmax: int = const.ESEARCH_MAX_RETMAX,
+    use_cache: bool = True,
+    date_filter: typing.Optional[DateFilter] = None
+) -> tuple:
+    """Builds and executes a non-History ESearch query, retrieving one page of matching UIDs.
+
+    :param term: Search term, e.g. 'cancer' or 'yeast[orgn]', as string.
+    :param db: Optional. Database to query. Should be a valid Entrez database name, as string.
+    :param retstart: Optional. Offset of the first UID to retrieve (0-based).
+    :param retmax: Optional. Max number of UIDs to retrieve; the remote caps it at 10000.
+    :param use_cache: Optional; if False, skips the search response cache entirely.
+    :param date_filter: Optional. Restricts the search to a date range.
+
+    :returns: A tuple of (list of UIDs, total result count).
+    """
+    _retmax = min(max(retmax, 1), const.ESEARCH_MAX_RETMAX)
+
+    cache = get_response_cache() if use_cache else None
+    cache_key = cache.build_key("esearch", term, db, retstart, _retmax, date_filter) if cache else None
+    query_response = cache.get(cache_key) if cache else None
+    response_dict = parse_query_response(query_response) if query_response else None
+
+    if not response_dict:
+        query_url = build_query_url(
+            term=term,
+            database=db,
+            retstart=retstart,
+            retmax=_retmax,
+            use_history=False,
+            **_date_params(date_filter)
+        )
+        query_response = run_query(query_url=query_url)
+        response_dict = parse_query_response(query_response)
+
+        if cache and response_dict.get(const.QUERY_IDLIST_FIELD):
+            cache.put(cache_key, query_response)
+
+    uids = list(response_dict.get(const.QUERY_IDLIST_FIELD) or [])
+    raw_count = response_dict.get(const.QUERY_COUNT_FIELD)
+    count = int(raw_count) if raw_count is not None else len(uids)
+    return uids, count
+
+
+def iter_uids(
+    term: str,
+    db=const.DEFAULT_DB_VALUE,
+    page_size: int = const.ESEARCH_MAX_RETMAX,
+    use_cache: bool = True,
+    date_filter: typing.Optional[DateFilter] = None
+) -> typing.Iterator[str]:
+    """Lazily harvests the full list of UIDs matching a search, paging ESearch at its max page size.
+
+    :param term: Search term, e.g. 'cancer' or 'yeast[orgn]', as string.
+    :param db: Optional. Database to query. Should be a valid Entrez database name, as string.
+    :param page_size: Optional. Number of UIDs requested per ESearch call; the remote caps it at 10000.
+    :param use_cache: Optional; if False, skips the search response cache entirely.
+    :param date_filter: Optional. Restricts the search to a date range.
+    """
+    retstart = 0
+    count = None
+
+    while count is None or retstart < count:
+        uids, count = get_uid_page(
+            term=term,
+            db=db,
+            retstart=retstart,
+            retmax=page_size,
+            use_cache=use_cache,
+            date_filter=date_filter
+        )
+        if not uids:
+            break
+
+        yield from uids
+        retstart += len(uids)
@@ -1,9 +1,12 @@
 import sys
 import json
+import typing
 
 import requests
 
 import app.constants as const
+from app.core.search.client import http_get, http_post, http_stream, get_identity, get_identity_params
+from app.utils.jsonstream import JsonStreamCursor
 from app.utils.decorators import with_print, with_logging
 
 
@@ -13,17 +16,21 @@ def build_search_url(
     webenv,
     query_key='',
     database=None,
-    retstart=1,
+    retstart=0,
     retmax=const.DEFAULT_SEARCH_INCREMENT,
+    api_key=None,
+    tool=None,
+    email=None,
     ) -> str:
 
     db_param = f"db={database}" if database else None
     version_param = f"version=2.0"
     webenv_param = f"WebEnv={webenv}"
-    retstart_param = f"retstart={retstart}" if retstart else 1
+    retstart_param = f"retstart={max(0, retstart)}" if retstart is not None else None
     retmax_param = f"retmax={retmax}" if retmax else None
     qkey_param = f"query_key={query_key}" if query_key else None
     fmt_param = f"retmode=json"
+    api_key_param, tool_param, email_param = get_identity_params(api_key=api_key, tool=tool, email=email)
 
     sanitized_params = "&".join(
         (p for p in (
@@ -33,7 +40,10 @@ def build_search_url(
             webenv_param,
             fmt_param,
             retstart_param,
-            retmax_param
+            retmax_param,
+            api_key_param,
+            tool_param,
+            email_param
         ) if p)
     )
 
@@ -45,13 +55,71 @@ def build_search_url(
     return req_url
 
 
+def build_summary_post(
+    uids: typing.Iterable[str],
+    database=None,
+    api_key=None,
+    tool=None,
+    email=None,
+    ) -> typing.Tuple[str, dict]:
+    """Builds an ESummary request for an explicit list of UIDs, to be sent as a POST.
+
+    :param uids: UIDs to retrieve the summaries for.
+    :param database: Database to query. Should be a valid Entrez database name, as string.
+    :param api_key: Optional; NCBI API key. Defaults to the configured one.
+    :param tool: Optional; tool name registered with NCBI. Defaults to the configured one.
+    :param email: Optional; developer contact email registered with NCBI. Defaults to the configured one.
+
+    :returns: A tuple of (request URL, form parameters dict)
+    """
+    form_data = {
+        "db": database or const.DEFAULT_DB_VALUE,
+        "version": "2.0",
+        "retmode": "json",
+        "id": ",".join(str(uid) for uid in uids),
+    }
+
+    form_data.update(get_identity(api_key=api_key, tool=tool, email=email))
+
+    return const.BASE_NCBI_SUMMARY_URL, form_data
+
+
 @with_logging(pretty=False, disabled=True)
 @with_print(pretty=True, disabled=True)
 def get_search_results(search_url):
-    result = requests.get(search_url).text
+    result = http_get(search_url)
+    return result
+
+
+@with_logging(pretty=False, disabled=True)
+@with_print(pretty=True, disabled=True)
+def get_summaries_by_id(uids: typing.Iterable[str], database=None):
+    """Retrieves the raw ESummary response for an explicit list of UIDs in a single POST request.
+
+    :param uids: UIDs to retrieve the summaries for.
+    :param database: Database to query. Should be a valid Entrez database name, as string.
+    """
+    summary_url, form_data = build_summary_post(uids=uids, database=database)
+    result = get_search_results_by_post(summary_url, form_data)
     return result
 
 
+@with_logging(pretty=False, disabled=True)
+@with_print(pretty=True, disabled=True)
+def get_search_results_by_post(search_url, form_data):
+    result = http_post(search_url, data=form_data)
+    return result
+
+
+def stream_search_results(search_url, form_data=None) -> typing.Iterator[bytes]:
+    """Streams the raw ESummary response body in chunks, as it arrives.
+
+    :param search_url: ESummary URL to query.
+    :param form_data: Optional; form parameters to POST (see build_summary_post()); GETs the URL otherwise.
+    """
+    return http_stream(search_url, data=form_data)
+
+
 @with_logging(pretty=False, disabled=True)
 @with_print(pretty=True, disabled=True)
 def parse_search_response(qry_response):
@@ -69,3 +137,117 @@ def parse_search_response(qry_response):
         except Exception as E:
             sys.excepthook(*sys.exc_info())
     return uid_data
+
+
+def is_query_env_expired(qry_response) -> bool:
+    """Checks whether an ESummary response reports that the History server session
+    (WebEnv/query_key) it referred to is no longer available.
+
+    :param qry_response: Raw ESummary response, as string.
+    """
+    if not qry_response:
+        return False
+
+    try:
+        doc = json.loads(qry_response)
+    except ValueError:
+        return False
+
+    return _reports_expired_env(doc)
+
+
+def _reports_expired_env(doc) -> bool:
+    if not isinstance(doc, dict):
+        return False
+
+    error_messages = []
+    for error_field in const.SEARCH_ERROR_FIELDS:
+        raw_errors = doc.get(error_field)
+        if isinstance(raw_errors, str):
+            error_messages.append(raw_errors)
+        elif isinstance(raw_errors, (list, tuple)):
+            error_messages.extend(str(err) for err in raw_errors)
+        elif isinstance(raw_errors, dict):
+            error_messages.extend(str(err) for err in raw_errors.values())
+
+    expired = any(
+        marker in message.lower()
+        for message in error_messages
+        for marker in const.QUERY_ENV_EXPIRED_MARKERS
+    )
+    return expired
+
+
+class SearchStreamParser:
+    """Incrementally parses a streamed ESummary JSON response, keeping only the requested summary fields.
+
+    Only one summary record is decoded at a time, so the memory use stays flat regardless of the page size.
+    Any error payloads the remote returns alongside (or instead of) the results are kept in `errors`.
+    """
+
+    def __init__(self, fields: typing.Iterable[str] = const.DEFAULT_SEARCH_FIELDS):
+        """
+        :param fields: Optional; summary fields to keep for each UID.
+        """
+        self.fields = tuple(fields)
+        self.errors = {}
+        # Whether the last parse() got through the whole stream
+        self.complete = False
+
+    def iter_records(self, chunks: typing.Iterable[bytes]) -> typing.Iterator[typing.Tuple[str, dict]]:
+        """Yields (UID, {field: value}) pairs as they are parsed from the stream.
+
+        :param chunks: The raw response body, as an iterable of chunks.
+        """
+        cursor = JsonStreamCursor(chunks)
+
+        for top_key in cursor.iter_object():
+            if top_key != const.SEARCH_RESULT_FIELD:
+                value = cursor.decode_value()
+                if top_key in const.SEARCH_ERROR_FIELDS:
+                    self.errors[top_key] = value
+                continue
+
+            for uid in cursor.iter_object():
+                record = cursor.decode_value()
+                if uid == const.SEARCH_UIDS_FIELD or not isinstance(record, dict):
+                    continue
+                yield uid, {field: record[field] for field in self.fields if field in record}
+
+    def parse(self, chunks: typing.Iterable[bytes]) -> dict:
+        """Parses the whole stream into the same format as parse_search_response(), with only the requested fields.
+
+        Like a buffered request, a stream is either parsed in full or not at all: if the connection breaks
+        off midway, the error is raised; if the response is malformed, no results are returned.
+        The records parsed up to the point of failure are never handed out, so they cannot be cached.
+        """
+        self.complete = False
+        uid_data = {}
+        try:
+            for (uid, record) in self.iter_records(chunks):
+                uid_data[uid] = record
+
+        except requests.RequestException:
+            raise
+
+        except Exception as E:
+            sys.excepthook(*sys.exc_info())
+            return {}
+
+        self.complete = True
+        return uid_data
+
+    def is_query_env_expired(self) -> bool:
+        """Checks whether the parsed stream reported an expired History server session."""
+        return _reports_expired_env(self.errors)
+
+
+def build_compact_response(uid_data: dict) -> str:
+    """Serializes parsed search results back into a minimal ESummary-shaped JSON document,
+    which parse_search_response() can read; used to cache the pruned streamed results.
+
+    :param uid_data: A dictionary of <identifier>: <summary data>.
+    """
+    result = {const.SEARCH_UIDS_FIELD: list(uid_data)}
+    result.update(uid_data)
+    return json.dumps({const.SEARCH_RESULT_FIELD: result}, separators=(",", ":"))
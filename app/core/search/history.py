@@ -0,0 +1,152 @@
+import threading
+import time
+import typing
+
+import app.constants as const
+from app.core.search import esearch
+from app.core.search.cache import normalize_term
+from app.utils.logs import logger
+
+
+class QueryEnv(typing.NamedTuple):
+    """An Entrez History server session for a single search."""
+    webenv: typing.Optional[str]
+    query_key: typing.Optional[str]
+    count: typing.Optional[int] = None
+    created: float = 0.0
+
+
+class QueryEnvManager:
+    """Keeps track of the Entrez History sessions (WebEnv + query_key) per (term, db),
+    so that they can be reused across fetches and re-established once they expire.
+
+    Sessions are refreshed proactively once they are older than `max_age`, and reactively
+    when a request reports the session as expired (see invalidate()).
+    """
+
+    def __init__(
+        self,
+        max_age: typing.Optional[float] = const.DEFAULT_QUERY_ENV_MAX_AGE,
+        clock: typing.Callable[[], float] = time.time,
+    ):
+        """
+        :param max_age: Optional; max age of a session before it is re-established, in seconds.
+                        None means the sessions are only refreshed once reported as expired.
+        :param clock: Optional; overrides the time source.
+        """
+        self.max_age = max_age
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._envs: typing.Dict[tuple, QueryEnv] = {}
+        self._refresh_count = 0
+
+    @staticmethod
+    def _key(term: str, db: typing.Optional[str], date_filter: typing.Optional[esearch.DateFilter] = None) -> tuple:
+        return normalize_term(term), db or const.DEFAULT_DB_VALUE, date_filter
+
+    def _is_stale(self, query_env: QueryEnv) -> bool:
+        if not query_env.webenv:
+            return True
+        if self.max_age is None:
+            return False
+        return (self.clock() - query_env.created) > self.max_age
+
+    def _establish(
+        self,
+        term: str,
+        db: typing.Optional[str],
+        date_filter: typing.Optional[esearch.DateFilter] = None
+    ) -> QueryEnv:
+        webenv, qkey, count = esearch.get_query_info(
+            term=term,
+            db=db or const.DEFAULT_DB_VALUE,
+            date_filter=date_filter
+        )
+        return QueryEnv(webenv=webenv, query_key=qkey, count=count, created=self.clock())
+
+    def get(
+        self,
+        term: str,
+        db=const.DEFAULT_DB_VALUE,
+        date_filter: typing.Optional[esearch.DateFilter] = None
+    ) -> QueryEnv:
+        """Returns a live session for a search, establishing a new one if needed.
+
+        :param term: Query term for the search.
+        :param db: Optional; NCBI database to search.
+        :param date_filter: Optional; date range the search is restricted to.
+        """
+        key = self._key(term, db, date_filter)
+
+        # Holding the lock across the esearch call is deliberate - concurrent page
+        # fetches for the same query should wait for one session, not start several.
+        with self._lock:
+            query_env = self._envs.get(key)
+
+            if query_env is None or self._is_stale(query_env):
+                if query_env is not None:
+                    self._refresh_count += 1
+                    logger.info(f"Re-establishing the search session for {term!r} (db={db})")
+                query_env = self._establish(term, db, date_filter)
+                self._envs[key] = query_env
+
+            return query_env
+
+    def invalidate(
+        self,
+        term: str,
+        db=const.DEFAULT_DB_VALUE,
+        stale_webenv: typing.Optional[str] = None,
+        date_filter: typing.Optional[esearch.DateFilter] = None
+    ) -> None:
+        """Drops the session for a search, so that the next get() re-establishes it.
+
+        :param term: Query term for the search.
+        :param db: Optional; NCBI database to search.
+        :param stale_webenv: Optional; only drop the session if it still uses this WebEnv.
+                             Avoids discarding a session another thread has just refreshed.
+        :param date_filter: Optional; date range the search is restricted to.
+        """
+        key = self._key(term, db, date_filter)
+
+        with self._lock:
+            query_env = self._envs.get(key)
+            if query_env is None:
+                return
+            if stale_webenv is not None and query_env.webenv != stale_webenv:
+                return
+            # Zero out the timestamp rather than dropping it, so get() counts it as a refresh:
+            self._envs[key] = query_env._replace(webenv=None, created=0.0)
+
+    def refresh(
+        self,
+        term: str,
+        db=const.DEFAULT_DB_VALUE,
+        stale_webenv: typing.Optional[str] = None,
+        date_filter: typing.Optional[esearch.DateFilter] = None
+    ) -> QueryEnv:
+        """Invalidates the session for a search and returns a live one."""
+        self.invalidate(term=term, db=db, stale_webenv=stale_webenv, date_filter=date_filter)
+        return self.get(term=term, db=db, date_filter=date_filter)
+
+    @property
+    def refresh_count(self) -> int:
+        """Number of sessions re-established so far."""
+        return self._refresh_count
+
+
+_query_env_manager = None
+_query_env_manager_lock = threading.Lock()
+
+
+def get_query_env_manager() -> QueryEnvManager:
+    """Returns the shared search session manager, building it on first use."""
+    global _query_env_manager
+
+    if _query_env_manager is None:
+        with _query_env_manager_lock:
+            if _query_env_manager is None:
+                _query_env_manager = QueryEnvManager()
+
+    return _query_env_manager
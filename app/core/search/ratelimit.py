@@ -0,0 +1,195 @@
+import os
+import struct
+import tempfile
+import threading
+import time
+import typing
+
+import app.constants as const
+from app.utils.logs import logger
+
+FCNTL_SUPPORT = False
+
+try:
+    import fcntl
+    FCNTL_SUPPORT = True
+
+except ImportError as IEr:
+    FCNTL_SUPPORT = False
+
+# Bucket state as persisted in the lock file: (available tokens, last refill timestamp)
+_STATE_FORMAT = "<dd"
+_STATE_SIZE = struct.calcsize(_STATE_FORMAT)
+
+
+class TokenBucket:
+    """A token-bucket rate limiter.
+
+    Within a process, the bucket is shared between threads. If a `state_path` is provided
+    (and the platform supports `fcntl`), the bucket state lives in that file instead and is
+    guarded by an exclusive file lock, so all processes on the host pointing at the same file
+    draw from one common budget. If the file cannot be opened (e.g. it belongs to another user),
+    the bucket falls back to the in-process state rather than failing the requests.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        capacity: float = 1,
+        state_path: typing.Optional[str] = None,
+        clock: typing.Callable[[], float] = time.time,
+        sleep: typing.Callable[[float], typing.Any] = time.sleep,
+    ):
+        """
+        :param rate: Tokens added per second, i.e. the sustained request rate.
+        :param capacity: Max tokens the bucket can hold, i.e. the max burst size.
+                         Defaults to 1, which spaces the requests out evenly.
+        :param state_path: Optional; path to the file holding the bucket state shared between processes.
+        :param clock: Optional; overrides the time source. Must be comparable between processes.
+        :param sleep: Optional; overrides the sleep function.
+        """
+        if rate <= 0:
+            raise ValueError(f"Rate must be positive, got {rate}")
+
+        self.rate = float(rate)
+        self.capacity = max(float(capacity), 1.0)
+        self.state_path = state_path if FCNTL_SUPPORT else None
+        self.clock = clock
+        self.sleep = sleep
+
+        self._lock = threading.Lock()
+        self._tokens = self.capacity
+        self._timestamp = self.clock()
+
+    def _read_state(self, fd: int) -> typing.Tuple[float, float]:
+        os.lseek(fd, 0, os.SEEK_SET)
+        raw_state = os.read(fd, _STATE_SIZE)
+        if len(raw_state) < _STATE_SIZE:
+            # Fresh file - nobody has drawn from the bucket yet.
+            return self.capacity, self.clock()
+        return struct.unpack(_STATE_FORMAT, raw_state)
+
+    def _write_state(self, fd: int, tokens: float, timestamp: float) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        os.write(fd, struct.pack(_STATE_FORMAT, tokens, timestamp))
+
+    def _draw(self, tokens: float, timestamp: float) -> typing.Tuple[float, float, float]:
+        """Refills the bucket and tries to take a token out of it.
+
+        :returns: A tuple of (new token count, new timestamp, seconds to wait before retrying or 0 on success)
+        """
+        now = self.clock()
+        elapsed = max(now - timestamp, 0.0)
+        available = min(self.capacity, tokens + elapsed * self.rate)
+
+        if available >= 1:
+            return available - 1, now, 0.0
+
+        wait = (1 - available) / self.rate
+        return available, now, wait
+
+    def _try_acquire(self) -> float:
+        with self._lock:
+            if not self.state_path:
+                self._tokens, self._timestamp, wait = self._draw(self._tokens, self._timestamp)
+                return wait
+
+            try:
+                fd = os.open(self.state_path, os.O_RDWR | os.O_CREAT, 0o600)
+
+            except OSError as OSErr:
+                logger.warning(
+                    f"Cannot open the rate limiter state at {self.state_path} ({OSErr}); "
+                    f"limiting the requests of this process only."
+                )
+                self.state_path = None
+                self._tokens, self._timestamp, wait = self._draw(self._tokens, self._timestamp)
+                return wait
+
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                tokens, timestamp = self._read_state(fd)
+                tokens, timestamp, wait = self._draw(tokens, timestamp)
+                self._write_state(fd, tokens, timestamp)
+            finally:
+                # Closing the descriptor releases the flock as well.
+                os.close(fd)
+
+            return wait
+
+    def acquire(self) -> float:
+        """Blocks until a token is available and takes it.
+
+        :returns: Total time spent waiting, in seconds.
+        """
+        waited = 0.0
+        wait = self._try_acquire()
+
+        while wait > 0:
+            self.sleep(wait)
+            waited += wait
+            wait = self._try_acquire()
+
+        return waited
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        return False
+
+
+def get_eutils_rate(api_key: typing.Optional[str] = None) -> float:
+    """Returns the request rate NCBI allows for the E-utilities, in requests per second."""
+    return const.NCBI_RATE_LIMIT_WITH_KEY if api_key else const.NCBI_RATE_LIMIT
+
+
+def _get_user_id() -> str:
+    getuid = getattr(os, "getuid", None)
+    if getuid is not None:
+        return str(getuid())
+
+    import getpass
+    try:
+        return getpass.getuser()
+    except Exception:
+        return "default"
+
+
+def get_bucket_path(api_key: typing.Optional[str] = None, lock_dir: typing.Optional[str] = None) -> str:
+    """Returns the path of the shared bucket state file for a given API key.
+
+    NCBI counts the requests per API key (or per host if there isn't one),
+    so all processes using the same key on this host need to share the file.
+    The file is private to the current user, though - another user's file in a shared
+    temp dir would not be writable, and the state of a foreign one should not be trusted.
+    """
+    import hashlib
+
+    _lock_dir = lock_dir or tempfile.gettempdir()
+    key_id = hashlib.sha1(api_key.encode("utf8")).hexdigest()[:12] if api_key else "anonymous"
+    return os.path.join(_lock_dir, f"{const.APP_NAME}-eutils-{_get_user_id()}-{key_id}.bucket")
+
+
+def build_eutils_limiter(
+    api_key: typing.Optional[str] = None,
+    rate: typing.Optional[float] = None,
+    burst: typing.Optional[float] = None,
+    lock_dir: typing.Optional[str] = None,
+    shared: bool = True,
+) -> TokenBucket:
+    """Builds a rate limiter for the E-utilities calls.
+
+    :param api_key: Optional; NCBI API key, raises the default rate from 3 to 10 requests per second.
+    :param rate: Optional; overrides the allowed request rate.
+    :param burst: Optional; overrides the bucket capacity (1 by default).
+    :param lock_dir: Optional; directory for the state file shared between processes. Temp dir by default.
+    :param shared: If False, the limiter is only shared between the threads of this process.
+    """
+    limiter = TokenBucket(
+        rate=rate or get_eutils_rate(api_key=api_key),
+        capacity=burst or 1,
+        state_path=get_bucket_path(api_key=api_key, lock_dir=lock_dir) if shared else None,
+    )
+    return limiter
@@ -0,0 +1,23 @@
+import typing
+
+import app.constants as const
+from app.parsers.series_matrix import SeriesMatrixParser, SeriesMatrixRow, iter_series_matrix_rows, iter_text_lines
+from app.utils.registry import registry_entry
+
+
+@registry_entry(const.PARSER_SERIES_MATRIX, registry_key=const.DEFAULT_PARSER_REGISTRY_KEY)
+def series_matrix_parser(
+    data: typing.Union[str, typing.Iterable[str]],
+    sink: typing.Optional[typing.Callable[[SeriesMatrixRow], typing.Any]] = None,
+    *args,
+    **kwargs
+) -> typing.Optional[typing.List[SeriesMatrixRow]]:
+    """Parses a series matrix file into rows, passing them to the sink if provided, or returning them otherwise."""
+    if sink is None:
+        return list(iter_series_matrix_rows(data))
+
+    parser = SeriesMatrixParser(sink=sink)
+    for line in (iter_text_lines(data) if isinstance(data, str) else data):
+        parser.feed(line)
+
+    return None
@@ -0,0 +1,147 @@
+import typing
+
+import app.constants as const
+
+# Parser states - where in the file the parser is:
+STATE_PREAMBLE = 'preamble'
+STATE_TABLE = 'table'
+STATE_EPILOGUE = 'epilogue'
+
+# Row sections:
+SECTION_SERIES = 'series'
+SECTION_SAMPLE = 'sample'
+SECTION_METADATA = 'metadata'
+SECTION_TABLE_HEADER = 'table_header'
+SECTION_TABLE = 'table'
+
+
+def parse_exclamation_as_key(
+    data: typing.Iterable[str]
+) -> typing.Tuple[typing.Optional[str], typing.Tuple[str]]:
+
+    key, vals = None, tuple()
+    data_range = data
+
+    data_iter = iter(data)
+    first_itm = next(data_iter, None)
+
+    if first_itm:
+        if first_itm.startswith("!"):
+            key = first_itm[1:]
+            data_range = data[1:]
+
+        elif first_itm.upper() == '"ID_REF"':
+            key = "ID_REF"
+            data_range = data[1:]
+
+    vals = tuple((x.strip('"') for x in data_range))
+
+    return key, vals
+
+
+class SeriesMatrixRow(typing.NamedTuple):
+    """A single parsed line of a series matrix file."""
+    key: typing.Optional[str]
+    values: typing.Tuple[str, ...]
+    section: str
+
+
+class SeriesMatrixParser:
+    """A line-at-a-time state machine parser of GEO series matrix files.
+
+    Goes through the !Series_/!Sample_ preamble, the expression table between the
+    !series_matrix_table_begin/end markers and whatever follows it, passing each parsed row
+    on to the sink as a SeriesMatrixRow as soon as its line comes in. Nothing is kept
+    between the lines, so the memory use does not depend on the size of the file.
+
+    The keys and values are the same as parse_exclamation_as_key() gives: the metadata rows are keyed
+    by the line label without the '!', the table header by 'ID_REF' and the table rows by None.
+    """
+
+    def __init__(self, sink: typing.Callable[[SeriesMatrixRow], typing.Any]):
+        """
+        :param sink: Callable taking in the parsed rows.
+        """
+        self.sink = sink
+        self.state = STATE_PREAMBLE
+        self.lines = 0
+        self.table_rows = 0
+        self._header_pending = False
+
+    def reset(self) -> None:
+        """Goes back to the start of the file, e.g. for a download restarting from scratch."""
+        self.state = STATE_PREAMBLE
+        self.lines = 0
+        self.table_rows = 0
+        self._header_pending = False
+
+    def _metadata_section(self, line: str) -> str:
+        if line.startswith("!Series_"):
+            return SECTION_SERIES
+        if line.startswith("!Sample_"):
+            return SECTION_SAMPLE
+        return SECTION_METADATA
+
+    def feed(self, line: str) -> None:
+        """Parses a single line (with or without its newline)."""
+        if line.endswith("\n"):
+            line = line[:-1]
+
+        if not line:
+            return
+
+        self.lines += 1
+
+        if line.startswith(const.SERIES_MATRIX_TABLE_BEGIN):
+            self.state = STATE_TABLE
+            self._header_pending = True
+            return
+
+        if line.startswith(const.SERIES_MATRIX_TABLE_END):
+            self.state = STATE_EPILOGUE
+            self._header_pending = False
+            return
+
+        key, vals = parse_exclamation_as_key(line.split('\t'))
+
+        if self.state == STATE_TABLE and not line.startswith("!"):
+            section = SECTION_TABLE_HEADER if self._header_pending else SECTION_TABLE
+            self._header_pending = False
+
+            if section == SECTION_TABLE:
+                self.table_rows += 1
+
+        else:
+            section = self._metadata_section(line)
+
+        self.sink(SeriesMatrixRow(key=key, values=vals, section=section))
+
+    __call__ = feed
+
+
+def iter_text_lines(text: str) -> typing.Iterator[str]:
+    """Lazily splits a text into lines, without building the list of all of them."""
+    start = 0
+
+    while True:
+        end = text.find("\n", start)
+        if end < 0:
+            yield text[start:]
+            return
+        yield text[start:end]
+        start = end + 1
+
+
+def iter_series_matrix_rows(lines: typing.Union[str, typing.Iterable[str]]) -> typing.Iterator[SeriesMatrixRow]:
+    """Lazily parses a series matrix file.
+
+    :param lines: The text of the file, or an iterable of its lines, e.g. a text file object
+                  or a decompression stream (see app.utils.gzstream.iter_gzip_lines()).
+    """
+    parsed = []
+    parser = SeriesMatrixParser(sink=parsed.append)
+
+    for line in (iter_text_lines(lines) if isinstance(lines, str) else lines):
+        parser.feed(line)
+        yield from parsed
+        parsed.clear()
@@ -3,7 +3,13 @@ from functools import wraps
 from app.utils.misc import cache
 
 from app.abcs import AbstractProcessingBackend
-from app.constants import DEFAULT_BACKEND_REGISTRY_KEY, BACKEND_LOCAL, BACKEND_SPARK, MAINARG_PROCESSING_BACKEND
+from app.constants import (
+    DEFAULT_BACKEND_REGISTRY_KEY,
+    BACKEND_LOCAL,
+    BACKEND_PROCESS_POOL,
+    BACKEND_SPARK,
+    MAINARG_PROCESSING_BACKEND
+)
 from app.utils.registry import get_registry
 
 
@@ -21,10 +27,12 @@ def get_backend(
     # but far easier to debug in terms of existing ones because there's less indirection and no
     # Fancy Dynamic Loading (TM).
     from app.processing_backends.definitions import local as local_backend
+    from app.processing_backends.definitions import process_pool as process_pool_backend
     from app.processing_backends.definitions import spark as spark_backend
 
     backend_keymap = {
         BACKEND_LOCAL: local_backend.LocalProcessingBackend,
+        BACKEND_PROCESS_POOL: process_pool_backend.ProcessPoolProcessingBackend,
         BACKEND_SPARK: spark_backend.SparkProcessingBackend
     }
 
@@ -1,41 +1,131 @@
-import copy
 import os
+import pickle
+import tempfile
+import weakref
 
 from app.abcs import AbstractProcessingBackend
 from app.parsers import parse_format, infer_format
-
-from app.utils.ftp import fetch_ftp
+from app.parsers.series_matrix import (
+    STATE_PREAMBLE,
+    SeriesMatrixParser,
+    SeriesMatrixRow,
+    iter_series_matrix_rows,
+    parse_exclamation_as_key,
+)
+
+from app.utils.blob_cache import get_blob_cache
+from app.utils.columnar import (
+    ColumnarMatrix,
+    KeyValued,
+    build_columnar,
+    compact_json_default,
+    index_rows,
+    iter_index_rows,
+    json_default,
+)
+from app.utils.ftp import TransferStopped, fetch_ftp, stream_ftp
+from app.utils.ftp_governor import get_ftp_governor
+from app.utils.ftp_pool import get_ftp_pool
 
 import typing
 
 import app.constants as const
 from app.utils.functional import tumap, tufilter
+from app.utils.jsonstream import dump_array, dump_items
 from app.utils.registry import registry_entry
 from app.utils.logs import logger
 
 
-def parse_exclamation_as_key(
-    data: typing.Iterable[str]
-) -> typing.Tuple[typing.Optional[str], typing.Tuple[str]]:
+class ParsedRows(list):
+    """Rows of a series matrix file already split into (key, values) pairs,
+    as produced by parse_exclamation_as_key(). Skips the text-splitting stage of normalize_item().
+    """
+
+
+def _close_spool(storage: typing.IO, path: str) -> None:
+    storage.close()
+    try: os.remove(path)
+    except OSError: pass
+
+
+class SpooledRows:
+    """Rows of a series matrix file split into (key, values) pairs (see ParsedRows), spooled to a temporary file
+    as they come in rather than held in memory.
+
+    Can be iterated over any number of times, each pass reading the rows back from the disk one at a time.
+    The file is removed by release() - or, failing that, once the object is garbage collected.
+    """
+
+    def __init__(self):
+        handle, self.path = tempfile.mkstemp(prefix="geoduck-rows-")
+        self._storage = os.fdopen(handle, "wb")
+        self._finalizer = weakref.finalize(self, _close_spool, self._storage, self.path)
+        self.count = 0
+
+    def append(self, row: KeyValued) -> None:
+        # One pickle per row, so that the pickler does not hold on to the rows it has seen
+        pickle.dump(row, self._storage, protocol=pickle.HIGHEST_PROTOCOL)
+        self.count += 1
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self) -> typing.Iterator[KeyValued]:
+        self._storage.flush()
+        count = self.count
+
+        with open(self.path, "rb") as spooled:
+            for _ in range(count):
+                yield pickle.load(spooled)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.path!r}, count={self.count})"
+
+    def release(self) -> None:
+        """Removes the spooled rows."""
+        self._finalizer()
 
-    key, vals = None, tuple()
-    data_range = data
 
-    data_iter = iter(data)
-    first_itm = next(data_iter, None)
+class RowCollector:
+    """A line sink (see app.utils.ftp.StreamingReader) parsing each line of a series matrix file as it arrives.
 
-    if first_itm:
-        if first_itm.startswith("!"):
-            key = first_itm[1:]
-            data_range = data[1:]
+    The rows go to a SpooledRows on the disk, so the size of the file does not matter.
+    """
+
+    rows_factory = SpooledRows
+
+    def __init__(self):
+        self.rows = self.rows_factory()
+        self.parser = SeriesMatrixParser(sink=self._collect)
+
+    def _collect(self, row: SeriesMatrixRow) -> None:
+        self.rows.append((row.key, row.values))
 
-        elif first_itm.upper() == '"ID_REF"':
-            key = "ID_REF"
-            data_range = data[1:]
+    def __call__(self, line: str) -> None:
+        self.parser.feed(line)
 
-    vals = tuple((x.strip('"') for x in data_range))
+    def reset(self) -> None:
+        release = getattr(self.rows, "release", None)
+        if release is not None:
+            release()
+        self.rows = self.rows_factory()
+        self.parser.reset()
+
+    def result(self) -> typing.Union[SpooledRows, ParsedRows]:
+        return self.rows
+
+
+class MetadataRowCollector(RowCollector):
+    """A RowCollector that stops the transfer once the metadata rows are over and the expression table begins.
+    The metadata rows are few, so they are kept in memory, as ParsedRows.
+    """
 
-    return key, vals
+    rows_factory = ParsedRows
+
+    def __call__(self, line: str) -> None:
+        super().__call__(line)
+        if self.parser.state != STATE_PREAMBLE:
+            raise TransferStopped(line)
 
 
 
@@ -46,13 +136,46 @@ class LocalProcessingBackend(AbstractProcessingBackend):
     """
 
     @classmethod
-    def extract_item(cls, addr: str, fname: str, *args, **kwargs):
+    def extract_item(
+        cls,
+        addr: str,
+        fname: str,
+        streaming: bool = False,
+        metadata_only: bool = False,
+        *args,
+        **kwargs
+    ):
         """The main processing pipeline for a single source URL.
 
         :param addr: Path to the source FTP directory
         :param fname: Filename in the source FTP directory
+        :param streaming: Optional; if True, the file is decompressed and parsed line by line as it downloads,
+                          and the result is the parsed rows (SpooledRows, on the disk) rather than the raw text.
+        :param metadata_only: Optional; if True, only the !Series_/!Sample_ rows are extracted - the transfer
+                              is aborted where the expression table begins. Implies `streaming`.
         """
-        raw_result, ftp_error = fetch_ftp(addr, fname)
+        if streaming or metadata_only:
+            parsed_result, ftp_error = stream_ftp(
+                addr,
+                fname,
+                sink_factory=MetadataRowCollector if metadata_only else RowCollector,
+                pool=get_ftp_pool(),
+                governor=get_ftp_governor(),
+                blob_cache=get_blob_cache(),
+                # Cut short at the expression table, so there is nothing worth caching:
+                spool=not metadata_only
+            )
+            if ftp_error:
+                logger.error(ftp_error)
+            return parsed_result
+
+        raw_result, ftp_error = fetch_ftp(
+            addr,
+            fname,
+            pool=get_ftp_pool(),
+            governor=get_ftp_governor(),
+            blob_cache=get_blob_cache()
+        )
         if ftp_error:
             logger.error(ftp_error)
         parsed_result = parse_format(data=raw_result, dataformat=infer_format(fname)) if raw_result else raw_result
@@ -67,7 +190,11 @@ class LocalProcessingBackend(AbstractProcessingBackend):
         saved = False
 
         with open(_filepath, "w") as dumpfile:
-            json.dump(extracted, dumpfile, indent=4)
+            if isinstance(extracted, SpooledRows):
+                # Written out as they are read back, the same as a ParsedRows list would be
+                dump_array(extracted, dumpfile, indent=4)
+            else:
+                json.dump(extracted, dumpfile, indent=4)
 
         saved = True
         return _filepath if saved else None
@@ -78,94 +205,127 @@ class LocalProcessingBackend(AbstractProcessingBackend):
         cls,
         extracted,
         pad_lengths=True,
+        columnar=False,
+        dtype=const.DEFAULT_COLUMNAR_DTYPE,
+        encode_metadata=False,
+        lazy_padding=False,
         *args,
         **kwargs
-    ) -> typing.Dict[str, typing.Tuple[str]]:
+    ) -> typing.Union[typing.Dict[str, typing.Tuple[str]], ColumnarMatrix]:
+        """Splits the extracted series matrix text into a dict of row key -> tuple of row values.
+
+        :param extracted: The extracted text (or the parsed rows, if it was parsed while streaming).
+        :param pad_lengths: Optional; if True, short rows are padded to the length of the longest one.
+        :param columnar: Optional; if True, returns a ColumnarMatrix (typed NumPy arrays) instead of the dict.
+                         The expression values are stored as numbers, so the text of the table is not kept;
+                         ColumnarMatrix.as_dict() gives an approximation of the dict (see there).
+        :param dtype: Optional; NumPy dtype of the expression values in the columnar representation.
+        :param encode_metadata: Optional; if True, the metadata rows repeating the same values across the samples
+                                are dictionary-encoded into EncodedRows (a unique values table and codes).
+        :param lazy_padding: Optional; if True, the padded rows are PaddedRows broadcasting their first value
+                             rather than tuples (see app.utils.columnar.index_rows()).
+        """
 
-        # Input standardization:
-        data_items = (
-            extracted if isinstance(extracted, typing.Iterable)
-            and not isinstance(extracted, typing.Sequence)
-            else [extracted]
+        if isinstance(extracted, (ParsedRows, SpooledRows)):
+            # Already split into rows while streaming the download:
+            key_valued = (extracted,)
+
+        else:
+            # Input standardization:
+            data_items = (
+                extracted if isinstance(extracted, typing.Iterable)
+                and not isinstance(extracted, typing.Sequence)
+                else [extracted]
+            )
+
+            # Preprocessing pipeline (lazy, unless passed 'reify=True'); the lines are parsed one at a time:
+            safe_data_items = tufilter(None, data_items)
+            key_valued = tumap(
+                lambda itm: ((row.key, row.values) for row in iter_series_matrix_rows(itm)),
+                safe_data_items
+            )
+
+        if columnar:
+            return build_columnar(key_valued, dtype=dtype, encode_metadata=encode_metadata)
+
+        return index_rows(
+            key_valued,
+            pad_lengths=pad_lengths,
+            encode_metadata=encode_metadata,
+            lazy_padding=lazy_padding
         )
 
-        # Preprocessing pipeline (lazy, unless passed 'reify=True'):
-        safe_data_items = tufilter(None, data_items)
-        data_lines = tumap(lambda itm: itm.split("\n"), safe_data_items)
-        nonempty_lines = tufilter(None, data_lines)
-        columns = tumap(lambda l: tumap(lambda x: x.split('\t'), l), nonempty_lines)
-        key_valued = tumap(lambda c: tumap(parse_exclamation_as_key, c), columns)
-
-        # Setting up the bookkeeping:
-        parsed = {}
-        duplicate_keys = {}
-        column_lengths = {}
-        max_row_length = 0
 
-        for series in key_valued:
-            for (key, vals) in series:
-                if not vals or not tufilter(None, vals, reify=True):
-                    continue
-
-                # Reindex duplicate key names:
-                used_key = key
-
-                if key in parsed:
-                    duplicate_count = duplicate_keys.get(key, 1) + 1
-                    duplicate_keys[key] = duplicate_count
-                    used_key = f"{key}-{duplicate_count}"
-
-                parsed[used_key] = vals
-
-                # Track tuple size for padding out short rows later:
-                row_length = len(vals)
-                if row_length > max_row_length:
-                    max_row_length = row_length
+    @classmethod
+    def save_normalized(
+        cls,
+        normalized: str,
+        file: typing.Optional[os.PathLike] = None,
+        compact: bool = False,
+        *args,
+        **kwargs
+    ) -> os.PathLike:
 
-                column_lengths.setdefault(row_length, []).append(used_key)
+        """Write out the results of normalize_item to a file.
+        Columnar results are written as .npz files (see ColumnarMatrix.save()).
 
-        if pad_lengths:
-            # NOTE: there's a case to be made for this being a separate function;
-            #       keeping it in here for now to avoid passing dicts around weirdly.
-            # Pad out rows to uniform length so that we can make columns independent:
-            for curr_row_length, adjusted_keys in column_lengths.items():
-                if curr_row_length == max_row_length:
-                    continue
+        :param compact: Optional; if True, the file is written without indentation, and the dictionary-encoded
+                        and padded rows in their compact forms, e.g. {"values": [...], "codes": [...]}
+                        (see app.utils.columnar.compact_json_default(), and decode_rows() to read them back).
+        """
+        _filepath = file or const.DEFAULT_NORMALIZED_SAVE_FILENAME
 
-                padding_size = (max_row_length - curr_row_length)
+        if isinstance(normalized, ColumnarMatrix):
+            return normalized.save(_filepath)
 
-                for short_key in adjusted_keys:
-                    curr_val = parsed[short_key]
+        saved = False
 
-                    # Rough heuristic - most of the time, the 'paddable' rows
-                    # will just have one value to explode to all columns:
-                    first_val_item = next(iter(curr_val))
+        with open(_filepath, "w") as dumpfile:
+            cls._dump_normalized_items(normalized.items(), dumpfile, compact=compact)
 
-                    # Append as many copies as needed to match the max rowsize:
-                    parsed[short_key] = curr_val + tuple((
-                        copy.deepcopy(first_val_item)
-                        for _ in range(padding_size)
-                    ))
+        saved = True
+        return _filepath if saved else None
 
-        return parsed
+    @staticmethod
+    def _dump_normalized_items(items: typing.Iterable[KeyValued], dumpfile: typing.TextIO, compact: bool) -> None:
+        if compact:
+            dump_items(items, dumpfile, separators=(",", ":"), default=compact_json_default)
+        else:
+            # Lazily padded and encoded rows are only materialized here, as they are written out
+            dump_items(items, dumpfile, indent=4, default=json_default)
 
 
     @classmethod
-    def save_normalized(
+    def normalize_to_file(
         cls,
-        normalized: str,
+        extracted,
         file: typing.Optional[os.PathLike] = None,
+        compact: bool = False,
         *args,
         **kwargs
     ) -> os.PathLike:
+        """normalize_item() and save_normalized() in one go.
+
+        The rows parsed while streaming a download (SpooledRows) are normalized and written out one at a time
+        (see app.utils.columnar.iter_index_rows()), so neither they nor the normalized result are ever held
+        in memory in full. Anything else - and the columnar representation - goes through normalize_item().
+
+        :param compact: Optional; see save_normalized().
+        (See normalize_item() for the other parameters.)
+        """
+        if not isinstance(extracted, SpooledRows) or kwargs.get("columnar"):
+            normalized = cls.normalize_item(extracted, *args, **kwargs)
+            return cls.save_normalized(normalized, file=file, compact=compact)
 
-        """Write out the results of normalize_item to a file."""
         _filepath = file or const.DEFAULT_NORMALIZED_SAVE_FILENAME
-        import json
-        saved = False
+        rows = iter_index_rows(
+            extracted,
+            pad_lengths=kwargs.get("pad_lengths", True),
+            encode_metadata=kwargs.get("encode_metadata", False),
+            lazy_padding=kwargs.get("lazy_padding", False)
+        )
 
         with open(_filepath, "w") as dumpfile:
-            json.dump(normalized, dumpfile, indent=4)
+            cls._dump_normalized_items(rows, dumpfile, compact=compact)
 
-        saved = True
-        return _filepath if saved else None
+        return _filepath
@@ -0,0 +1,136 @@
+import gzip
+import os
+import typing
+
+import app.constants as const
+from app.processing_backends.definitions.local import LocalProcessingBackend, RowCollector
+from app.utils.blob_cache import get_blob_cache
+from app.utils.ftp import LocalCopy, RawReader, fetch_ftp
+from app.utils.ftp_governor import get_ftp_governor
+from app.utils.ftp_pool import get_ftp_pool
+from app.utils.gzstream import iter_gzip_lines
+from app.utils.logs import logger
+from app.utils.process_pool import get_process_pool
+from app.utils.registry import registry_entry
+
+
+class Normalized(typing.NamedTuple):
+    """An extracted item together with its normalized form, computed in a worker process."""
+    extracted: typing.Any
+    normalized: typing.Any
+
+
+def normalize_in_worker(extracted: typing.Any, normalize_options: typing.Mapping) -> typing.Any:
+    """The worker process side of the backend.
+
+    :param extracted: Path to the downloaded file as received (gzipped), or the rows already parsed from it.
+    :param normalize_options: Keyword arguments of normalize_item().
+    """
+    if isinstance(extracted, str):
+        # Decompressed and parsed a block at a time, rather than unpacking the whole text first:
+        collector = RowCollector()
+
+        with open(extracted, "rb") as gzipped:
+            blocks = iter(lambda: gzipped.read(const.DEFAULT_HTTP_CHUNK_SIZE), b"")
+            for line in iter_gzip_lines(blocks):
+                collector(line)
+
+        try:
+            return LocalProcessingBackend.normalize_item(extracted=collector.result(), **normalize_options)
+        finally:
+            collector.result().release()
+
+    return LocalProcessingBackend.normalize_item(extracted=extracted, **normalize_options)
+
+
+@registry_entry(as_key=const.BACKEND_PROCESS_POOL, registry_key=const.DEFAULT_BACKEND_REGISTRY_KEY)
+class ProcessPoolProcessingBackend(LocalProcessingBackend):
+    """The local processing pipeline, with the CPU-bound stages spread over a pool of worker processes.
+
+    The downloads stay in the main process, sharing its FTP connections and caches. The workers get the paths
+    of the files, still compressed on disk; a worker decompresses, parses and normalizes its file, and the result
+    comes back through shared memory (see app.utils.process_pool) - which pays off the most for the columnar
+    representation, whose arrays are not pickled at all.
+
+    The items reach the workers from the threads of the download engine, each waiting on its own item,
+    so the engine runs at least as many threads as there are workers.
+    """
+
+    @classmethod
+    def parallelism(cls) -> int:
+        return get_process_pool().workers
+
+    @classmethod
+    def extract_item(
+        cls,
+        addr: str,
+        fname: str,
+        streaming: bool = False,
+        metadata_only: bool = False,
+        normalize_options: typing.Optional[typing.Mapping] = None,
+        *args,
+        **kwargs
+    ):
+        """Downloads a single item and normalizes it in a worker process.
+
+        :param addr: Path to the source FTP directory
+        :param fname: Filename in the source FTP directory
+        :param streaming: Optional; ignored - the workers always parse the files a block at a time.
+        :param metadata_only: Optional; if True, only the !Series_/!Sample_ rows are extracted, while downloading
+                              (see LocalProcessingBackend.extract_item).
+        :param normalize_options: Optional; keyword arguments of normalize_item(), e.g. columnar=True.
+        """
+        if metadata_only:
+            extracted = super().extract_item(addr=addr, fname=fname, metadata_only=True)
+
+        else:
+            extracted, ftp_error = fetch_ftp(
+                addr,
+                fname,
+                pool=get_ftp_pool(),
+                governor=get_ftp_governor(),
+                blob_cache=get_blob_cache(),
+                reader_factory=RawReader
+            )
+            if ftp_error:
+                logger.error(ftp_error)
+
+        if not extracted:
+            return extracted
+
+        try:
+            worker_input = extracted.path if isinstance(extracted, LocalCopy) else extracted
+            normalized = get_process_pool().run(normalize_in_worker, worker_input, dict(normalize_options or {}))
+
+        except BaseException:
+            if isinstance(extracted, LocalCopy):
+                extracted.release()
+            raise
+
+        # The local copy stays around in case the raw file gets saved (see save_extracted)
+        return Normalized(extracted=extracted, normalized=normalized)
+
+    @classmethod
+    def save_extracted(cls, extracted, file: typing.Optional[os.PathLike] = None, *args, **kwargs) -> os.PathLike:
+        """Write out the results of extract_item to a file."""
+        if isinstance(extracted, Normalized):
+            extracted = extracted.extracted
+
+        if isinstance(extracted, LocalCopy):
+            local_copy = extracted
+            try:
+                with gzip.open(local_copy.path, "rt", encoding="utf8") as textfile:
+                    extracted = textfile.read()
+            finally:
+                local_copy.release()
+
+        return super().save_extracted(extracted, file, *args, **kwargs)
+
+    @classmethod
+    def normalize_item(cls, extracted, *args, **kwargs):
+        """Returns the normalized form computed along with the extraction; normalizes in-process otherwise."""
+        if isinstance(extracted, Normalized):
+            if isinstance(extracted.extracted, LocalCopy):
+                extracted.extracted.release()
+            return extracted.normalized
+        return super().normalize_item(extracted, *args, **kwargs)
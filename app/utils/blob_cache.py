@@ -0,0 +1,164 @@
+import os
+import shutil
+import tempfile
+import threading
+import typing
+
+import app.constants as const
+from app.utils.disk_cache import DiskCache
+from app.utils.logs import logger
+
+BLOB_ENTRY_SUFFIX = ".blob"
+
+
+class BlobCache(DiskCache):
+    """A disk-backed cache of downloaded files, stored as received (i.e. still compressed).
+
+    Entries are addressed by the remote path together with its size and modification time,
+    so a file changed on the server simply maps to a new entry - stale ones are never served,
+    and age out through the LRU eviction once the cache goes over its byte budget.
+    See DiskCache for the storage and eviction; the entries are the raw files rather than JSON documents.
+    """
+
+    entry_suffix = BLOB_ENTRY_SUFFIX
+
+    def __init__(
+        self,
+        cache_dir: typing.Optional[str] = None,
+        max_bytes: typing.Optional[int] = const.DEFAULT_BLOB_CACHE_MAX_BYTES,
+        enabled: bool = True,
+        host: str = const.DEFAULT_FTP_HOST,
+    ):
+        """
+        :param cache_dir: Optional; directory holding the cache entries. Defaults to the app blob cache dir.
+        :param max_bytes: Optional; total size budget of the cache, in bytes. None means unbounded.
+        :param enabled: If False, the cache neither returns nor stores anything.
+        :param host: Optional; the server the files come from; part of the cache keys.
+        """
+        # No TTL - an entry is only ever served for the same size and modification time
+        super().__init__(cache_dir=cache_dir or const.BLOB_CACHE_DIR, max_bytes=max_bytes, enabled=enabled)
+        self.host = host
+        self._counters["bytes_saved"] = 0
+
+    def build_key(self, path: str, size: typing.Optional[int], modify: typing.Optional[str]) -> typing.Optional[str]:
+        """Builds the cache key of a remote file; None if it lacks the facts needed to validate an entry."""
+        if size is None or not modify:
+            return None
+        return self.hash_key(self.host, path, int(size), str(modify))
+
+    def get(self, path: str, size: typing.Optional[int], modify: typing.Optional[str]) -> typing.Optional[str]:
+        """Looks up a remote file in the cache.
+
+        :param path: Absolute path of the file on the server.
+        :param size: Size of the remote file, in bytes.
+        :param modify: Modification time of the remote file, as reported by the server.
+        :returns: Local path to the cached copy, or None on a miss.
+        """
+        key = self.build_key(path, size, modify) if self.enabled else None
+        if key is None:
+            return None
+
+        entry_path = self._entry_path(key)
+
+        try:
+            cached_size = os.path.getsize(entry_path)
+        except OSError:
+            self._count("misses")
+            return None
+
+        if cached_size != size:
+            # A torn or tampered-with entry; not worth keeping
+            self._remove(entry_path)
+            self._count("misses")
+            return None
+
+        # Bump the mtime - it tracks the recency of use for the LRU eviction:
+        try: os.utime(entry_path)
+        except OSError: pass
+
+        with self._lock:
+            self._counters["hits"] += 1
+            self._counters["bytes_saved"] += cached_size
+
+        return entry_path
+
+    def put(
+        self,
+        path: str,
+        size: typing.Optional[int],
+        modify: typing.Optional[str],
+        source: typing.Union[str, typing.BinaryIO],
+    ) -> bool:
+        """Stores a downloaded file in the cache.
+
+        :param path: Absolute path of the file on the server.
+        :param size: Size of the remote file, in bytes.
+        :param modify: Modification time of the remote file, as reported by the server.
+        :param source: The downloaded data, as a local file path or a binary file object (read from the start).
+        :returns: True if the file was stored.
+        """
+        key = self.build_key(path, size, modify) if self.enabled else None
+        if key is None:
+            return False
+
+        entry_path = self._entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+
+            with os.fdopen(fd, "wb") as tmp_file:
+                if isinstance(source, (str, os.PathLike)):
+                    with open(source, "rb") as source_file:
+                        shutil.copyfileobj(source_file, tmp_file)
+                else:
+                    source.flush()
+                    source.seek(0)
+                    shutil.copyfileobj(source, tmp_file)
+
+            if os.path.getsize(tmp_path) != size:
+                os.remove(tmp_path)
+                return False
+
+            os.replace(tmp_path, entry_path)
+
+        except OSError as OSErr:
+            logger.warning(f"Failed to store a download cache entry at {entry_path}: {OSErr}")
+            return False
+
+        self._count("stores")
+        self._track_size(size)
+        return True
+
+
+_blob_cache = None
+_blob_cache_lock = threading.Lock()
+
+
+def configure_blob_cache(
+    cache_dir: typing.Optional[str] = None,
+    max_bytes: typing.Optional[int] = const.DEFAULT_BLOB_CACHE_MAX_BYTES,
+    enabled: bool = True,
+    host: str = const.DEFAULT_FTP_HOST,
+) -> BlobCache:
+    """Replaces the shared download cache with one using the provided options.
+    See BlobCache for the meaning of the parameters.
+    """
+    global _blob_cache
+
+    with _blob_cache_lock:
+        _blob_cache = BlobCache(cache_dir=cache_dir, max_bytes=max_bytes, enabled=enabled, host=host)
+        return _blob_cache
+
+
+def get_blob_cache() -> BlobCache:
+    """Returns the shared download cache, building a default one on first use."""
+    global _blob_cache
+
+    if _blob_cache is None:
+        with _blob_cache_lock:
+            if _blob_cache is None:
+                _blob_cache = BlobCache()
+
+    return _blob_cache
@@ -0,0 +1,624 @@
+import array
+import collections.abc
+import json
+import os
+import typing
+
+import app.constants as const
+from app.utils.functional import tufilter
+from app.utils.logs import logger
+
+NUMPY_SUPPORT = False
+
+try:
+    import numpy as np
+    NUMPY_SUPPORT = True
+
+except ImportError as IEr:
+    NUMPY_SUPPORT = False
+
+# A parsed line of a series matrix file, as produced by parse_exclamation_as_key()
+KeyValued = typing.Tuple[typing.Optional[str], typing.Tuple[str, ...]]
+
+
+class PaddedRow(collections.abc.Sequence):
+    """A row padded out to `length` by broadcasting its first value, without storing the padding.
+
+    Behaves as (and compares equal to) the tuple it stands for; the padding cells are all the same
+    (immutable) object, and the tuple is only built when asked for, through materialize().
+    """
+
+    __slots__ = ("values", "length")
+
+    def __init__(self, values: typing.Tuple[str, ...], length: int):
+        """
+        :param values: The row as parsed; its first value is the padding.
+        :param length: The padded length, at least that of the values.
+        """
+        self.values = values
+        self.length = max(length, len(values))
+
+    @property
+    def fill(self) -> str:
+        return self.values[0]
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self[idx] for idx in range(*index.indices(self.length)))
+
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError("PaddedRow index out of range")
+
+        return self.values[index] if index < len(self.values) else self.fill
+
+    def __iter__(self) -> typing.Iterator[str]:
+        yield from self.values
+        for _ in range(self.length - len(self.values)):
+            yield self.fill
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, PaddedRow):
+            return self.length == other.length and tuple(self) == tuple(other)
+        if isinstance(other, tuple):
+            return self.length == len(other) and tuple(self) == other
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.materialize())
+
+    def __add__(self, other: tuple) -> tuple:
+        return self.materialize() + tuple(other)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.values!r}, length={self.length})"
+
+    def materialize(self) -> typing.Tuple[str, ...]:
+        """Returns the padded row as a plain tuple."""
+        return self.values + (self.fill,) * (self.length - len(self.values))
+
+
+class EncodedRow(collections.abc.Sequence):
+    """A dictionary-encoded row: each distinct value is stored once, and the cells are small integer codes
+    indexing them. Meant for the metadata rows that repeat the same few values for every sample
+    (platform, organism, submission date...).
+
+    Behaves as (and compares equal to) the tuple it stands for; decode() builds that tuple.
+    """
+
+    __slots__ = ("values", "codes")
+
+    def __init__(self, values: typing.Tuple[str, ...], codes: typing.Sequence[int]):
+        """
+        :param values: The distinct values of the row, in the order of their first appearance.
+        :param codes: For each cell, the index of its value.
+        """
+        self.values = tuple(values)
+        self.codes = array.array(_code_typecode(len(self.values)), codes)
+
+    @classmethod
+    def encode(cls, row: typing.Iterable[str]) -> "EncodedRow":
+        """Dictionary-encodes a row."""
+        index = {}
+        codes = [index.setdefault(val, len(index)) for val in row]
+        return cls(values=tuple(index), codes=codes)
+
+    def __len__(self) -> int:
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return tuple(self.values[code] for code in self.codes[index])
+        return self.values[self.codes[index]]
+
+    def __iter__(self) -> typing.Iterator[str]:
+        values = self.values
+        for code in self.codes:
+            yield values[code]
+
+    def __eq__(self, other) -> bool:
+        if isinstance(other, EncodedRow):
+            return self.decode() == other.decode()
+        if isinstance(other, (tuple, PaddedRow)):
+            return len(self) == len(other) and self.decode() == tuple(other)
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.decode())
+
+    def __add__(self, other: tuple) -> tuple:
+        return self.decode() + tuple(other)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.values!r}, codes={self.codes.tolist()!r})"
+
+    def decode(self) -> typing.Tuple[str, ...]:
+        """Returns the row as a plain tuple."""
+        return tuple(self)
+
+    def to_json(self) -> dict:
+        """The compact JSON form of the row, {"values": [...], "codes": [...]}."""
+        return dict(values=list(self.values), codes=self.codes.tolist())
+
+    @classmethod
+    def from_json(cls, data: typing.Mapping) -> "EncodedRow":
+        """Reads a row back from its compact JSON form."""
+        return cls(values=data["values"], codes=data["codes"])
+
+
+def _code_typecode(value_count: int) -> str:
+    # The narrowest unsigned array type that can index all the values:
+    if value_count <= 0xFF:
+        return "B"
+    if value_count <= 0xFFFF:
+        return "H"
+    return "L"
+
+
+def encode_row(
+    row: typing.Sequence[str],
+    max_distinct_ratio: float = const.DEFAULT_ENCODING_MAX_DISTINCT_RATIO,
+) -> typing.Sequence[str]:
+    """Dictionary-encodes a row, if it repeats its values enough to be worth it.
+
+    :param row: The row to encode.
+    :param max_distinct_ratio: Optional; rows with a larger share of distinct values are returned as they are.
+    """
+    if isinstance(row, (EncodedRow, PaddedRow)) or len(row) < 2:
+        return row
+
+    distinct = len(set(row))
+    if distinct > max_distinct_ratio * len(row):
+        return row
+
+    return EncodedRow.encode(row)
+
+
+def materialize_rows(parsed: typing.Mapping[str, typing.Sequence[str]]) -> typing.Dict[str, typing.Tuple[str]]:
+    """Returns a copy of a dict-of-tuples normalized result with any PaddedRows and EncodedRows
+    turned into plain tuples.
+    """
+    return {
+        key: (
+            vals.materialize() if isinstance(vals, PaddedRow)
+            else vals.decode() if isinstance(vals, EncodedRow)
+            else vals
+        )
+        for (key, vals) in parsed.items()
+    }
+
+
+def row_from_json(data: typing.Any) -> typing.Sequence[str]:
+    """Reads a row back from its JSON form - a plain list, or one of the compact forms of compact_json_default()."""
+    if not isinstance(data, collections.abc.Mapping):
+        return tuple(data)
+
+    row = EncodedRow.from_json(data) if "codes" in data else tuple(data["values"])
+    return PaddedRow(row, length=data["length"]) if "length" in data else row
+
+
+def decode_rows(parsed: typing.Mapping[str, typing.Any]) -> typing.Dict[str, typing.Tuple[str]]:
+    """Decodes a normalized result into plain tuples, including one read back from a compact JSON file
+    (see compact_json_default()).
+    """
+    return materialize_rows({
+        key: (
+            row_from_json(vals) if isinstance(vals, (collections.abc.Mapping, list))
+            else vals
+        )
+        for (key, vals) in parsed.items()
+    })
+
+
+def json_default(obj: typing.Any) -> typing.Any:
+    """A `default` hook for json.dump(), writing PaddedRows and EncodedRows out as lists."""
+    if isinstance(obj, (PaddedRow, EncodedRow)):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def compact_json_default(obj: typing.Any) -> typing.Any:
+    """A `default` hook for json.dump(), writing the rows out without repeating their values:
+    EncodedRows as {"values": [...], "codes": [...]} (see EncodedRow.to_json()), and PaddedRows
+    as their unpadded values plus the padded length, {"values": [...], "length": n} - or,
+    for a padded EncodedRow, {"values": [...], "codes": [...], "length": n}.
+    Read back by row_from_json().
+    """
+    if isinstance(obj, PaddedRow):
+        unpadded = obj.values
+        data = unpadded.to_json() if isinstance(unpadded, EncodedRow) else dict(values=list(unpadded))
+        data["length"] = len(obj)
+        return data
+    if isinstance(obj, EncodedRow):
+        return obj.to_json()
+    return json_default(obj)
+
+
+def pad_row(row: typing.Sequence[str], length: int) -> typing.Sequence[str]:
+    """Pads a row out to `length` by repeating its first value, eagerly.
+
+    Tuples come out as tuples; EncodedRows stay encoded, with the code of the first value repeated.
+    """
+    padding = length - len(row)
+    if padding <= 0:
+        return row
+
+    if isinstance(row, EncodedRow):
+        codes = row.codes.tolist()
+        return EncodedRow(row.values, codes + codes[:1] * padding)
+
+    row = tuple(row)
+    return row + row[:1] * padding
+
+
+def _index_row(
+    key: typing.Optional[str],
+    vals: typing.Tuple[str, ...],
+    used_keys: typing.Container,
+    duplicate_keys: typing.Dict[str, int],
+    encode_metadata: bool,
+) -> typing.Optional[KeyValued]:
+    # A single row of index_rows(); None if the row is dropped
+    if not vals or not tufilter(None, vals, reify=True):
+        return None
+
+    # Reindex duplicate key names:
+    used_key = key
+
+    if key in used_keys:
+        duplicate_count = duplicate_keys.get(key, 1) + 1
+        duplicate_keys[key] = duplicate_count
+        used_key = f"{key}-{duplicate_count}"
+
+    if encode_metadata and key is not None and key != "ID_REF":
+        vals = encode_row(vals)
+
+    return used_key, vals
+
+
+def index_rows(
+    key_valued: typing.Iterable[typing.Iterable[KeyValued]],
+    pad_lengths: bool = True,
+    encode_metadata: bool = False,
+    lazy_padding: bool = False,
+) -> typing.Dict[str, typing.Tuple[str]]:
+    """Builds the dict-of-tuples normalized representation out of parsed rows.
+
+    Empty rows are dropped, repeated keys are renamed to `key-2`, `key-3`... and (if `pad_lengths`)
+    the short rows are padded to the length of the longest one by repeating their first value.
+
+    :param key_valued: Iterable of series, each an iterable of (key, values) rows.
+    :param pad_lengths: Optional; if False, the rows keep their original lengths.
+    :param encode_metadata: Optional; if True, the metadata rows repeating their values are dictionary-encoded
+                            into EncodedRows (see encode_row()), before any padding.
+    :param lazy_padding: Optional; if True, the padded rows are PaddedRows, which only hold the padding length
+                         rather than the padding itself. They are not tuples - see materialize_rows()
+                         and json_default() for turning them into plain tuples and lists.
+    """
+    # Setting up the bookkeeping:
+    parsed = {}
+    duplicate_keys = {}
+    column_lengths = {}
+    max_row_length = 0
+
+    for series in key_valued:
+        for (key, vals) in series:
+            indexed = _index_row(key, vals, parsed, duplicate_keys, encode_metadata)
+            if indexed is None:
+                continue
+
+            used_key, vals = indexed
+            parsed[used_key] = vals
+
+            # Track tuple size for padding out short rows later:
+            row_length = len(vals)
+            if row_length > max_row_length:
+                max_row_length = row_length
+
+            column_lengths.setdefault(row_length, []).append(used_key)
+
+    if pad_lengths:
+        # Pad out rows to uniform length so that we can make columns independent:
+        for curr_row_length, adjusted_keys in column_lengths.items():
+            if curr_row_length == max_row_length:
+                continue
+
+            for short_key in adjusted_keys:
+                # Rough heuristic - most of the time, the 'paddable' rows
+                # will just have one value to explode to all columns;
+                # the first value is broadcast to match the max rowsize:
+                parsed[short_key] = (
+                    PaddedRow(parsed[short_key], length=max_row_length) if lazy_padding
+                    else pad_row(parsed[short_key], length=max_row_length)
+                )
+
+    return parsed
+
+
+def iter_index_rows(
+    rows: typing.Iterable[KeyValued],
+    pad_lengths: bool = True,
+    encode_metadata: bool = False,
+    lazy_padding: bool = False,
+) -> typing.Iterator[KeyValued]:
+    """index_rows() for a single series too large to hold in memory: yields the (key, values) items
+    of the normalized dict one at a time, in order, instead of building it.
+
+    Takes two passes over the rows - the first one finds the length the short rows are padded to - so `rows`
+    has to be re-iterable (e.g. SpooledRows, reading them back from the disk), not a one-shot iterator.
+    Only the keys of the metadata rows are kept between the rows, so the memory use does not depend
+    on the size of the expression table.
+
+    (See index_rows() for the parameters.)
+    """
+    if iter(rows) is rows:
+        raise TypeError("iter_index_rows() needs to go over the rows twice; got a one-shot iterator")
+
+    max_row_length = 0
+    if pad_lengths:
+        for (key, vals) in rows:
+            if len(vals) > max_row_length and tufilter(None, vals, reify=True):
+                max_row_length = len(vals)
+
+    used_keys = set()
+    duplicate_keys = {}
+
+    for (key, vals) in rows:
+        indexed = _index_row(key, vals, used_keys, duplicate_keys, encode_metadata)
+        if indexed is None:
+            continue
+
+        used_key, vals = indexed
+        # The table rows ('None-2', 'None-3'...) would make up nearly all of the keys,
+        # and only a '!None-2' line could clash with one of them
+        if key is not None or used_key is None:
+            used_keys.add(used_key)
+
+        if len(vals) < max_row_length:
+            vals = (
+                PaddedRow(vals, length=max_row_length) if lazy_padding
+                else pad_row(vals, length=max_row_length)
+            )
+
+        yield used_key, vals
+
+
+class ColumnarMatrix:
+    """The columnar normalized representation of a series matrix file.
+
+    The expression table is held as a (probes x samples) array of floats, with NaN for the missing values,
+    indexed by the `probe_ids` and `sample_ids` string arrays; the !Series_/!Sample_ metadata rows are kept
+    apart, as a dict of tuples (with the repeated keys renamed, as in the dict-of-tuples representation)
+    or of EncodedRows.
+
+    Only the metadata survives as text; the original spelling of the expression values is not kept.
+    """
+
+    def __init__(
+        self,
+        metadata: typing.Dict[str, typing.Tuple[str, ...]],
+        probe_ids: "np.ndarray",
+        sample_ids: "np.ndarray",
+        values: "np.ndarray",
+        id_ref: typing.Optional[str] = "ID_REF",
+    ):
+        """
+        :param metadata: The metadata rows, by key.
+        :param probe_ids: 1D array of the table row IDs.
+        :param sample_ids: 1D array of the table column IDs.
+        :param values: 2D (probes x samples) array of the expression values.
+        :param id_ref: Optional; key of the table header row, None if the table had none.
+        """
+        self.metadata = metadata
+        self.probe_ids = probe_ids
+        self.sample_ids = sample_ids
+        self.values = values
+        self.id_ref = id_ref
+
+    @property
+    def shape(self) -> typing.Tuple[int, int]:
+        """The (probes, samples) shape of the expression table."""
+        return self.values.shape
+
+    @property
+    def nbytes(self) -> int:
+        """Memory taken up by the arrays, in bytes (not counting the metadata)."""
+        return self.values.nbytes + self.probe_ids.nbytes + self.sample_ids.nbytes
+
+    def iter_rows(self) -> typing.Iterator[KeyValued]:
+        """Yields the data back as (key, values) rows, in the order of a series matrix file.
+
+        The expression values are rendered from the stored numbers, so this is lossy: they come out
+        with the precision of the dtype and in NumPy's formatting (e.g. '5' as '5.0', and a float32
+        '9.5246739' as '9.524673'), and every missing or non-numeric value ('NA', '', ...) as 'null'.
+        """
+        yield from self.metadata.items()
+
+        if self.id_ref is not None:
+            yield self.id_ref, tuple(self.sample_ids.tolist())
+
+        for probe_id, row in zip(self.probe_ids.tolist(), self.values):
+            yield None, (probe_id,) + tuple(
+                const.SERIES_MATRIX_NULL if np.isnan(val) else str(val)
+                for val in row
+            )
+
+    def as_dict(self, pad_lengths: bool = True) -> typing.Dict[str, typing.Tuple[str]]:
+        """A dict-of-tuples view of the data, shaped like the result of the non-columnar normalize_item().
+        The metadata rows match it, but the expression values are re-rendered from numbers (see iter_rows()),
+        so they generally differ from the original text. Builds the full view, so it takes as much memory
+        as the non-columnar representation does.
+        """
+        return index_rows((self.iter_rows(),), pad_lengths=pad_lengths)
+
+    def save(self, file: os.PathLike) -> str:
+        """Writes the data out to an .npz file (the extension is added if missing).
+
+        :returns: The path to the written file.
+        """
+        _filepath = os.fspath(file)
+        if not _filepath.endswith(".npz"):
+            _filepath = f"{os.path.splitext(_filepath)[0]}.npz"
+
+        np.savez_compressed(
+            _filepath,
+            values=self.values,
+            probe_ids=self.probe_ids,
+            sample_ids=self.sample_ids,
+            metadata=np.array(json.dumps(
+                dict(metadata=self.metadata, id_ref=self.id_ref),
+                default=compact_json_default
+            )),
+        )
+        return _filepath
+
+    @classmethod
+    def load(cls, file: os.PathLike) -> "ColumnarMatrix":
+        """Reads the data back from an .npz file written by save()."""
+        with np.load(file, allow_pickle=False) as npz:
+            extras = json.loads(str(npz["metadata"]))
+            return cls(
+                metadata={key: row_from_json(vals) for (key, vals) in extras["metadata"].items()},
+                probe_ids=npz["probe_ids"],
+                sample_ids=npz["sample_ids"],
+                values=npz["values"],
+                id_ref=extras["id_ref"],
+            )
+
+
+class ColumnarBuilder:
+    """Assembles a ColumnarMatrix out of parsed series matrix rows, one row at a time.
+
+    Rows keyed None are the expression table (the first value being the probe ID), 'ID_REF' is its header
+    and anything else is metadata. The table values are converted as they come in, so the text of the table
+    is never held in full. Can be used directly as a SeriesMatrixParser sink.
+    """
+
+    def __init__(self, dtype: str = const.DEFAULT_COLUMNAR_DTYPE, encode_metadata: bool = False):
+        """
+        :param dtype: Optional; NumPy dtype of the expression values, e.g. 'float32' or 'float64'.
+        :param encode_metadata: Optional; if True, the metadata rows repeating their values are dictionary-encoded
+                                as they come in (see encode_row()).
+        """
+        if not NUMPY_SUPPORT:
+            raise ImportError("The columnar representation requires NumPy")
+
+        self.dtype = np.dtype(dtype)
+        self.encode_metadata = encode_metadata
+        self.metadata = {}
+        self.sample_ids = None
+        self.id_ref = None
+
+        self._duplicate_keys = {}
+        self._probe_ids = []
+        self._rows = []
+        self._width = None
+        self._misshapen_rows = 0
+
+    def _to_array(self, vals: typing.Sequence[str]) -> "np.ndarray":
+        tokens = ["nan" if val in const.SERIES_MATRIX_NULL_VALUES else val for val in vals]
+
+        try:
+            return np.array(tokens, dtype=self.dtype)
+
+        except ValueError:
+            # Some non-numeric value in there; only that one is lost
+            return np.array([_to_float(token) for token in tokens], dtype=self.dtype)
+
+    def _add_metadata(self, key: str, vals: typing.Tuple[str, ...]) -> None:
+        used_key = key
+
+        if key in self.metadata or (key == self.id_ref):
+            duplicate_count = self._duplicate_keys.get(key, 1) + 1
+            self._duplicate_keys[key] = duplicate_count
+            used_key = f"{key}-{duplicate_count}"
+
+        self.metadata[used_key] = encode_row(vals) if self.encode_metadata else vals
+
+    def _add_table_row(self, vals: typing.Tuple[str, ...]) -> None:
+        if self._width is None:
+            self._width = len(self.sample_ids) if self.sample_ids is not None else len(vals) - 1
+
+        values = self._to_array(vals[1:])
+
+        if len(values) != self._width:
+            # Ragged table; pad with NaN / cut down to the width of the header
+            self._misshapen_rows += 1
+            fitted = np.full(self._width, np.nan, dtype=self.dtype)
+            fitted[:min(len(values), self._width)] = values[:self._width]
+            values = fitted
+
+        self._probe_ids.append(vals[0])
+        self._rows.append(values)
+
+    def add(self, key: typing.Optional[str], vals: typing.Tuple[str, ...]) -> None:
+        """Takes in a single parsed row (see parse_exclamation_as_key())."""
+        if not vals or not tufilter(None, vals, reify=True):
+            return
+
+        if key is None:
+            self._add_table_row(vals)
+
+        elif key == "ID_REF" and self.sample_ids is None and not self._rows:
+            self.id_ref = key
+            self.sample_ids = np.array(vals, dtype=str)
+
+        else:
+            self._add_metadata(key, vals)
+
+    def __call__(self, row: typing.Tuple[typing.Optional[str], typing.Tuple[str, ...], ...]) -> None:
+        """Takes in a single parsed row as a tuple, e.g. a SeriesMatrixRow."""
+        self.add(row[0], row[1])
+
+    def build(self) -> ColumnarMatrix:
+        """Returns the assembled ColumnarMatrix."""
+        width = self._width or (len(self.sample_ids) if self.sample_ids is not None else 0)
+
+        if self._misshapen_rows:
+            logger.warning(f"{self._misshapen_rows} table rows did not match the header width of {width}")
+
+        values = (
+            np.stack(self._rows) if self._rows
+            else np.empty((0, width), dtype=self.dtype)
+        )
+        sample_ids = (
+            self.sample_ids if self.sample_ids is not None
+            else np.array([str(idx) for idx in range(width)], dtype=str)
+        )
+
+        return ColumnarMatrix(
+            metadata=self.metadata,
+            probe_ids=np.array(self._probe_ids, dtype=str),
+            sample_ids=sample_ids,
+            values=values,
+            id_ref=self.id_ref,
+        )
+
+
+def _to_float(token: str) -> float:
+    try: return float(token)
+    except ValueError: return float("nan")
+
+
+def build_columnar(
+    key_valued: typing.Iterable[typing.Iterable[KeyValued]],
+    dtype: str = const.DEFAULT_COLUMNAR_DTYPE,
+    encode_metadata: bool = False,
+) -> ColumnarMatrix:
+    """Builds a ColumnarMatrix out of parsed rows.
+
+    :param key_valued: Iterable of series, each an iterable of (key, values) rows.
+    :param dtype: Optional; NumPy dtype of the expression values.
+    :param encode_metadata: Optional; if True, the metadata rows repeating their values are dictionary-encoded.
+    """
+    builder = ColumnarBuilder(dtype=dtype, encode_metadata=encode_metadata)
+
+    for series in key_valued:
+        for (key, vals) in series:
+            builder.add(key, vals)
+
+    return builder.build()
@@ -0,0 +1,225 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+import typing
+
+from app.utils.logs import logger
+
+CACHE_ENTRY_SUFFIX = ".json"
+
+
+class DiskCache:
+    """A disk-backed TTL + LRU cache of text entries, by (hashed) string keys.
+
+    Each entry is a separate file, written atomically, so several processes can share the directory.
+    Entries expire after `ttl` seconds; once the total size exceeds `max_bytes`, the least recently
+    used entries are evicted.
+    """
+
+    # Subclasses storing their entries in some other format should pick a suffix of their own
+    entry_suffix = CACHE_ENTRY_SUFFIX
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl: typing.Optional[float] = None,
+        max_bytes: typing.Optional[int] = None,
+        enabled: bool = True,
+        bypass: bool = False,
+    ):
+        """
+        :param cache_dir: Directory holding the cache entries.
+        :param ttl: Optional; max age of an entry, in seconds. None means the entries never expire.
+        :param max_bytes: Optional; total size budget of the cache, in bytes. None means unbounded.
+        :param enabled: If False, the cache neither returns nor stores anything.
+        :param bypass: If True, lookups always miss, but fresh entries are still stored.
+        """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.bypass = bypass
+
+        self._lock = threading.Lock()
+        self._counters = dict(hits=0, misses=0, stores=0, expired=0, evictions=0)
+        self._total_bytes = None
+
+    @staticmethod
+    def hash_key(*parts) -> str:
+        """Builds a cache key out of any JSON-serializable parts identifying an entry."""
+        raw_key = json.dumps(list(parts))
+        return hashlib.sha256(raw_key.encode("utf8")).hexdigest()
+
+    def _entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}{self.entry_suffix}")
+
+    def _count(self, counter: str, increment: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += increment
+
+    def _iter_entries(self) -> typing.Iterator[os.DirEntry]:
+        if not os.path.isdir(self.cache_dir):
+            return
+        for subdir in os.scandir(self.cache_dir):
+            if not subdir.is_dir():
+                continue
+            for entry in os.scandir(subdir.path):
+                if entry.name.endswith(self.entry_suffix):
+                    yield entry
+
+    def get(self, key: str) -> typing.Optional[str]:
+        """Retrieves a cached entry.
+
+        :param key: Cache key, e.g. as built by hash_key().
+        :returns: The cached text, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        if self.bypass:
+            self._count("misses")
+            return None
+
+        path = self._entry_path(key)
+
+        try:
+            with open(path, "r", encoding="utf8") as entry_file:
+                entry = json.load(entry_file)
+
+        except (OSError, ValueError):
+            self._count("misses")
+            return None
+
+        created = entry.get("created", 0)
+        if self.ttl is not None and (time.time() - created) > self.ttl:
+            self._count("expired")
+            self._count("misses")
+            self._remove(path)
+            return None
+
+        # Bump the mtime - it tracks the recency of use for the LRU eviction:
+        try: os.utime(path)
+        except OSError: pass
+
+        self._count("hits")
+        return entry.get("body")
+
+    def put(self, key: str, body: str) -> bool:
+        """Stores an entry in the cache.
+
+        :param key: Cache key, e.g. as built by hash_key().
+        :param body: The text to store.
+        :returns: True if the entry was stored.
+        """
+        if not self.enabled or not body:
+            return False
+
+        path = self._entry_path(key)
+        entry_dir = os.path.dirname(path)
+
+        try:
+            os.makedirs(entry_dir, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix=".tmp")
+
+            with os.fdopen(fd, "w", encoding="utf8") as tmp_file:
+                json.dump({"created": time.time(), "body": body}, tmp_file)
+
+            os.replace(tmp_path, path)
+
+        except OSError as OSErr:
+            logger.warning(f"Failed to store a cache entry at {path}: {OSErr}")
+            return False
+
+        self._count("stores")
+        self._track_size(os.path.getsize(path))
+        return True
+
+    def delete(self, key: str) -> bool:
+        """Removes a single entry from the cache.
+
+        :param key: Cache key, e.g. as built by hash_key().
+        :returns: True if there was an entry to remove.
+        """
+        return bool(self._remove(self._entry_path(key)))
+
+    def _remove(self, path: str) -> int:
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+        except OSError:
+            return 0
+
+        with self._lock:
+            if self._total_bytes is not None:
+                self._total_bytes = max(self._total_bytes - size, 0)
+        return size
+
+    def _track_size(self, added_bytes: int) -> None:
+        if self.max_bytes is None:
+            return
+
+        with self._lock:
+            if self._total_bytes is None:
+                # First store in this process - take stock of what is already on disk:
+                self._total_bytes = sum(entry.stat().st_size for entry in self._iter_entries())
+            else:
+                self._total_bytes += added_bytes
+
+            over_budget = self._total_bytes > self.max_bytes
+
+        if over_budget:
+            self.evict()
+
+    def evict(self) -> int:
+        """Removes expired entries, then the least recently used ones until the cache fits its byte budget.
+
+        :returns: The number of entries removed.
+        """
+        now = time.time()
+        entries = []
+
+        for entry in self._iter_entries():
+            try: stat = entry.stat()
+            except OSError: continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        entries.sort()
+        total_bytes = sum(size for (_, size, _) in entries)
+        removed = 0
+
+        for (mtime, size, path) in entries:
+            # NOTE: mtime is bumped on every hit, so this is a conservative expiry check;
+            #       stale entries that are still being hit get caught in get() instead.
+            expired = self.ttl is not None and (now - mtime) > self.ttl
+            over_budget = self.max_bytes is not None and total_bytes > self.max_bytes
+
+            if not (expired or over_budget):
+                continue
+
+            if self._remove(path):
+                total_bytes -= size
+                removed += 1
+
+        with self._lock:
+            self._total_bytes = total_bytes
+            self._counters["evictions"] += removed
+
+        return removed
+
+    def clear(self) -> int:
+        """Removes all the entries from the cache.
+
+        :returns: The number of entries removed.
+        """
+        removed = sum(1 for entry in list(self._iter_entries()) if self._remove(entry.path))
+        with self._lock:
+            self._total_bytes = 0
+        return removed
+
+    def stats(self) -> dict:
+        """Returns the cache counters (hits, misses, stores, expired, evictions), as a dict."""
+        with self._lock:
+            return dict(self._counters)
@@ -1,14 +1,25 @@
 import ftplib
+import io
+import os
+import posixpath
 import tempfile
+import time
 import typing
+import weakref
+import zlib
 
 from smart_open import open
 
 import app.constants as const
+from app.utils.blob_cache import BlobCache
 from app.utils.decorators import with_print, with_logging
+from app.utils.ftp_governor import FtpConcurrencyGovernor
+from app.utils.ftp_listing import FileFacts, get_listing_cache
+from app.utils.ftp_pool import CONNECTION_ERRORS, FtpConnectionPool, TrackingFTP, absolute_ftp_path, get_ftp_pool
+from app.utils.gzstream import GzipLineDecoder
 from app.utils.logs import logger
 
-ftp_client_builder = ftplib.FTP
+ftp_client_builder = TrackingFTP
 FtpClientType = ftplib.FTP
 
 
@@ -27,19 +38,40 @@ def extract_ftp_links(search_result) -> typing.Dict[typing.Hashable, dict]:
 @with_print(pretty=True, disabled=True)
 def build_matrix_ftp_url(raw_ftp_link: str) -> typing.Tuple[str, str]:
     entry_name = raw_ftp_link.rstrip('/').split('/')[-1]
-    protocol_adjusted_link = raw_ftp_link.replace('ftp://ftp.ncbi.nlm.nih.gov/', '', 1)
+    protocol_adjusted_link = raw_ftp_link.replace(const.GEO_FTP_ROOT, '', 1)
     download_ftp_path = ''.join((protocol_adjusted_link, 'matrix/'))
     download_ftp_filename = entry_name
     return download_ftp_path, download_ftp_filename
 
 
+def build_series_ftp_link(accession: str) -> str:
+    """Builds the FTP directory link of a GEO Series from its accession, in the format ESummary reports it,
+    e.g. GSE12345 -> ftp://ftp.ncbi.nlm.nih.gov/geo/series/GSE12nnn/GSE12345/
+
+    :param accession: GEO Series accession, e.g. 'GSE12345'.
+    """
+    accession_number = accession[len(const.GEO_SERIES_PREFIX):]
+    # Series are bucketed into directories by the accession number with the last three digits masked out
+    bucket = f"{const.GEO_SERIES_PREFIX}{accession_number[:-3]}nnn"
+    return f"{const.GEO_FTP_ROOT}geo/series/{bucket}/{accession}/"
+
+
 class FTPReader:
     def __init__(self, fname: typing.Optional[str] = None):
         self.fname = fname
         self.storage = tempfile.NamedTemporaryFile()
+        self.received = 0
+        self.result = None
 
     def ftp_read(self, data: typing.AnyStr) -> typing.NoReturn:
         self.storage.write(data)
+        self.received += len(data)
+
+    def reset(self) -> None:
+        """Drops the data received so far, e.g. to restart a transfer that cannot be resumed."""
+        self.storage.seek(0)
+        self.storage.truncate()
+        self.received = 0
 
     def __call__(self, *args, **kwargs) -> typing.NoReturn:
         self.ftp_read(*args, **kwargs)
@@ -72,46 +104,376 @@ class FTPReader:
 
         return result
 
+    @property
+    def spool(self) -> typing.Optional[typing.IO]:
+        """The received (compressed) data, for storing a copy of it."""
+        return self.storage
+
+    def finish(self) -> typing.AnyStr:
+        """Completes a transfer, returning the decompressed contents."""
+        return self.parse_to_raw_result()
+
+    def load(self, datastream: typing.IO) -> typing.AnyStr:
+        """Decompresses a locally stored copy of the file instead of a transfer."""
+        return self.parse_to_raw_result(datastream=datastream)
+
+
+def _remove_file(path: str) -> None:
+    try: os.remove(path)
+    except OSError: pass
+
+
+class LocalCopy:
+    """A downloaded file stored on the local disk, as received (i.e. still compressed).
+
+    Temporary copies are removed by release() - or, failing that, once the object is garbage collected.
+    """
+
+    def __init__(self, path: str, temporary: bool = False):
+        """
+        :param path: Path to the local file.
+        :param temporary: Optional; if True, the file is owned by this object and removed along with it.
+        """
+        self.path = path
+        self.temporary = temporary
+        self._finalizer = weakref.finalize(self, _remove_file, path) if temporary else None
+
+    def __fspath__(self) -> str:
+        return self.path
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.path!r}, temporary={self.temporary})"
+
+    def open(self) -> typing.BinaryIO:
+        return io.open(self.path, 'rb')
+
+    def release(self) -> None:
+        """Removes the file if it is a temporary one; a no-op otherwise."""
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+class RawReader(FTPReader):
+    """An FTPReader handing over the received data as is (i.e. still compressed), e.g. to be decompressed elsewhere.
+
+    The data is never read into memory; the result is a LocalCopy of the file - the transfer's own temporary file,
+    or the entry of the download cache the file was served from.
+    """
+
+    def __init__(self, fname: typing.Optional[str] = None):
+        self.fname = fname
+        self.storage = tempfile.NamedTemporaryFile(delete=False)
+        # Until finish() hands the file over, it is this reader's to clean up
+        self._finalizer = weakref.finalize(self, _remove_file, self.storage.name)
+        self.received = 0
+        self.result = None
+
+    def finish(self) -> LocalCopy:
+        """Completes a transfer, returning the received file."""
+        self.storage.close()
+        self._finalizer.detach()
+        return LocalCopy(self.storage.name, temporary=True)
+
+    def load(self, datastream: typing.IO) -> LocalCopy:
+        """Hands over a locally stored copy of the file instead of a transfer."""
+        self.storage.close()
+        self._finalizer()
+        return LocalCopy(datastream.name)
+
+
+class TransferStopped(Exception):
+    """Raised by a line sink to end a streamed transfer early, once it has all it needs."""
+
+
+class StreamingReader:
+    """A transfer callback decompressing the data as it arrives and passing it on to a sink line by line,
+    so that neither the compressed nor the decompressed file is ever held in full.
+
+    The sink is a callable taking a line (without the newline). If it also has a reset() method,
+    transfers that cannot be resumed can restart from scratch; if it has a result() method,
+    its return value becomes the result of the transfer. The sink can raise TransferStopped
+    to end the transfer early, e.g. once it has seen the part of the file it was after.
+    """
+
+    def __init__(
+        self,
+        fname: typing.Optional[str] = None,
+        sink: typing.Optional[typing.Callable[[str], typing.Any]] = None,
+        spool: bool = False
+    ):
+        """
+        :param fname: Optional; name of the transferred file, for logging.
+        :param sink: Callable receiving the decompressed lines.
+        :param spool: Optional; if True, the compressed data is also written to a temporary file (see `spool`).
+        """
+        self.fname = fname
+        self.sink = sink
+        self.decoder = GzipLineDecoder()
+        self.storage = tempfile.NamedTemporaryFile() if spool else None
+        self.received = 0
+        self.result = None
+        self.stopped = False
+
+    def _feed(self, data: bytes) -> None:
+        try:
+            for line in self.decoder.feed(data):
+                self.sink(line)
+        except TransferStopped:
+            self.stopped = True
+            raise
+
+    def ftp_read(self, data: bytes) -> typing.NoReturn:
+        if self.storage is not None:
+            self.storage.write(data)
+        self.received += len(data)
+        self._feed(data)
+
+    def __call__(self, *args, **kwargs) -> typing.NoReturn:
+        self.ftp_read(*args, **kwargs)
+
+    def reset(self) -> None:
+        """Drops the data received so far - which requires the sink to be able to forget the lines it got."""
+        if self.received:
+            sink_reset = getattr(self.sink, "reset", None)
+            if sink_reset is None:
+                raise ValueError(f"Cannot restart the streamed transfer of {self.fname}")
+            sink_reset()
+
+        if self.storage is not None:
+            self.storage.seek(0)
+            self.storage.truncate()
+
+        self.decoder = GzipLineDecoder()
+        self.received = 0
+        self.stopped = False
+
+    @property
+    def spool(self) -> typing.Optional[typing.IO]:
+        # A partial copy is no use to anybody
+        return None if self.stopped else self.storage
+
+    def finish(self) -> typing.Any:
+        """Completes a transfer, flushing the last line to the sink and returning the sink's result."""
+        if self.fname:
+            logger.info(f"Processed filename: {self.fname}")
+
+        try:
+            # A stopped transfer ends mid-stream; whatever is left in the decoder is not wanted
+            for line in ([] if self.stopped else self.decoder.flush()):
+                self.sink(line)
+
+        except TransferStopped:
+            self.stopped = True
+
+        except (zlib.error, EOFError) as E:
+            # A corrupt or truncated file
+            logger.exception(E)
+            return None
+
+        finally:
+            if self.storage is not None:
+                self.storage.close()
+
+        sink_result = getattr(self.sink, "result", None)
+        return sink_result() if sink_result is not None else True
+
+    def load(self, datastream: typing.IO) -> typing.Any:
+        """Streams a locally stored copy of the file through the sink instead of a transfer."""
+        try:
+            for block in iter(lambda: datastream.read(const.DEFAULT_HTTP_CHUNK_SIZE), b""):
+                self._feed(block)
+
+        except TransferStopped:
+            pass
+
+        except (zlib.error, EOFError) as E:
+            # A corrupt or truncated file
+            logger.exception(E)
+            return None
+
+        return self.finish()
+
 
 def rebuild_client() -> FtpClientType:
-    client = ftp_client_builder('ftp.ncbi.nlm.nih.gov')
+    client = ftp_client_builder(const.DEFAULT_FTP_HOST)
     client.login()
     return client
 
 
 def ftp_switchcwd(address: str, ftp_client: FtpClientType) -> bool:
-    ftp_client.cwd('/')
-    for subdir in address.split('/'):
-        ftp_client.cwd(subdir)
+    # A single absolute CWD; clients that track their directory skip it entirely if already there
+    ftp_client.cwd(absolute_ftp_path(address))
     return True
 
 
-def ftp_listdir(address, client: typing.Optional[FtpClientType] = None) -> typing.List[typing.Tuple[str, typing.Union[dict, typing.Any]]]:
-    ftp_client = client or rebuild_client()
+def ftp_listdir(
+    address,
+    client: typing.Optional[FtpClientType] = None,
+    pool: typing.Optional[FtpConnectionPool] = None,
+    use_cache: bool = True
+) -> typing.List[typing.Tuple[str, typing.Union[dict, typing.Any]]]:
+    """Lists a remote directory with MLSD.
+
+    :param address: Path to the directory on the FTP server.
+    :param client: Optional; a connection to use. Checked out of the pool otherwise.
+    :param pool: Optional; the connection pool to use if no client is given. Defaults to the shared one.
+    :param use_cache: Optional; if True (default), listings are served from and stored in the listing cache.
+    """
+    listing_cache = get_listing_cache() if use_cache else None
+
+    cached = listing_cache.get(address) if listing_cache else None
+    if cached is not None:
+        return cached
+
+    if client is None:
+        _pool = pool or get_ftp_pool()
+        with _pool.connection() as pooled_client:
+            return ftp_listdir(address=address, client=pooled_client, use_cache=use_cache)
+
     err = None
     results = None
 
     try:
-        ftp_switchcwd(address, ftp_client=ftp_client)
-        results = tuple(ftp_client.mlsd())
+        # Listing by absolute path spares the CWDs into the directory
+        results = tuple(client.mlsd(path=absolute_ftp_path(address)))
 
     except ftplib.error_perm as E:
         err = E
 
-    finally:
-        if not client:
-            # we created one, so we're closing it
-            ftp_client.close()
-
     if err:
         results = [('', err)]
 
+    elif listing_cache:
+        results = listing_cache.put(address, results)
+
     return results
 
 
-def fetch_ftp(address, filename, client=None):
+def ftp_file_facts(
+    address,
+    filename: str,
+    client: typing.Optional[FtpClientType] = None,
+    pool: typing.Optional[FtpConnectionPool] = None,
+) -> typing.List[FileFacts]:
+    """Looks up the MLSD facts (size, modification time, type) of the files in a remote directory
+    whose names contain `filename`, going through the listing cache.
+
+    :param address: Path to the directory on the FTP server.
+    :param filename: (Part of) the name of the file(s) to look up.
+    :param client: Optional; a connection to use on a cache miss. Checked out of the pool otherwise.
+    :param pool: Optional; the connection pool to use if no client is given. Defaults to the shared one.
+    """
+    listing = ftp_listdir(address=address, client=client, pool=pool)
+    return [
+        FileFacts.from_mlsd(name, facts)
+        for (name, facts) in listing
+        if name and filename in name and isinstance(facts, dict)
+    ]
+
+
+class TransferIncomplete(EOFError):
+    """A transfer that ended without delivering the whole file. A retry resumes it where it stopped."""
+
+
+def _transfer(ftp_client: FtpClientType, target_path: str, reader, rest: typing.Optional[int] = None) -> None:
+    """Runs a RETR into the reader. If the reader stops the transfer early (see TransferStopped),
+    the server is told to abort it, so that the connection can be reused.
+    """
+    try:
+        ftp_client.retrbinary(cmd=f'RETR {target_path}', callback=reader.ftp_read, rest=rest)
+
+    except TransferStopped:
+        # The data connection is already closed at this point; the server still has to be told
+        abort_transfer = getattr(ftp_client, "abort_transfer", None)
+
+        if abort_transfer is None or not abort_transfer():
+            # The control connection is in an unknown state; make sure it is not reused
+            raise EOFError(f"Could not cleanly abort the transfer of {target_path}")
+
+        logger.info(f"Stopped the transfer of {target_path} after {reader.received} bytes")
+
+
+def _retrieve(ftp_client: FtpClientType, target_path: str, reader, expected_size: typing.Optional[int]) -> int:
+    """Transfers a remote file into the reader, resuming from the bytes it already holds if possible.
+
+    :returns: The number of bytes transferred.
+    """
+    offset = reader.received
+
+    if offset and (expected_size is None or offset >= expected_size):
+        # Without a size to check the pieces against, a resumed file cannot be trusted
+        logger.info(f"Cannot verify a resume of {target_path} at byte {offset}; restarting it")
+        reader.reset()
+        offset = 0
+
+    if offset:
+        logger.info(f"Resuming {target_path} at byte {offset} of {expected_size}")
+
+    try:
+        # The callback accumulates blocks of data in an IO object here
+        _transfer(ftp_client, target_path=target_path, reader=reader, rest=offset or None)
+
+    except ftplib.error_perm:
+        if not offset:
+            raise
+        # Most likely the server does not support REST; start over from scratch
+        logger.info(f"Resume of {target_path} refused; restarting it")
+        reader.reset()
+        offset = 0
+        _transfer(ftp_client, target_path=target_path, reader=reader)
+
+    if getattr(reader, "stopped", False):
+        # Cut short on purpose; the size check does not apply
+        return reader.received - offset
+
+    if expected_size is not None and reader.received != expected_size:
+        received = reader.received
+        if received > expected_size:
+            # The file changed under us (or the listing is stale) - nothing received so far can be kept
+            reader.reset()
+            get_listing_cache().invalidate(posixpath.dirname(target_path))
+        raise TransferIncomplete(f"Got {received} bytes of {target_path}, expected {expected_size}")
+
+    return reader.received - offset
+
+
+def _complete_facts(ftp_client: FtpClientType, target_path: str, facts: FileFacts) -> FileFacts:
+    """Fills in the size and modification time of a remote file with SIZE/MDTM, if the listing lacked them."""
+    size, modify = facts.size, facts.modify
+
+    try:
+        if size is None:
+            size = ftp_client.size(target_path)
+        if not modify:
+            resp = ftp_client.sendcmd(f'MDTM {target_path}')
+            modify = resp[4:].strip() if resp.startswith('213') else None
+
+    except ftplib.error_perm as E:
+        logger.debug(f"Could not get the size/modification time of {target_path}: {E}")
+
+    return facts._replace(size=size, modify=modify)
+
+
+def _fetch_with_client(
+    address,
+    filename,
+    ftp_client: FtpClientType,
+    readers: typing.Optional[typing.Dict[str, typing.Any]] = None,
+    blob_cache: typing.Optional[BlobCache] = None,
+    reader_factory: typing.Callable[[str], typing.Any] = FTPReader
+) -> typing.Tuple[typing.Any, typing.Any, int]:
+    """A single attempt at fetch_ftp() over a given connection. Connection-level errors are left to the caller.
+
+    :param readers: Optional; the readers of earlier attempts, by filename. Transfers broken off midway
+                    are resumed from where they stopped, the completed ones are not repeated.
+    :param blob_cache: Optional; a cache of earlier downloads, consulted before (and filled after) each transfer.
+    :param reader_factory: Optional; builds the transfer callback of a file from its name (FTPReader by default).
+
+    :returns: A tuple of (decompressed contents, error, number of bytes transferred)
+    """
+    _readers = {} if readers is None else readers
     result, err = None, None
-    ftp_client = client or rebuild_client()
+    nbytes = 0
 
     try:
         file_list = ftp_listdir(address=address, client=ftp_client)
@@ -120,19 +482,45 @@ def fetch_ftp(address, filename, client=None):
             if filename in name:
                 target = name
 
-                reader = FTPReader(address + target)
-
-                try:
-                    # The callback accumulates blocks of data in an IO object here
-                    ftp_client.retrbinary(cmd=f'RETR {target}', callback=reader.ftp_read)
-
-                except ftplib.error_temp:
-                    ftp_client = rebuild_client()
-                    ftp_client.retrbinary(cmd=f'RETR {target}', callback=reader.ftp_read)
-
-                # Since the FTP reads are (sadly) stateful, the
-                # data to parse is smuggled in the state here:
-                result = reader.parse_to_raw_result()
+                target_path = posixpath.join(absolute_ftp_path(address), target)
+                reader = _readers.get(target) or _readers.setdefault(target, reader_factory(address + target))
+
+                facts = FileFacts.from_mlsd(name, metadata)
+                if blob_cache is not None and blob_cache.enabled:
+                    facts = _complete_facts(ftp_client, target_path=target_path, facts=facts)
+
+                cached_path = blob_cache.get(target_path, facts.size, facts.modify) if blob_cache else None
+
+                if reader.result is None and cached_path:
+                    with io.open(cached_path, 'rb') as cached_file:
+                        reader.result = reader.load(cached_file)
+
+                elif reader.result is None and getattr(reader, "stopped", False):
+                    # An earlier attempt already got all it wanted, and only failed to abort the transfer cleanly;
+                    # resuming it would feed the reader the part of the file it stopped before
+                    reader.result = reader.finish()
+
+                elif reader.result is None:
+                    start = reader.received
+                    try:
+                        nbytes += _retrieve(
+                            ftp_client,
+                            target_path=target_path,
+                            reader=reader,
+                            expected_size=facts.size
+                        )
+                    except BaseException:
+                        nbytes += max(reader.received - start, 0)
+                        raise
+
+                    if blob_cache is not None and reader.spool is not None:
+                        blob_cache.put(target_path, facts.size, facts.modify, source=reader.spool)
+
+                    # Since the FTP reads are (sadly) stateful, the
+                    # data to parse is smuggled in the state here:
+                    reader.result = reader.finish()
+
+                result = reader.result
                 if not result:
                     raise ValueError(f"Failed to parse the results for {target}")
 
@@ -142,9 +530,118 @@ def fetch_ftp(address, filename, client=None):
     except ValueError as E:
         err = E
 
-    finally:
-        if not client:
-            # we created one, so we're closing it
-            ftp_client.close()
+    return result, err, nbytes
+
+
+def fetch_ftp(
+    address,
+    filename,
+    client=None,
+    pool: typing.Optional[FtpConnectionPool] = None,
+    governor: typing.Optional[FtpConcurrencyGovernor] = None,
+    retries: int = const.DEFAULT_FTP_TRANSFER_RETRIES,
+    blob_cache: typing.Optional[BlobCache] = None,
+    reader_factory: typing.Callable[[str], typing.Any] = FTPReader,
+):
+    """Downloads and decompresses the files in a remote directory whose names contain `filename`.
+
+    :param address: Path to the directory on the FTP server.
+    :param filename: (Part of) the name of the file to fetch.
+    :param client: Optional; a connection to use. Checked out of the pool otherwise.
+    :param pool: Optional; the connection pool to use if no client is given. Defaults to the shared one.
+    :param governor: Optional; limits the number of parallel transfers, backing off when the server refuses them.
+    :param retries: Optional; number of times a pooled transfer is retried on a fresh connection
+                    after a connection-level error (refusal, timeout, dropped connection).
+    :param blob_cache: Optional; serves unchanged files from earlier downloads instead of transferring them.
+    :param reader_factory: Optional; builds the transfer callback of a file from its name (FTPReader by default).
+
+    :returns: A tuple of (decompressed contents, error)
+    """
+    # Shared by the attempts, so that a retry resumes the transfers where they broke off:
+    readers = {}
+
+    if client is not None:
+        try:
+            result, err, _ = _fetch_with_client(
+                address, filename, ftp_client=client, readers=readers,
+                blob_cache=blob_cache, reader_factory=reader_factory
+            )
+        except ftplib.error_temp:
+            # A one-off connection; logged out and closed (QUIT) once the retry is done
+            with rebuild_client() as fresh_client:
+                result, err, _ = _fetch_with_client(
+                    address, filename, ftp_client=fresh_client, readers=readers,
+                    blob_cache=blob_cache, reader_factory=reader_factory
+                )
+        return result, err
+
+    _pool = pool or get_ftp_pool()
+    failure = None
+
+    for attempt in range(max(retries, 0) + 1):
+        if attempt:
+            time.sleep(const.DEFAULT_FTP_RETRY_BACKOFF * (2 ** (attempt - 1)))
+
+        if governor is not None:
+            governor.acquire()
+
+        nbytes, failure, err = 0, None, None
 
-    return result, err
+        try:
+            # The pool discards connections that raised connection-level errors:
+            with _pool.connection() as ftp_client:
+                result, err, nbytes = _fetch_with_client(
+                    address, filename, ftp_client=ftp_client, readers=readers,
+                    blob_cache=blob_cache, reader_factory=reader_factory
+                )
+            return result, err
+
+        except CONNECTION_ERRORS as E:
+            failure = E
+            logger.warning(f"FTP transfer from {address} failed (attempt {attempt + 1} of {retries + 1}): {E!r}")
+
+        except BaseException as E:
+            failure = E
+            raise
+
+        finally:
+            if governor is not None:
+                # The hard failures (e.g. a missing file) are reported too, so they are not taken for completions
+                governor.release(nbytes=nbytes, error=failure or err)
+
+    return None, failure
+
+
+def stream_ftp(
+    address,
+    filename,
+    sink_factory: typing.Callable[[], typing.Callable[[str], typing.Any]],
+    client=None,
+    pool: typing.Optional[FtpConnectionPool] = None,
+    governor: typing.Optional[FtpConcurrencyGovernor] = None,
+    retries: int = const.DEFAULT_FTP_TRANSFER_RETRIES,
+    blob_cache: typing.Optional[BlobCache] = None,
+    spool: bool = True,
+):
+    """Like fetch_ftp(), but decompresses the files while they are being transferred,
+    feeding the lines to a sink instead of returning the whole decompressed text.
+
+    :param sink_factory: Builds a fresh sink for every file; see StreamingReader for the sink protocol.
+    :param spool: Optional; if False, the transfers are not copied into the blob cache - e.g. because the sink
+                  stops them early, and a partial copy could never be stored. Cached copies are still used.
+    (See fetch_ftp() for the other parameters.)
+
+    :returns: A tuple of (the sink's result, error)
+    """
+    spool = spool and blob_cache is not None and blob_cache.enabled
+
+    return fetch_ftp(
+        address=address,
+        filename=filename,
+        client=client,
+        pool=pool,
+        governor=governor,
+        retries=retries,
+        blob_cache=blob_cache,
+        reader_factory=lambda fname: StreamingReader(fname=fname, sink=sink_factory(), spool=spool),
+    )
@@ -0,0 +1,182 @@
+import ftplib
+import socket
+import threading
+import time
+import typing
+
+import app.constants as const
+from app.utils.ftp_pool import FtpConnectError
+from app.utils.logs import logger
+
+
+class FtpConcurrencyGovernor:
+    """An AIMD (additive increase, multiplicative decrease) limit on the number of FTP transfers in flight.
+
+    The limit grows by one after every 'round' (as many completed transfers as the current limit)
+    whose throughput was not worse than the previous round's, and is cut by `decrease_factor`
+    on every refusal (e.g. '421 Too many connections') or connection timeout. That way the transfers settle
+    around the parallelism the server tolerates, without having to tune it by hand.
+
+    Transfers failing for any other reason (a missing file, a connection dropped midway) neither shrink
+    the limit nor count as completed - they say nothing about the load the server can take.
+    """
+
+    def __init__(
+        self,
+        initial_limit: int = const.DEFAULT_FTP_GOVERNOR_INITIAL_LIMIT,
+        min_limit: int = 1,
+        max_limit: int = const.DEFAULT_FTP_POOL_SIZE,
+        decrease_factor: float = 0.5,
+        tolerance: float = 0.05,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param initial_limit: Optional; number of parallel transfers to start with.
+        :param min_limit: Optional; lower bound of the limit.
+        :param max_limit: Optional; upper bound of the limit, e.g. the size of the connection pool.
+        :param decrease_factor: Optional; multiplicative decrease per refusal or timeout.
+        :param tolerance: Optional; relative throughput drop still counted as 'no worse' between rounds.
+        :param clock: Optional; overrides the time source.
+        """
+        self.min_limit = max(int(min_limit), 1)
+        self.max_limit = max(int(max_limit), self.min_limit)
+        self.decrease_factor = min(max(decrease_factor, 0.0), 1.0)
+        self.tolerance = tolerance
+        self.clock = clock
+
+        self._cond = threading.Condition()
+        self._limit = min(max(int(initial_limit), self.min_limit), self.max_limit)
+        self._in_flight = 0
+
+        self._round_started = None
+        self._round_bytes = 0
+        self._round_completions = 0
+        self._last_rate = None
+
+        self._counters = dict(completed=0, failed=0, refusals=0, timeouts=0, increases=0, decreases=0, bytes=0)
+
+    @property
+    def limit(self) -> int:
+        """The current max number of parallel transfers."""
+        return self._limit
+
+    def acquire(self) -> None:
+        """Blocks until a transfer may start under the current limit."""
+        with self._cond:
+            self._cond.wait_for(lambda: self._in_flight < self._limit)
+            self._in_flight += 1
+
+            if self._round_started is None:
+                self._round_started = self.clock()
+
+    def release(self, nbytes: int = 0, error: typing.Optional[BaseException] = None) -> None:
+        """Reports the outcome of a transfer started with acquire().
+
+        :param nbytes: Optional; number of bytes transferred.
+        :param error: Optional; the error the transfer failed with. Refusals and connection timeouts
+                      shrink the limit (see is_backoff_error()), other errors are only counted.
+        """
+        with self._cond:
+            self._in_flight -= 1
+            self._counters["bytes"] += nbytes
+
+            if error is None:
+                self._counters["completed"] += 1
+                self._round_bytes += nbytes
+                self._round_completions += 1
+
+                if self._round_completions >= self._limit:
+                    self._end_round()
+
+            elif is_backoff_error(error):
+                cause = error.__cause__ if isinstance(error, FtpConnectError) else error
+                is_timeout = isinstance(cause, (socket.timeout, TimeoutError))
+                self._counters["timeouts" if is_timeout else "refusals"] += 1
+                self._decrease(reason=error)
+
+            else:
+                self._counters["failed"] += 1
+
+            self._cond.notify_all()
+
+    def _reset_round(self) -> None:
+        self._round_started = self.clock() if self._in_flight else None
+        self._round_bytes = 0
+        self._round_completions = 0
+
+    def _end_round(self) -> None:
+        elapsed = self.clock() - self._round_started
+        rate = (self._round_bytes / elapsed) if elapsed > 0 else None
+
+        no_worse = rate is not None and (self._last_rate is None or rate >= self._last_rate * (1 - self.tolerance))
+        if no_worse and self._limit < self.max_limit:
+            self._limit += 1
+            self._counters["increases"] += 1
+            logger.debug(f"FTP concurrency limit raised to {self._limit} ({rate:.0f} B/s)")
+
+        if rate is not None:
+            self._last_rate = rate
+        self._reset_round()
+
+    def _decrease(self, reason: BaseException) -> None:
+        new_limit = max(int(self._limit * self.decrease_factor), self.min_limit)
+
+        if new_limit < self._limit:
+            self._counters["decreases"] += 1
+            logger.info(f"FTP concurrency limit lowered to {new_limit} after: {reason}")
+
+        self._limit = new_limit
+        # The throughput measured before the backoff is no baseline for what comes after it:
+        self._last_rate = None
+        self._reset_round()
+
+    def stats(self) -> dict:
+        """Returns the current limit and the governor counters, as a dict."""
+        with self._cond:
+            stats = dict(self._counters)
+            stats["limit"] = self._limit
+            stats["in_flight"] = self._in_flight
+        return stats
+
+
+def is_backoff_error(error: BaseException) -> bool:
+    """True for errors meaning the server is overloaded or refusing us, rather than the request being wrong:
+    the 4xx replies (e.g. '421 Too many connections') and the new connections refused or timing out.
+
+    A transfer cut off midway (see TransferIncomplete) or a read timeout on an established connection
+    are not among them - the server did let us in.
+    """
+    return isinstance(error, (ftplib.error_temp, FtpConnectError))
+
+
+_ftp_governor = None
+_ftp_governor_lock = threading.Lock()
+
+
+def configure_ftp_governor(
+    enabled: bool = True,
+    initial_limit: int = const.DEFAULT_FTP_GOVERNOR_INITIAL_LIMIT,
+    min_limit: int = 1,
+    max_limit: int = const.DEFAULT_FTP_POOL_SIZE,
+    decrease_factor: float = 0.5,
+    tolerance: float = 0.05,
+) -> typing.Optional[FtpConcurrencyGovernor]:
+    """Replaces the shared FTP concurrency governor with one using the provided options
+    (or removes it, if not `enabled`). See FtpConcurrencyGovernor for the meaning of the parameters.
+    """
+    global _ftp_governor
+
+    with _ftp_governor_lock:
+        _ftp_governor = FtpConcurrencyGovernor(
+            initial_limit=initial_limit,
+            min_limit=min_limit,
+            max_limit=max_limit,
+            decrease_factor=decrease_factor,
+            tolerance=tolerance,
+        ) if enabled else None
+        return _ftp_governor
+
+
+def get_ftp_governor() -> typing.Optional[FtpConcurrencyGovernor]:
+    """Returns the shared FTP concurrency governor; None if the transfers are not governed."""
+    return _ftp_governor
@@ -0,0 +1,201 @@
+import collections
+import json
+import threading
+import time
+import typing
+
+import app.constants as const
+from app.utils.disk_cache import DiskCache
+from app.utils.ftp_pool import absolute_ftp_path
+
+# An MLSD listing, as returned by ftplib: (name, {fact: value}) pairs
+Listing = typing.Tuple[typing.Tuple[str, typing.Dict[str, str]], ...]
+
+
+class FileFacts(typing.NamedTuple):
+    """The MLSD facts of a single remote file that the pipeline cares about."""
+    name: str
+    size: typing.Optional[int] = None
+    modify: typing.Optional[str] = None
+    type: typing.Optional[str] = None
+
+    @classmethod
+    def from_mlsd(cls, name: str, facts: typing.Mapping[str, str]) -> "FileFacts":
+        raw_size = facts.get("size")
+        return cls(
+            name=name,
+            size=int(raw_size) if raw_size not in (None, "") else None,
+            modify=facts.get("modify"),
+            type=facts.get("type"),
+        )
+
+
+class ListingCache:
+    """A TTL + LRU cache of FTP directory listings, keyed by the absolute directory path.
+
+    The in-memory layer holds up to `max_entries` directories; the optional persistent layer
+    (a DiskCache) lets the listings outlive the process, e.g. across consecutive runs.
+    """
+
+    def __init__(
+        self,
+        ttl: typing.Optional[float] = const.DEFAULT_FTP_LISTING_TTL,
+        max_entries: typing.Optional[int] = const.DEFAULT_FTP_LISTING_MAX_ENTRIES,
+        persistent: bool = False,
+        cache_dir: typing.Optional[str] = None,
+        enabled: bool = True,
+        host: str = const.DEFAULT_FTP_HOST,
+        clock: typing.Callable[[], float] = time.time,
+    ):
+        """
+        :param ttl: Optional; max age of a listing, in seconds. None means the listings never expire.
+        :param max_entries: Optional; max number of directories kept in memory. None means unbounded.
+        :param persistent: If True, the listings are also stored on disk.
+        :param cache_dir: Optional; directory of the persistent layer. Defaults to the app FTP listing cache dir.
+        :param enabled: If False, the cache neither returns nor stores anything.
+        :param host: Optional; the FTP server listed; part of the persistent cache keys.
+        :param clock: Optional; overrides the time source.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.enabled = enabled
+        self.host = host
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._entries: typing.MutableMapping[str, typing.Tuple[float, Listing]] = collections.OrderedDict()
+        self._counters = dict(hits=0, misses=0, stores=0, evictions=0)
+
+        self._disk = None
+        if persistent and enabled:
+            self._disk = DiskCache(
+                cache_dir=cache_dir or const.FTP_LISTING_CACHE_DIR,
+                ttl=ttl,
+                max_bytes=None,
+            )
+
+    def _count(self, counter: str, increment: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += increment
+
+    def _disk_key(self, path: str) -> str:
+        return DiskCache.hash_key("mlsd", self.host, path)
+
+    def _store_in_memory(self, path: str, created: float, listing: Listing) -> None:
+        with self._lock:
+            self._entries[path] = (created, listing)
+            self._entries.move_to_end(path)
+
+            while self.max_entries is not None and len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._counters["evictions"] += 1
+
+    def get(self, address: str) -> typing.Optional[Listing]:
+        """Retrieves a cached listing.
+
+        :param address: Path to the directory on the FTP server.
+        :returns: The listing, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        path = absolute_ftp_path(address)
+
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                created, listing = entry
+                if self.ttl is None or (self.clock() - created) <= self.ttl:
+                    self._entries.move_to_end(path)
+                    self._counters["hits"] += 1
+                    return listing
+                del self._entries[path]
+
+        if self._disk is not None:
+            body = self._disk.get(self._disk_key(path))
+            if body:
+                listing = tuple((name, dict(facts)) for (name, facts) in json.loads(body))
+                # The disk layer checks the TTL itself; the remaining lifetime restarts in memory
+                self._store_in_memory(path, self.clock(), listing)
+                self._count("hits")
+                return listing
+
+        self._count("misses")
+        return None
+
+    def put(self, address: str, listing: typing.Iterable[typing.Tuple[str, typing.Dict[str, str]]]) -> Listing:
+        """Stores a listing in the cache.
+
+        :param address: Path to the directory on the FTP server.
+        :param listing: MLSD entries of the directory.
+        :returns: The stored listing.
+        """
+        _listing = tuple((name, dict(facts)) for (name, facts) in listing)
+
+        if not self.enabled:
+            return _listing
+
+        path = absolute_ftp_path(address)
+        self._store_in_memory(path, self.clock(), _listing)
+
+        if self._disk is not None:
+            self._disk.put(self._disk_key(path), json.dumps(_listing))
+
+        self._count("stores")
+        return _listing
+
+    def invalidate(self, address: str) -> None:
+        """Drops the cached listing of a directory, e.g. after it turned out to be out of date."""
+        path = absolute_ftp_path(address)
+
+        with self._lock:
+            self._entries.pop(path, None)
+
+        if self._disk is not None:
+            self._disk.delete(self._disk_key(path))
+
+    def stats(self) -> dict:
+        """Returns the cache counters (hits, misses, stores, evictions), as a dict."""
+        with self._lock:
+            return dict(self._counters)
+
+
+_listing_cache = None
+_listing_cache_lock = threading.Lock()
+
+
+def configure_listing_cache(
+    ttl: typing.Optional[float] = const.DEFAULT_FTP_LISTING_TTL,
+    max_entries: typing.Optional[int] = const.DEFAULT_FTP_LISTING_MAX_ENTRIES,
+    persistent: bool = False,
+    cache_dir: typing.Optional[str] = None,
+    enabled: bool = True,
+    host: str = const.DEFAULT_FTP_HOST,
+) -> ListingCache:
+    """Replaces the shared FTP listing cache with one using the provided options.
+    See ListingCache for the meaning of the parameters.
+    """
+    global _listing_cache
+
+    with _listing_cache_lock:
+        _listing_cache = ListingCache(
+            ttl=ttl,
+            max_entries=max_entries,
+            persistent=persistent,
+            cache_dir=cache_dir,
+            enabled=enabled,
+            host=host,
+        )
+        return _listing_cache
+
+
+def get_listing_cache() -> ListingCache:
+    """Returns the shared FTP listing cache, building a default one on first use."""
+    global _listing_cache
+
+    if _listing_cache is None:
+        with _listing_cache_lock:
+            if _listing_cache is None:
+                _listing_cache = ListingCache()
+
+    return _listing_cache
@@ -0,0 +1,355 @@
+import contextlib
+import ftplib
+import posixpath
+import socket
+import threading
+import time
+import typing
+
+import app.constants as const
+from app.utils.logs import logger
+
+# Errors meaning the connection itself is unusable, rather than the request being wrong:
+CONNECTION_ERRORS = (ftplib.error_temp, ftplib.error_reply, EOFError, OSError)
+# Errors of a new connection meaning the server turned it away (or is too busy to answer), rather than it being down:
+CONNECT_REFUSAL_ERRORS = (ConnectionRefusedError, ConnectionResetError, EOFError, socket.timeout, TimeoutError)
+
+
+class FtpConnectError(ConnectionError):
+    """Opening a new connection to the server timed out, or the server refused or dropped it straight away."""
+
+
+def absolute_ftp_path(address: str) -> str:
+    """Normalizes a path on the FTP server to an absolute one, e.g. 'geo/series/' -> '/geo/series'."""
+    return posixpath.normpath(posixpath.join("/", address or ""))
+
+
+class TrackingFTP(ftplib.FTP):
+    """An FTP client that keeps track of its session state to skip redundant commands.
+
+    Remembers the current directory and transfer type, so that CWD and TYPE are only sent when
+    they would change something, and counts the commands sent over the control connection
+    (`round_trips`), each of which costs a full network round-trip.
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.round_trips = 0
+        self.current_dir: typing.Optional[str] = None
+        self.transfer_type: typing.Optional[str] = None
+        super().__init__(*args, **kwargs)
+
+    def putcmd(self, line: str) -> None:
+        self.round_trips += 1
+        super().putcmd(line)
+
+    def _set_type(self, cmd: str, send: typing.Callable[[str], str]) -> str:
+        transfer_type = cmd[5:].strip().upper()
+        if transfer_type == self.transfer_type:
+            return "200 Type unchanged"
+
+        self.transfer_type = None
+        resp = send(cmd)
+        self.transfer_type = transfer_type
+        return resp
+
+    # ftplib switches the type with sendcmd() for text transfers and voidcmd() for binary ones:
+    def sendcmd(self, cmd: str) -> str:
+        if cmd.upper().startswith("TYPE "):
+            return self._set_type(cmd, super().sendcmd)
+        return super().sendcmd(cmd)
+
+    def voidcmd(self, cmd: str) -> str:
+        if cmd.upper().startswith("TYPE "):
+            return self._set_type(cmd, super().voidcmd)
+        return super().voidcmd(cmd)
+
+    def cwd(self, dirname: str) -> str:
+        target = posixpath.normpath(posixpath.join(self.current_dir or "/", dirname or "/"))
+
+        if target == self.current_dir:
+            return "250 Directory unchanged"
+
+        try:
+            resp = super().cwd(target)
+        except ftplib.Error:
+            self.current_dir = None
+            raise
+
+        self.current_dir = target
+        return resp
+
+    def abort_transfer(self, max_responses: int = 4) -> bool:
+        """Aborts a RETR whose data connection the client has already closed, and resynchronizes the control
+        connection, so that it can be reused. Depending on timing, the server answers the RETR with 226 or 426,
+        and the ABOR with 225/226 - a NOOP sent after them marks where the leftover responses end.
+
+        :param max_responses: Optional; max number of responses to skip while looking for the NOOP's.
+        :returns: True if the connection is back in sync.
+        """
+        # Sent as urgent data, like ftplib's own abort():
+        self.round_trips += 1
+        self.sock.sendall(b"ABOR\r\n", socket.MSG_OOB)
+        self.putcmd("NOOP")
+
+        for _ in range(max_responses):
+            resp = self.getmultiline()
+            if resp.startswith("200"):
+                return True
+            if resp[:1] not in ("2", "4", "5"):
+                return False
+
+        return False
+
+    def login(self, *args, **kwargs) -> str:
+        resp = super().login(*args, **kwargs)
+        self.current_dir = None
+        self.transfer_type = None
+        return resp
+
+
+def build_ftp_client(
+    host: str = const.DEFAULT_FTP_HOST,
+    timeout: typing.Optional[float] = const.DEFAULT_FTP_TIMEOUT,
+) -> ftplib.FTP:
+    """Connects and anonymously logs in to an FTP server."""
+    client = TrackingFTP(host, timeout=timeout)
+    client.login()
+    return client
+
+
+def close_quietly(client: ftplib.FTP) -> None:
+    """Closes a connection, politely if possible; the server may well be gone already."""
+    try:
+        client.quit()
+    except Exception:
+        client.close()
+
+
+class FtpConnectionPool:
+    """A thread-safe pool of logged-in FTP connections.
+
+    At most `size` connections are checked out at any time; acquire() blocks until one frees up.
+    Idle connections are closed once they sit unused for over `idle_timeout` seconds (servers
+    drop them on their own after a while anyway) and get a NOOP health check before reuse.
+    """
+
+    def __init__(
+        self,
+        host: str = const.DEFAULT_FTP_HOST,
+        size: int = const.DEFAULT_FTP_POOL_SIZE,
+        idle_timeout: typing.Optional[float] = const.DEFAULT_FTP_IDLE_TIMEOUT,
+        timeout: typing.Optional[float] = const.DEFAULT_FTP_TIMEOUT,
+        health_check_after: typing.Optional[float] = const.DEFAULT_FTP_HEALTH_CHECK_AFTER,
+        client_builder: typing.Optional[typing.Callable[[], ftplib.FTP]] = None,
+        clock: typing.Callable[[], float] = time.monotonic,
+    ):
+        """
+        :param host: Optional; FTP server to connect to.
+        :param size: Optional; max number of simultaneous connections.
+        :param idle_timeout: Optional; max time a connection is kept unused, in seconds. None keeps them forever.
+        :param timeout: Optional; socket timeout of the connections, in seconds.
+        :param health_check_after: Optional; idle time after which a connection is NOOP-checked before reuse,
+                                   in seconds. Connections used more recently are trusted to save a round-trip.
+        :param client_builder: Optional; overrides how new connections are made. Has to return a logged-in client.
+        :param clock: Optional; overrides the time source.
+        """
+        self.host = host
+        self.size = max(int(size), 1)
+        self.idle_timeout = idle_timeout
+        self.timeout = timeout
+        self.health_check_after = health_check_after
+        self.client_builder = client_builder or (lambda: build_ftp_client(host=self.host, timeout=self.timeout))
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.size)
+        self._idle: typing.List[typing.Tuple[ftplib.FTP, float]] = []
+        self._counters = dict(created=0, reused=0, discarded=0, health_check_failures=0, round_trips=0)
+
+    def _count(self, counter: str, increment: int = 1) -> None:
+        with self._lock:
+            self._counters[counter] += increment
+
+    def _tally_round_trips(self, client: ftplib.FTP) -> None:
+        """Adds the commands a connection sent since the last tally to the pool-wide counter."""
+        round_trips = getattr(client, "round_trips", None)
+        if round_trips is None:
+            return
+
+        reported = getattr(client, "_round_trips_tallied", 0)
+        client._round_trips_tallied = round_trips
+        self._count("round_trips", round_trips - reported)
+
+    def _connect(self) -> ftplib.FTP:
+        try:
+            client = self.client_builder()
+        except CONNECT_REFUSAL_ERRORS as E:
+            raise FtpConnectError(f"Could not connect to {self.host}: {E!r}") from E
+
+        self._count("created")
+        return client
+
+    def _is_healthy(self, client: ftplib.FTP) -> bool:
+        try:
+            client.voidcmd("NOOP")
+            return True
+        except CONNECTION_ERRORS + (ftplib.error_perm,):
+            self._count("health_check_failures")
+            return False
+
+    def _pop_idle(self) -> typing.Optional[ftplib.FTP]:
+        """Takes the most recently used idle connection that is still alive, closing any dead ones found."""
+        while True:
+            with self._lock:
+                if not self._idle:
+                    return None
+                client, last_used = self._idle.pop()
+
+            idle_for = self.clock() - last_used
+            if self.idle_timeout is not None and idle_for > self.idle_timeout:
+                self.discard(client)
+                continue
+
+            needs_check = self.health_check_after is None or idle_for > self.health_check_after
+            if needs_check and not self._is_healthy(client):
+                self.discard(client)
+                continue
+
+            self._count("reused")
+            return client
+
+    def acquire(self, timeout: typing.Optional[float] = None) -> ftplib.FTP:
+        """Checks out a connection, reusing an idle one if possible. Blocks while the pool is exhausted.
+
+        Every acquire() has to be paired with a release() (or a reconnect() followed by a release()).
+
+        :param timeout: Optional; max time to wait for a free slot, in seconds. Waits indefinitely by default.
+        """
+        if not self._slots.acquire(timeout=timeout):
+            raise TimeoutError(f"No FTP connection to {self.host} freed up within {timeout}s")
+
+        try:
+            return self._pop_idle() or self._connect()
+        except BaseException:
+            self._slots.release()
+            raise
+
+    def release(self, client: ftplib.FTP, discard: bool = False) -> None:
+        """Returns a checked out connection to the pool.
+
+        :param client: The connection, as returned by acquire().
+        :param discard: If True, the connection is closed instead of kept for reuse, e.g. after an error.
+        """
+        try:
+            if discard:
+                self.discard(client)
+            else:
+                self._tally_round_trips(client)
+                with self._lock:
+                    self._idle.append((client, self.clock()))
+        finally:
+            self._slots.release()
+
+    def discard(self, client: ftplib.FTP) -> None:
+        """Closes a connection for good. Does not free up its slot; that is what release() is for."""
+        self._tally_round_trips(client)
+        self._count("discarded")
+        close_quietly(client)
+
+    def reconnect(self, client: ftplib.FTP) -> ftplib.FTP:
+        """Replaces a broken checked out connection with a fresh one, keeping the slot."""
+        self.discard(client)
+        return self._connect()
+
+    @contextlib.contextmanager
+    def connection(self, timeout: typing.Optional[float] = None) -> typing.Iterator[ftplib.FTP]:
+        """Checks out a connection for the duration of a `with` block.
+        Connections that raised a connection-level error are discarded rather than reused.
+        """
+        client = self.acquire(timeout=timeout)
+        broken = False
+
+        try:
+            yield client
+        except CONNECTION_ERRORS:
+            broken = True
+            raise
+        finally:
+            self.release(client, discard=broken)
+
+    def evict_idle(self) -> int:
+        """Closes the connections that have been idle for too long.
+
+        :returns: The number of connections closed.
+        """
+        if self.idle_timeout is None:
+            return 0
+
+        now = self.clock()
+        with self._lock:
+            expired = [client for (client, last_used) in self._idle if (now - last_used) > self.idle_timeout]
+            self._idle = [(client, last_used) for (client, last_used) in self._idle if client not in expired]
+
+        for client in expired:
+            self.discard(client)
+        return len(expired)
+
+    def close(self) -> None:
+        """Closes all the idle connections. Checked out ones are closed as they get released."""
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for (client, _) in idle:
+            close_quietly(client)
+
+    def stats(self) -> dict:
+        """Returns the pool counters (created, reused, discarded, health_check_failures,
+        round_trips of the released connections), as a dict.
+        """
+        with self._lock:
+            stats = dict(self._counters)
+            stats["idle"] = len(self._idle)
+        return stats
+
+
+_ftp_pool = None
+_ftp_pool_lock = threading.Lock()
+
+
+def configure_ftp_pool(
+    host: str = const.DEFAULT_FTP_HOST,
+    size: int = const.DEFAULT_FTP_POOL_SIZE,
+    idle_timeout: typing.Optional[float] = const.DEFAULT_FTP_IDLE_TIMEOUT,
+    timeout: typing.Optional[float] = const.DEFAULT_FTP_TIMEOUT,
+    health_check_after: typing.Optional[float] = const.DEFAULT_FTP_HEALTH_CHECK_AFTER,
+) -> FtpConnectionPool:
+    """Replaces the shared FTP connection pool with one using the provided options, closing the old one.
+    See FtpConnectionPool for the meaning of the parameters.
+    """
+    global _ftp_pool
+
+    with _ftp_pool_lock:
+        if _ftp_pool is not None:
+            _ftp_pool.close()
+
+        _ftp_pool = FtpConnectionPool(
+            host=host,
+            size=size,
+            idle_timeout=idle_timeout,
+            timeout=timeout,
+            health_check_after=health_check_after
+        )
+        logger.debug(f"FTP connection pool for {host} set up with {_ftp_pool.size} connections")
+        return _ftp_pool
+
+
+def get_ftp_pool() -> FtpConnectionPool:
+    """Returns the shared FTP connection pool, building a default one on first use."""
+    global _ftp_pool
+
+    if _ftp_pool is None:
+        with _ftp_pool_lock:
+            if _ftp_pool is None:
+                _ftp_pool = FtpConnectionPool()
+
+    return _ftp_pool
@@ -0,0 +1,95 @@
+import codecs
+import typing
+import zlib
+
+# wbits for zlib to expect (and check) the gzip header and trailer
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+class GzipLineDecoder:
+    """Incrementally decompresses and decodes a gzip stream fed in arbitrary chunks, splitting it into lines.
+
+    Only the current partial line and zlib's window are held in memory, regardless of the stream size.
+    Handles multi-member gzip files (concatenated streams), like gzip.GzipFile does.
+    """
+
+    def __init__(self, encoding: str = "utf8", newline: str = "\n"):
+        """
+        :param encoding: Optional; text encoding of the decompressed data.
+        :param newline: Optional; the line separator. Not included in the emitted lines.
+        """
+        self.encoding = encoding
+        self.newline = newline
+
+        self._decompressor = zlib.decompressobj(GZIP_WBITS)
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._tail = ""
+        # Whether the current gzip member got any input yet; a stream may end between two members, but not midway
+        self._member_started = False
+        self.compressed_bytes = 0
+        self.decompressed_bytes = 0
+
+    def _split(self, text: str, final: bool = False) -> typing.List[str]:
+        if not text and not final:
+            return []
+
+        lines = (self._tail + text).split(self.newline)
+        self._tail = lines.pop()
+
+        if final and self._tail:
+            lines.append(self._tail)
+            self._tail = ""
+
+        return lines
+
+    def feed(self, chunk: bytes) -> typing.List[str]:
+        """Decompresses a chunk of the gzip stream.
+
+        :param chunk: The next bytes of the compressed stream.
+        :returns: The lines completed by this chunk (possibly none).
+        """
+        self.compressed_bytes += len(chunk)
+        data = chunk
+        text = []
+
+        while data:
+            self._member_started = True
+            raw = self._decompressor.decompress(data)
+            self.decompressed_bytes += len(raw)
+            text.append(self._decoder.decode(raw))
+
+            if not self._decompressor.eof:
+                break
+
+            # End of a gzip member; anything after it is the next member
+            data = self._decompressor.unused_data
+            self._decompressor = zlib.decompressobj(GZIP_WBITS)
+            self._member_started = False
+
+        return self._split("".join(text))
+
+    def flush(self) -> typing.List[str]:
+        """Ends the stream, returning the remaining lines (including a last line without a trailing newline).
+
+        Raises EOFError if the stream was cut off before the end of a gzip member, like gzip.decompress() does.
+        """
+        if self._member_started and not self._decompressor.eof:
+            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+
+        raw = self._decompressor.flush()
+        self.decompressed_bytes += len(raw)
+        text = self._decoder.decode(raw, final=True)
+        return self._split(text, final=True)
+
+
+def iter_gzip_lines(
+    chunks: typing.Iterable[bytes],
+    encoding: str = "utf8",
+) -> typing.Iterator[str]:
+    """Lazily decompresses an iterable of gzip stream chunks (e.g. a file read in blocks) into lines."""
+    decoder = GzipLineDecoder(encoding=encoding)
+
+    for chunk in chunks:
+        yield from decoder.feed(chunk)
+
+    yield from decoder.flush()
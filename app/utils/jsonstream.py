@@ -0,0 +1,167 @@
+import codecs
+import json
+import typing
+
+_WHITESPACE = " \t\n\r"
+# Once this much of the buffer has been consumed, the consumed part is dropped
+_COMPACT_THRESHOLD = 64 * 1024
+
+
+class JsonStreamCursor:
+    """A minimal pull-based cursor over a JSON document arriving in chunks.
+
+    It does not build the whole document; the caller walks the object structure
+    it cares about (keys, container boundaries) and decodes only the individual
+    values it needs, so memory use is bounded by the largest single value decoded
+    rather than by the size of the document.
+    """
+
+    def __init__(self, chunks: typing.Iterable[typing.Union[bytes, str]], encoding: str = "utf8"):
+        """
+        :param chunks: The document, as an iterable of byte (or text) chunks, e.g. an HTTP response stream.
+        :param encoding: Optional; encoding of the byte chunks.
+        """
+        self._chunks = iter(chunks)
+        self._decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        self._json_decoder = json.JSONDecoder()
+        self._buf = ""
+        self._pos = 0
+        self._exhausted = False
+
+    def _fill(self) -> bool:
+        """Pulls another chunk into the buffer; returns False if the stream is exhausted."""
+        if self._exhausted:
+            return False
+
+        if self._pos > _COMPACT_THRESHOLD:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+
+        for chunk in self._chunks:
+            text = self._decoder.decode(chunk) if isinstance(chunk, bytes) else chunk
+            if text:
+                self._buf += text
+                return True
+
+        self._buf += self._decoder.decode(b"", final=True)
+        self._exhausted = True
+        return False
+
+    def peek(self) -> typing.Optional[str]:
+        """Returns the next non-whitespace character without consuming it; None at the end of the stream."""
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+
+            if not self._fill():
+                return None
+
+    def expect(self, chars: str) -> str:
+        """Consumes the next non-whitespace character, which has to be one of `chars`."""
+        char = self.peek()
+        if char is None or char not in chars:
+            raise ValueError(f"Expected one of {chars!r} in the JSON stream, got {char!r}")
+        self._pos += 1
+        return char
+
+    def decode_value(self) -> typing.Any:
+        """Decodes and consumes the next complete JSON value, pulling more data as needed."""
+        self.peek()
+
+        while True:
+            try:
+                value, end = self._json_decoder.raw_decode(self._buf, self._pos)
+
+            except json.JSONDecodeError:
+                # Most likely cut off by the chunk boundary - retry with more data:
+                if self._fill():
+                    continue
+                raise
+
+            if end >= len(self._buf) and not self._exhausted:
+                # A number or literal might continue in the next chunk:
+                if self._fill():
+                    continue
+
+            self._pos = end
+            return value
+
+    def iter_object(self) -> typing.Iterator[str]:
+        """Walks the members of the JSON object at the cursor, yielding each key.
+
+        The caller has to consume the member value (e.g. via decode_value() or a nested iter_object())
+        before advancing the iteration.
+        """
+        self.expect("{")
+
+        if self.peek() == "}":
+            self._pos += 1
+            return
+
+        while True:
+            key = self.decode_value()
+            self.expect(":")
+            yield key
+
+            if self.expect(",}") == "}":
+                return
+
+
+def _dump_members(
+    wrapped: typing.Iterable[typing.Union[dict, list]],
+    brackets: str,
+    fp: typing.TextIO,
+    dumps_kwargs: typing.Mapping,
+) -> None:
+    # Each member is dumped inside a container of its own, which is then stripped off; that way,
+    # the keys, the values and the indentation come out exactly as json.dump() would write them.
+    indented = dumps_kwargs.get("indent") is not None
+    item_separator = (
+        dumps_kwargs["separators"][0] if dumps_kwargs.get("separators")
+        else ("," if indented else ", ")
+    )
+    strip = 2 if indented else 1
+    written = False
+
+    for container in wrapped:
+        member = json.dumps(container, **dumps_kwargs)[strip:-strip]
+
+        if written:
+            fp.write(item_separator + ("\n" if indented else ""))
+        else:
+            fp.write(brackets[0] + ("\n" if indented else ""))
+            written = True
+
+        fp.write(member)
+
+    if written:
+        fp.write(("\n" if indented else "") + brackets[1])
+    else:
+        fp.write(brackets)
+
+
+def dump_items(
+    items: typing.Iterable[typing.Tuple[typing.Any, typing.Any]],
+    fp: typing.TextIO,
+    **dumps_kwargs
+) -> None:
+    """Writes a JSON object out one (key, value) member at a time, without building the whole object first.
+
+    The text is the same as json.dump(dict(items), fp, **dumps_kwargs) would write.
+    """
+    _dump_members(({key: value} for (key, value) in items), "{}", fp, dumps_kwargs)
+
+
+def dump_array(
+    values: typing.Iterable[typing.Any],
+    fp: typing.TextIO,
+    **dumps_kwargs
+) -> None:
+    """Writes a JSON array out one value at a time, without building the whole list first.
+
+    The text is the same as json.dump(list(values), fp, **dumps_kwargs) would write.
+    """
+    _dump_members(([value] for value in values), "[]", fp, dumps_kwargs)
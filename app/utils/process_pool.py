@@ -0,0 +1,182 @@
+import multiprocessing
+import os
+import pickle
+import threading
+import typing
+from concurrent.futures import ProcessPoolExecutor
+
+import app.constants as const
+from app.utils.logs import logger
+
+SHARED_MEMORY_SUPPORT = True
+
+try:
+    # Python 3.8+
+    from multiprocessing import shared_memory
+
+except ImportError as IErr:
+    logger.debug(f"Shared memory not available, results of the process pool will be pickled in full: {IErr}")
+    shared_memory = None
+    SHARED_MEMORY_SUPPORT = False
+
+# Out-of-band buffers need pickle protocol 5 (Python 3.8+ as well)
+PICKLE_BUFFER_SUPPORT = pickle.HIGHEST_PROTOCOL >= 5
+
+
+class SharedPayload(typing.NamedTuple):
+    """A pickled object on its way between processes.
+
+    The pickle itself is small and travels the usual way; the large binary buffers in it (e.g. NumPy arrays)
+    are taken out of band with pickle protocol 5 and laid out one after another in a shared memory block,
+    so they are neither pickled nor pushed through the pipe between the processes.
+    Small buffers are not worth a shared memory block, and travel along with the pickle instead.
+    Without shared memory and pickle protocol 5 (before Python 3.8), the header is a plain pickle of the object.
+    """
+    header: bytes
+    shm_name: typing.Optional[str] = None
+    buffer_sizes: typing.Tuple[int, ...] = ()
+    inline_buffers: typing.Tuple[bytes, ...] = ()
+
+
+def dumps_shared(obj: typing.Any, min_shared_bytes: int = const.DEFAULT_SHARED_MEMORY_MIN_BYTES) -> SharedPayload:
+    """Pickles an object, moving its out-of-band buffers into a shared memory block.
+
+    The block outlives this call; the receiving side owns it and frees it in loads_shared().
+
+    :param obj: The object to pickle.
+    :param min_shared_bytes: Optional; below this total size, the buffers are sent along with the pickle.
+    """
+    if not (SHARED_MEMORY_SUPPORT and PICKLE_BUFFER_SUPPORT):
+        return SharedPayload(header=pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL))
+
+    buffers = []
+    header = pickle.dumps(obj, protocol=5, buffer_callback=buffers.append)
+
+    raw_buffers = [buffer.raw() for buffer in buffers]
+    total_bytes = sum(raw.nbytes for raw in raw_buffers)
+
+    if not raw_buffers:
+        return SharedPayload(header=header)
+
+    if total_bytes < min_shared_bytes:
+        return SharedPayload(header=header, inline_buffers=tuple(raw.tobytes() for raw in raw_buffers))
+
+    shm = shared_memory.SharedMemory(create=True, size=max(total_bytes, 1))
+    try:
+        offset = 0
+        for raw in raw_buffers:
+            shm.buf[offset:offset + raw.nbytes] = raw
+            offset += raw.nbytes
+
+        return SharedPayload(
+            header=header,
+            shm_name=shm.name,
+            buffer_sizes=tuple(raw.nbytes for raw in raw_buffers),
+        )
+
+    finally:
+        shm.close()
+
+
+def loads_shared(payload: SharedPayload) -> typing.Any:
+    """Unpickles an object packed by dumps_shared(), freeing its shared memory block."""
+    if payload.shm_name is None and not payload.inline_buffers:
+        return pickle.loads(payload.header)
+
+    if payload.shm_name is None:
+        return pickle.loads(payload.header, buffers=payload.inline_buffers)
+
+    shm = shared_memory.SharedMemory(name=payload.shm_name)
+    try:
+        # A single copy out of the shared block; the unpickled buffers are views into it
+        data = bytearray(shm.buf[:sum(payload.buffer_sizes)])
+    finally:
+        shm.close()
+        shm.unlink()
+
+    view = memoryview(data)
+    buffers = []
+    offset = 0
+
+    for size in payload.buffer_sizes:
+        buffers.append(view[offset:offset + size])
+        offset += size
+
+    return pickle.loads(payload.header, buffers=buffers)
+
+
+def run_shared(func: typing.Callable, *args, **kwargs) -> SharedPayload:
+    """Runs a function, packing its result with dumps_shared(). Meant to be submitted to the process pool."""
+    return dumps_shared(func(*args, **kwargs))
+
+
+class ProcessPool:
+    """A lazily started pool of worker processes for the CPU-bound stages of the pipeline.
+
+    The workers are spawned (rather than forked), so that they do not inherit the threads,
+    sockets and locks of the parent process.
+    """
+
+    def __init__(self, workers: typing.Optional[int] = const.DEFAULT_PROCESS_POOL_WORKERS):
+        """
+        :param workers: Optional; number of worker processes. Defaults to the number of CPUs.
+        """
+        self.workers = max(int(workers or os.cpu_count() or 1), 1)
+
+        self._lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ProcessPoolExecutor(
+                        max_workers=self.workers,
+                        mp_context=multiprocessing.get_context("spawn")
+                    )
+                    logger.debug(f"Process pool started with {self.workers} workers")
+        return self._executor
+
+    def run(self, func: typing.Callable, *args, **kwargs) -> typing.Any:
+        """Runs a (picklable, module-level) function in a worker process, blocking until it returns.
+        The result comes back through shared memory; see dumps_shared().
+        """
+        future = self._get_executor().submit(run_shared, func, *args, **kwargs)
+        return loads_shared(future.result())
+
+    def close(self) -> None:
+        """Stops the worker processes, if any were started."""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
+
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+
+def configure_process_pool(workers: typing.Optional[int] = const.DEFAULT_PROCESS_POOL_WORKERS) -> ProcessPool:
+    """Replaces the shared process pool with one using the provided options, closing the old one.
+    See ProcessPool for the meaning of the parameters.
+    """
+    global _process_pool
+
+    with _process_pool_lock:
+        if _process_pool is not None:
+            _process_pool.close()
+
+        _process_pool = ProcessPool(workers=workers)
+        return _process_pool
+
+
+def get_process_pool() -> ProcessPool:
+    """Returns the shared process pool, building a default one on first use."""
+    global _process_pool
+
+    if _process_pool is None:
+        with _process_pool_lock:
+            if _process_pool is None:
+                _process_pool = ProcessPool()
+
+    return _process_pool
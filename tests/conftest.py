@@ -0,0 +1,203 @@
+import posixpath
+import socket
+import threading
+
+import pytest
+
+SERIES_MATRIX = "\n".join([
+    '!Series_title\t"A small series"',
+    '!Series_geo_accession\t"GSE1"',
+    '!Series_summary\t"First part"',
+    '!Series_summary\t"Second part"',
+    '!Sample_title\t"s1"\t"s2"\t"s3"',
+    '!Sample_source_name_ch1\t"skin"\t"skin"\t"skin"',
+    '!Sample_characteristics_ch1\t"age: 30"\t"age: 40"\t"age: 50"',
+    '!Sample_characteristics_ch1\t"sex: F"\t"sex: M"\t"sex: F"',
+    '',
+    '!series_matrix_table_begin',
+    '"ID_REF"\t"GSM1"\t"GSM2"\t"GSM3"',
+    '"p1"\t1.5\t2\tnull',
+    '"p2"\t\t3.25\t4',
+    '!series_matrix_table_end',
+    '',
+])
+
+# The output of the original (pre-streaming, eagerly padded) normalize_item() for SERIES_MATRIX
+BASELINE_NORMALIZED = {
+    'Series_title': ('A small series', 'A small series', 'A small series', 'A small series'),
+    'Series_geo_accession': ('GSE1', 'GSE1', 'GSE1', 'GSE1'),
+    'Series_summary': ('First part', 'First part', 'First part', 'First part'),
+    'Series_summary-2': ('Second part', 'Second part', 'Second part', 'Second part'),
+    'Sample_title': ('s1', 's2', 's3', 's1'),
+    'Sample_source_name_ch1': ('skin', 'skin', 'skin', 'skin'),
+    'Sample_characteristics_ch1': ('age: 30', 'age: 40', 'age: 50', 'age: 30'),
+    'Sample_characteristics_ch1-2': ('sex: F', 'sex: M', 'sex: F', 'sex: F'),
+    'ID_REF': ('GSM1', 'GSM2', 'GSM3', 'GSM1'),
+    None: ('p1', '1.5', '2', 'null'),
+    'None-2': ('p2', '', '3.25', '4'),
+}
+
+
+@pytest.fixture
+def series_matrix() -> str:
+    """A small series matrix file, as text."""
+    return SERIES_MATRIX
+
+
+@pytest.fixture
+def baseline_normalized() -> dict:
+    """What the original normalize_item() made of the series_matrix fixture."""
+    return dict(BASELINE_NORMALIZED)
+
+
+class FakeFtpServer:
+    """A minimal local FTP server, serving in-memory files over passive mode.
+
+    Understands just the commands the app sends; records all of them in `commands`.
+    With `break_after` set, the first transfer of every file breaks off after that many bytes;
+    with `supports_rest` unset, the server refuses to resume transfers.
+    """
+
+    def __init__(self, files: dict, break_after=None):
+        """
+        :param files: The served files, as {absolute path: bytes}.
+        :param break_after: Optional; number of bytes after which the first transfer of a file breaks off.
+        """
+        self.files = files
+        self.break_after = break_after
+        self.broken = set()
+        self.supports_rest = True
+        self.commands = []
+        self.logins = 0
+
+        self._sock = socket.create_server(("127.0.0.1", 0))
+        self.port = self._sock.getsockname()[1]
+        threading.Thread(target=self._serve, daemon=True).start()
+
+    def connect(self):
+        """Opens a new logged-in connection to the server."""
+        from app.utils.ftp_pool import TrackingFTP
+
+        client = TrackingFTP(timeout=5)
+        client.connect("127.0.0.1", self.port)
+        client.login()
+        return client
+
+    def close(self):
+        self._sock.close()
+
+    def _serve(self):
+        while True:
+            try:
+                conn, _ = self._sock.accept()
+            except OSError:
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    @staticmethod
+    def _listen():
+        data_sock = socket.create_server(("127.0.0.1", 0))
+        port = data_sock.getsockname()[1]
+        return data_sock, f"227 Entering Passive Mode (127,0,0,1,{port >> 8},{port & 255})"
+
+    def _handle(self, conn):
+        # ABOR comes in as urgent data; read it along with the rest
+        conn.setsockopt(socket.SOL_SOCKET, socket.SO_OOBINLINE, 1)
+        stream = conn.makefile("rwb")
+        cwd, data_sock, rest = "/", None, 0
+
+        def reply(line):
+            stream.write(f"{line}\r\n".encode())
+            stream.flush()
+
+        def resolve(arg):
+            return posixpath.normpath(posixpath.join(cwd, arg or "."))
+
+        try:
+            reply("220 Welcome")
+            for raw in stream:
+                line = raw.decode().strip()
+                self.commands.append(line)
+                cmd, _, arg = line.partition(" ")
+                cmd = cmd.upper()
+
+                if cmd == "USER":
+                    reply("331 Anonymous login ok")
+                elif cmd == "PASS":
+                    self.logins += 1
+                    reply("230 Logged in")
+                elif cmd in ("TYPE", "NOOP"):
+                    reply("200 Ok")
+                elif cmd == "CWD":
+                    cwd = resolve(arg)
+                    reply("250 Ok")
+                elif cmd == "REST" and self.supports_rest:
+                    rest = int(arg)
+                    reply("350 Restarting")
+                elif cmd == "SIZE":
+                    path = resolve(arg)
+                    reply(f"213 {len(self.files[path])}" if path in self.files else "550 No such file")
+                elif cmd == "MDTM":
+                    reply("213 20240101000000" if resolve(arg) in self.files else "550 No such file")
+                elif cmd == "PASV":
+                    data_sock, resp = self._listen()
+                    reply(resp)
+                elif cmd == "MLSD":
+                    directory = resolve(arg)
+                    reply("150 Listing")
+                    data_conn, _ = data_sock.accept()
+                    for (path, body) in self.files.items():
+                        if posixpath.dirname(path) == directory:
+                            name = posixpath.basename(path)
+                            data_conn.sendall(f"type=file;size={len(body)};modify=20240101000000; {name}\r\n".encode())
+                    data_conn.close()
+                    data_sock.close()
+                    reply("226 Done")
+                elif cmd == "RETR":
+                    path = resolve(arg)
+                    if path not in self.files:
+                        reply("550 No such file")
+                        continue
+                    reply("150 Sending")
+                    data_conn, _ = data_sock.accept()
+                    body, rest = self.files[path][rest:], 0
+                    breaks = self.break_after is not None and path not in self.broken
+                    if breaks:
+                        self.broken.add(path)
+                        body = body[:self.break_after]
+                    try:
+                        data_conn.sendall(body)
+                    except OSError:
+                        pass
+                    data_conn.close()
+                    data_sock.close()
+                    reply("426 Connection closed; transfer aborted" if breaks else "226 Done")
+                elif cmd == "ABOR":
+                    reply("226 Aborted")
+                elif cmd == "QUIT":
+                    reply("221 Bye")
+                    break
+                else:
+                    reply("502 Not implemented")
+        except OSError:
+            pass
+        finally:
+            conn.close()
+
+
+@pytest.fixture
+def ftp_server():
+    """Starts a FakeFtpServer; add the files to serve to its `files`."""
+    server = FakeFtpServer(files={})
+    yield server
+    server.close()
+
+
+@pytest.fixture
+def listing_cache(monkeypatch):
+    """Swaps the shared FTP listing cache for a fresh one."""
+    from app.utils import ftp_listing
+
+    fresh = ftp_listing.ListingCache()
+    monkeypatch.setattr(ftp_listing, "_listing_cache", fresh)
+    return fresh
@@ -0,0 +1,150 @@
+import time
+import types
+
+import pytest
+
+from app.core.fetch import fetching
+from app.core.fetch.adaptive import BatchSizeController, adaptive_batches
+from app.core.search import client
+
+
+def test_slow_start_doubles_full_pages():
+    controller = BatchSizeController(initial_size=10, min_size=5, max_size=1000, target_latency=1.0,
+                                     max_page_bytes=None)
+
+    assert controller.observe(latency=0.1, item_count=10) == 20
+    assert controller.observe(latency=0.1, item_count=20) == 40
+    # A short page is the end of the results, not a reason to grow
+    assert controller.observe(latency=0.1, item_count=3) == 40
+
+
+def test_additive_increase_multiplicative_decrease():
+    controller = BatchSizeController(initial_size=100, min_size=10, max_size=1000, target_latency=1.0,
+                                     increase_step=10, max_page_bytes=None)
+
+    assert controller.observe(latency=2.0, item_count=100) == 50
+    assert not controller.slow_start
+    assert controller.observe(latency=0.1, item_count=50) == 60
+    assert controller.observe(latency=0.1, item_count=60) == 70
+    assert controller.observe(latency=5.0, item_count=70) == 35
+
+    # Never below the floor, or above the ceiling
+    for _ in range(10):
+        controller.observe(latency=5.0, item_count=controller.size)
+    assert controller.size == 10
+    assert controller.reset(5000) == 1000
+
+
+def test_page_size_is_capped_by_the_payload_budget():
+    controller = BatchSizeController(initial_size=100, min_size=1, max_size=10000, target_latency=1.0,
+                                     max_page_bytes=1000)
+
+    # 100 bytes per item - no more than 10 items fit
+    assert controller.observe(latency=0.1, item_count=100, nbytes=10000) == 10
+    assert not controller.slow_start
+    assert controller.observe(latency=0.1, item_count=10, nbytes=1000) == 10
+
+
+def test_throughput():
+    controller = BatchSizeController(initial_size=10, max_page_bytes=None)
+    controller.observe(latency=0.5, item_count=10)
+    controller.observe(latency=1.5, item_count=30)
+
+    assert controller.throughput == 20.0
+
+
+def _batches(*specs):
+    """A fetcher coroutine yielding SearchBatch-es of (uid count, latency, requested size), recording the sent sizes."""
+    sent = []
+
+    def _fetcher():
+        for (uid_count, latency, requested) in specs:
+            new_size = yield fetching.SearchBatch({}, uid_count=uid_count, latency=latency, requested=requested)
+            sent.append(new_size)
+
+    return _fetcher(), sent
+
+
+def test_adaptive_batches_use_the_measured_latency():
+    controller = BatchSizeController(initial_size=10, min_size=1, max_size=1000, target_latency=1.0,
+                                     increase_step=1, max_page_bytes=None)
+    fetcher, sent = _batches((10, 0.1, 10), (20, 3.0, 20), (10, None, 10), (10, 0.1, 10))
+
+    def _slow_consumer(batches):
+        for batch in batches:
+            # Time spent by the consumer is not the remote's latency
+            time.sleep(0.01)
+            yield batch
+
+    assert len(list(_slow_consumer(adaptive_batches(fetcher, controller=controller)))) == 4
+    # Doubled, then halved; the cached page leaves the size as it is
+    assert sent == [20, 10, 10, 11]
+    assert controller.pages_observed == 3
+
+
+def test_adaptive_batches_grow_on_the_requested_size_of_each_page():
+    controller = BatchSizeController(initial_size=10, min_size=1, max_size=1000, target_latency=1.0,
+                                     max_page_bytes=None)
+    # Concurrent pages: the second one went out before the first one came back
+    fetcher, sent = _batches((10, 0.1, 10), (10, 0.1, 10))
+
+    list(adaptive_batches(fetcher, controller=controller))
+
+    assert sent == [20, 20]
+
+
+def test_adaptive_batches_accept_overrides():
+    controller = BatchSizeController(initial_size=10, min_size=1, max_size=1000, target_latency=1.0,
+                                     max_page_bytes=None)
+    fetcher, sent = _batches((10, 0.1, 10), (5, 0.1, 5))
+
+    batches = adaptive_batches(fetcher, controller=controller)
+    next(batches)
+    batches.send(5)
+    with pytest.raises(StopIteration):
+        next(batches)
+
+    assert sent[0] == 5
+
+
+class _SlowLimiter:
+    def acquire(self):
+        time.sleep(0.2)
+
+
+class _Session:
+    def __init__(self, text="{}"):
+        self.text = text
+
+    def request(self, method, url, **kwargs):
+        time.sleep(0.05)
+        return types.SimpleNamespace(text=self.text, status_code=200, raise_for_status=lambda: None)
+
+
+def test_timed_requests_leave_out_the_rate_limiter(monkeypatch):
+    monkeypatch.setattr(client, "get_rate_limiter", lambda: _SlowLimiter())
+    monkeypatch.setattr(client, "get_session", lambda: _Session())
+
+    with client.timed_requests() as outer:
+        with client.timed_requests() as inner:
+            client.http_get("https://example.org")
+        client.http_get("https://example.org")
+
+    assert inner.requests == 1 and 0.05 <= inner.elapsed < 0.2
+    assert outer.requests == 2 and 0.1 <= outer.elapsed < 0.4
+
+    # Nothing is recorded outside of a timed block
+    client.http_get("https://example.org")
+    assert outer.requests == 2
+
+
+def test_fetched_pages_carry_their_latency(monkeypatch):
+    response = '{"result": {"uids": ["1"], "1": {"uid": "1"}}}'
+    monkeypatch.setattr(client, "get_rate_limiter", lambda: _SlowLimiter())
+    monkeypatch.setattr(client, "get_session", lambda: _Session(response))
+
+    batch = fetching.fetch_from_pos(0, term="term", batch_size=7, query_env=("env", "1"), use_cache=False)
+
+    assert batch.requested == 7
+    assert batch.uid_count == 1
+    assert 0.05 <= batch.latency < 0.2
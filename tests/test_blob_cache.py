@@ -0,0 +1,94 @@
+import io
+import os
+import time
+
+from app.utils.blob_cache import BlobCache
+from app.utils.disk_cache import DiskCache
+
+MODIFY = "20240101120000"
+
+
+def test_stores_and_serves_unchanged_files(tmp_path):
+    cache = BlobCache(cache_dir=str(tmp_path))
+    data = b"compressed bytes"
+
+    assert cache.get("/geo/GSE1.gz", len(data), MODIFY) is None
+    assert cache.put("/geo/GSE1.gz", len(data), MODIFY, source=io.BytesIO(data))
+
+    cached_path = cache.get("/geo/GSE1.gz", len(data), MODIFY)
+    with open(cached_path, "rb") as cached:
+        assert cached.read() == data
+
+    # A file changed on the server is a different entry
+    assert cache.get("/geo/GSE1.gz", len(data), "20240202120000") is None
+    assert cache.stats() == dict(hits=1, misses=2, stores=1, expired=0, evictions=0, bytes_saved=len(data))
+
+
+def test_stores_from_a_local_path(tmp_path):
+    source = tmp_path / "download.gz"
+    source.write_bytes(b"12345")
+    cache = BlobCache(cache_dir=str(tmp_path / "cache"))
+
+    assert cache.put("/geo/GSE1.gz", 5, MODIFY, source=str(source))
+    assert cache.get("/geo/GSE1.gz", 5, MODIFY) is not None
+
+
+def test_rejects_files_without_the_validating_facts_or_of_the_wrong_size(tmp_path):
+    cache = BlobCache(cache_dir=str(tmp_path))
+
+    assert not cache.put("/geo/GSE1.gz", None, MODIFY, source=io.BytesIO(b"x"))
+    assert not cache.put("/geo/GSE1.gz", 1, None, source=io.BytesIO(b"x"))
+    # A truncated download is never stored
+    assert not cache.put("/geo/GSE1.gz", 10, MODIFY, source=io.BytesIO(b"x"))
+    assert list(cache._iter_entries()) == []
+
+
+def test_drops_torn_entries(tmp_path):
+    cache = BlobCache(cache_dir=str(tmp_path))
+    cache.put("/geo/GSE1.gz", 4, MODIFY, source=io.BytesIO(b"abcd"))
+
+    with open(cache.get("/geo/GSE1.gz", 4, MODIFY), "wb") as entry:
+        entry.write(b"ab")
+
+    assert cache.get("/geo/GSE1.gz", 4, MODIFY) is None
+    assert list(cache._iter_entries()) == []
+
+
+def test_evicts_the_least_recently_used_files(tmp_path):
+    cache = BlobCache(cache_dir=str(tmp_path), max_bytes=25)
+
+    for idx in range(2):
+        cache.put(f"/geo/GSE{idx}.gz", 10, MODIFY, source=io.BytesIO(b"x" * 10))
+        # The recency is tracked by the mtime; make sure it differs
+        path = cache._entry_path(cache.build_key(f"/geo/GSE{idx}.gz", 10, MODIFY))
+        os.utime(path, (time.time() - 100 + idx, time.time() - 100 + idx))
+
+    # Used last, so kept
+    assert cache.get("/geo/GSE0.gz", 10, MODIFY) is not None
+    cache.put("/geo/GSE2.gz", 10, MODIFY, source=io.BytesIO(b"x" * 10))
+
+    assert cache.get("/geo/GSE1.gz", 10, MODIFY) is None
+    assert cache.get("/geo/GSE0.gz", 10, MODIFY) is not None
+    assert cache.get("/geo/GSE2.gz", 10, MODIFY) is not None
+    assert cache.stats()["evictions"] == 1
+
+
+def test_shares_a_directory_with_other_caches(tmp_path):
+    blobs = BlobCache(cache_dir=str(tmp_path))
+    responses = DiskCache(cache_dir=str(tmp_path))
+
+    blobs.put("/geo/GSE1.gz", 4, MODIFY, source=io.BytesIO(b"abcd"))
+    responses.put(DiskCache.hash_key("esearch"), "response")
+
+    # Neither sees the entries of the other
+    assert len(list(blobs._iter_entries())) == 1
+    assert len(list(responses._iter_entries())) == 1
+    assert blobs.clear() == 1
+    assert responses.get(DiskCache.hash_key("esearch")) == "response"
+
+
+def test_disabled(tmp_path):
+    cache = BlobCache(cache_dir=str(tmp_path), enabled=False)
+
+    assert not cache.put("/geo/GSE1.gz", 1, MODIFY, source=io.BytesIO(b"x"))
+    assert cache.get("/geo/GSE1.gz", 1, MODIFY) is None
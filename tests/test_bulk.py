@@ -0,0 +1,143 @@
+import urllib.parse
+
+import pytest
+
+from app.core.fetch import fetching
+from app.core.search import esearch, esummary
+
+
+@pytest.fixture
+def uid_pages(monkeypatch):
+    """Serves the UIDs 1..`count` from ESearch in pages, in place of the remote; records the pages asked for."""
+    requested = []
+
+    def _serve(count):
+        def _get_uid_page(term, db=None, retstart=0, retmax=10000, use_cache=True, date_filter=None):
+            requested.append((retstart, retmax))
+            return [str(uid) for uid in range(retstart + 1, min(retstart + retmax, count) + 1)], count
+
+        monkeypatch.setattr(esearch, "get_uid_page", _get_uid_page)
+        return requested
+
+    return _serve
+
+
+def test_iter_uids_harvests_all_the_pages(uid_pages):
+    requested = uid_pages(25)
+
+    assert list(esearch.iter_uids("cancer", page_size=10)) == [str(uid) for uid in range(1, 26)]
+    assert requested == [(0, 10), (10, 10), (20, 10)]
+
+
+def test_iter_uids_is_lazy(uid_pages):
+    requested = uid_pages(100000)
+
+    uids = esearch.iter_uids("cancer", page_size=10000)
+    assert next(uids) == "1"
+    assert requested == [(0, 10000)]
+
+
+def test_iter_uids_stops_on_an_empty_page(monkeypatch):
+    # The count says there are more, but the remote has nothing left to give
+    monkeypatch.setattr(esearch, "get_uid_page", lambda term, retstart=0, **kwargs: (["1"] if not retstart else [], 5))
+
+    assert list(esearch.iter_uids("cancer")) == ["1"]
+
+
+def test_uid_pages_are_capped_at_the_max_page_size(monkeypatch):
+    urls = []
+
+    def _run_query(query_url):
+        urls.append(query_url)
+        return '{"esearchresult": {"count": "2", "idlist": ["1", "2"]}}'
+
+    monkeypatch.setattr(esearch, "run_query", _run_query)
+
+    assert esearch.get_uid_page("cancer", retstart=0, retmax=50000, use_cache=False) == (["1", "2"], 2)
+    params = urllib.parse.parse_qs(urllib.parse.urlsplit(urls[0]).query)
+    assert params["retmax"] == ["10000"]
+    assert params["retstart"] == ["0"]
+    assert params["usehistory"] == ["n"]
+
+
+def test_summaries_are_posted_in_one_request():
+    url, form_data = esummary.build_summary_post(uids=["1", "2", 3], database="gds", api_key="secret")
+
+    assert url.endswith("esummary.fcgi")
+    assert form_data["id"] == "1,2,3"
+    assert (form_data["db"], form_data["retmode"], form_data["api_key"]) == ("gds", "json", "secret")
+
+
+@pytest.fixture
+def summaries(monkeypatch):
+    """Summarizes the UIDs in place of the remote, as records with an FTP link; records the UID batches posted."""
+    posted = []
+
+    def _fetch_by_ids(uids, db=None, use_cache=True, streaming=False):
+        posted.append(list(uids))
+        links = {uid: ("geo/series/GSE1nnn/GSE1/matrix/", f"GSE{uid}") for uid in uids if uid != "13"}
+        return fetching.SearchBatch(links, uid_count=len(links), latency=0.1, requested=len(uids))
+
+    monkeypatch.setattr(fetching, "fetch_by_ids", _fetch_by_ids)
+    return posted
+
+
+def test_fetch_bulk_summarizes_the_uids_in_batches(uid_pages, summaries):
+    uid_pages(25)
+
+    batches = list(fetching.fetch_bulk("cancer", batch_size=10, uid_page_size=10))
+
+    assert summaries == [[str(uid) for uid in range(start, min(start + 10, 26))] for start in (1, 11, 21)]
+    # The page is the UIDs asked for, whether ESummary had a record for each or not
+    assert [batch.uid_count for batch in batches] == [10, 10, 5]
+    assert "13" not in batches[1]
+
+
+def test_fetch_bulk_follows_the_new_batch_size(uid_pages, summaries):
+    uid_pages(25)
+
+    fetcher = fetching.fetch_bulk("cancer", batch_size=10)
+    next(fetcher)
+    assert fetcher.send(15).uid_count == 15
+    with pytest.raises(StopIteration):
+        next(fetcher)
+
+    assert [len(batch) for batch in summaries] == [10, 15]
+
+
+@pytest.mark.parametrize(("uid", "db", "accession"), [
+    ("200012345", "gds", "GSE12345"),
+    (200000012, "gds", "GSE12"),
+    # DataSets, Platforms and Samples share the database, but not the FTP layout
+    ("100001234", "gds", None),
+    ("300001234", "gds", None),
+    ("200000000", "gds", None),
+    ("GSE12345", "gds", None),
+    ("200012345", "pubmed", None),
+])
+def test_series_accessions_are_decoded_from_the_uids(uid, db, accession):
+    assert fetching.uid_to_series_accession(uid, db=db) == accession
+
+
+def test_download_links_are_derived_from_the_uids():
+    links, unresolved = fetching.derive_download_links(["200012345", "100001234", "200000012"], db="gds")
+
+    assert links == {
+        "200012345": ("geo/series/GSE12nnn/GSE12345/matrix/", "GSE12345"),
+        "200000012": ("geo/series/GSEnnn/GSE12/matrix/", "GSE12"),
+    }
+    assert unresolved == ["100001234"]
+
+
+def test_fetch_bulk_summarizes_only_the_uids_it_cannot_decode(monkeypatch, summaries):
+    uids = ["200012345", "13", "100001234", "200000012"]
+    monkeypatch.setattr(esearch, "get_uid_page", lambda term, retstart=0, **kwargs: (uids[retstart:], len(uids)))
+
+    (batch,) = fetching.fetch_bulk("cancer", batch_size=10, derive_links=True)
+
+    assert summaries == [["13", "100001234"]]
+    assert batch["200012345"] == ("geo/series/GSE12nnn/GSE12345/matrix/", "GSE12345")
+    assert batch["100001234"] == ("geo/series/GSE1nnn/GSE1/matrix/", "GSE100001234")
+    # The summaries' latency, but the page is all of the UIDs
+    assert (batch.uid_count, batch.requested, batch.latency) == (4, 4, 0.1)
+    assert len(batch) == 3
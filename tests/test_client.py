@@ -0,0 +1,152 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+import requests
+
+from app.core.search import client
+
+
+class ScriptedServer(ThreadingHTTPServer):
+    """Answers the requests with the scripted (status, headers, body) responses, in order; the last one repeats."""
+
+    def __init__(self, responses):
+        super().__init__(("127.0.0.1", 0), ScriptedHandler)
+        self.responses = list(responses)
+        self.requests = []
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/eutils"
+
+    def next_response(self):
+        return self.responses.pop(0) if len(self.responses) > 1 else self.responses[0]
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+
+    def _respond(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        self.server.requests.append((self.command, self.rfile.read(length)))
+
+        status, headers, body = self.server.next_response()
+        self.send_response(status)
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    do_GET = do_POST = _respond
+
+    def log_message(self, *args):
+        pass
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+@pytest.fixture
+def serve(monkeypatch):
+    servers = []
+    limiter = CountingLimiter()
+
+    monkeypatch.setattr(client, "get_rate_limiter", lambda: limiter)
+    monkeypatch.setitem(client._session_options, "backoff", 0.01)
+    monkeypatch.setitem(client._session_options, "retries", 2)
+
+    def _serve(*responses):
+        server = ScriptedServer(responses)
+        threading.Thread(target=server.serve_forever, kwargs=dict(poll_interval=0.01), daemon=True).start()
+        servers.append(server)
+        return server, limiter
+
+    yield _serve
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_returns_the_body(serve):
+    server, limiter = serve((200, {}, b'{"result": {}}'))
+
+    assert client.http_get(server.url) == '{"result": {}}'
+    assert client.http_post(server.url, data={"id": "1,2"}) == '{"result": {}}'
+    assert server.requests[1] == ("POST", b"id=1%2C2")
+    assert limiter.acquired == 2
+
+
+@pytest.mark.parametrize("fetch", [
+    client.http_get,
+    lambda url: client.http_post(url, data={"id": "1"}),
+    lambda url: b"".join(client.http_stream(url)),
+])
+def test_error_statuses_raise(serve, fetch):
+    server, limiter = serve((400, {}, b'{"error": "Invalid query_key"}'))
+
+    with pytest.raises(requests.HTTPError):
+        fetch(server.url)
+
+    # Client errors are not worth retrying
+    assert len(server.requests) == 1
+
+
+def test_retries_go_through_the_rate_limiter(serve):
+    server, limiter = serve(
+        (429, {"Retry-After": "0"}, b'{"error": "API rate limit exceeded"}'),
+        (503, {}, b""),
+        (200, {}, b"ok"),
+    )
+
+    assert client.http_get(server.url) == "ok"
+    assert len(server.requests) == 3
+    # A token for every attempt, not just the first one
+    assert limiter.acquired == 3
+
+
+def test_retries_run_out(serve):
+    server, limiter = serve((503, {}, b"busy"))
+
+    with pytest.raises(requests.HTTPError) as raised:
+        client.http_get(server.url)
+
+    assert raised.value.response.status_code == 503
+    assert len(server.requests) == limiter.acquired == 3
+
+
+def test_connection_errors_are_retried(serve):
+    # Nothing listens there any more
+    server, limiter = serve((200, {}, b""))
+    url = server.url
+    server.shutdown()
+    server.server_close()
+
+    with pytest.raises(requests.ConnectionError):
+        client.http_get(url)
+
+    assert limiter.acquired == 3
+
+
+def test_stream_yields_the_body(serve):
+    server, limiter = serve((503, {}, b""), (200, {}, b"x" * 100))
+
+    assert b"".join(client.http_stream(server.url, chunk_size=30)) == b"x" * 100
+    assert limiter.acquired == 2
+
+
+def test_retry_delay_honors_retry_after(monkeypatch):
+    monkeypatch.setitem(client._session_options, "backoff", 0.5)
+    response = requests.Response()
+
+    response.headers["Retry-After"] = "3"
+    assert client._retry_delay(0, response) == 3.0
+
+    response.headers["Retry-After"] = "Wed, 21 Oct 2015 07:28:00 GMT"
+    assert client._retry_delay(2, response) == 2.0
+    assert client._retry_delay(1) == 1.0
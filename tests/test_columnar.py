@@ -0,0 +1,82 @@
+import math
+
+import pytest
+
+from app.parsers.series_matrix import iter_series_matrix_rows
+from app.processing_backends.definitions.local import LocalProcessingBackend
+
+np = pytest.importorskip("numpy")
+
+from app.utils.columnar import ColumnarMatrix, build_columnar  # noqa: E402
+
+SERIES_MATRIX = "\n".join([
+    '!Series_title\t"A series"',
+    '!Sample_title\t"s1"\t"s2"',
+    '!Sample_organism_ch1\t"Homo sapiens"\t"Homo sapiens"',
+    '!series_matrix_table_begin',
+    '"ID_REF"\t"GSM1"\t"GSM2"',
+    '"p1"\t1.5\tnull',
+    '"p2"\t\tNA',
+    '"p3"\t4\tword',
+    '!series_matrix_table_end',
+])
+
+
+def key_valued():
+    return ((row.key, row.values) for row in iter_series_matrix_rows(SERIES_MATRIX))
+
+
+def test_columnar_matrix():
+    matrix = build_columnar([key_valued()], dtype="float64")
+
+    assert matrix.shape == (3, 2)
+    assert matrix.probe_ids.tolist() == ["p1", "p2", "p3"]
+    assert matrix.sample_ids.tolist() == ["GSM1", "GSM2"]
+    assert matrix.values.dtype == np.float64
+    assert matrix.values[0, 0] == 1.5 and matrix.values[2, 0] == 4
+    # Missing and non-numeric values alike
+    assert all(math.isnan(val) for val in (matrix.values[0, 1], matrix.values[1, 0], matrix.values[1, 1], matrix.values[2, 1]))
+    assert matrix.metadata == {
+        "Series_title": ("A series",),
+        "Sample_title": ("s1", "s2"),
+        "Sample_organism_ch1": ("Homo sapiens", "Homo sapiens"),
+    }
+
+
+def test_columnar_dict_view():
+    as_dict = build_columnar([key_valued()], dtype="float64").as_dict()
+
+    # The metadata survives as text, padded out to the width of the table rows, probe ID included...
+    assert as_dict["Series_title"] == ("A series", "A series", "A series")
+    assert as_dict["Sample_organism_ch1"] == ("Homo sapiens", "Homo sapiens", "Homo sapiens")
+    assert as_dict["ID_REF"] == ("GSM1", "GSM2", "GSM1")
+    # ...while the table is rendered back from the numbers
+    assert as_dict[None] == ("p1", "1.5", "null")
+    assert as_dict["None-2"] == ("p2", "null", "null")
+    assert as_dict["None-3"] == ("p3", "4.0", "null")
+
+
+def test_columnar_normalize_item(series_matrix):
+    matrix = LocalProcessingBackend.normalize_item(series_matrix, columnar=True)
+
+    assert isinstance(matrix, ColumnarMatrix)
+    assert matrix.values.dtype == np.float32
+    assert matrix.shape == (2, 3)
+    assert matrix.id_ref == "ID_REF"
+    assert matrix.metadata["Series_summary-2"] == ("Second part",)
+
+
+def test_columnar_matrix_save_load(tmp_path):
+    matrix = build_columnar([key_valued()])
+    savepath = LocalProcessingBackend.save_normalized(matrix, file=tmp_path / "GSE1.json")
+
+    assert savepath.endswith(".npz")
+
+    loaded = ColumnarMatrix.load(savepath)
+
+    assert loaded.id_ref == matrix.id_ref
+    assert loaded.metadata == matrix.metadata
+    assert loaded.probe_ids.tolist() == matrix.probe_ids.tolist()
+    assert loaded.sample_ids.tolist() == matrix.sample_ids.tolist()
+    assert loaded.values.dtype == matrix.values.dtype
+    np.testing.assert_array_equal(loaded.values, matrix.values)
@@ -0,0 +1,157 @@
+import os
+import types
+
+import pytest
+
+from app.core.fetch import fetching
+from app.core.search import cache, client
+from app.core.search.cache import ResponseCache, normalize_term
+from app.utils import disk_cache
+from app.utils.disk_cache import DiskCache
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Stands in for the wall clock of the cache module."""
+    fake = types.SimpleNamespace(now=1_000_000.0)
+    monkeypatch.setattr(disk_cache, "time", types.SimpleNamespace(time=lambda: fake.now))
+    return fake
+
+
+def test_stores_and_serves_entries(tmp_path):
+    store = DiskCache(cache_dir=str(tmp_path))
+    key = DiskCache.hash_key("esummary", "cancer", 0, 20)
+
+    assert store.get(key) is None
+    assert store.put(key, '{"result": {}}')
+    assert store.get(key) == '{"result": {}}'
+    # Nothing worth storing
+    assert not store.put(DiskCache.hash_key("empty"), "")
+
+    assert store.stats() == dict(hits=1, misses=1, stores=1, expired=0, evictions=0)
+
+
+def test_entries_expire(tmp_path, clock):
+    store = DiskCache(cache_dir=str(tmp_path), ttl=60)
+    key = DiskCache.hash_key("esearch")
+    store.put(key, "response")
+
+    clock.now += 59
+    assert store.get(key) == "response"
+    clock.now += 2
+    assert store.get(key) is None
+    assert store.stats()["expired"] == 1
+    assert list(store._iter_entries()) == []
+
+
+def test_evicts_the_least_recently_used_entries(tmp_path):
+    store = DiskCache(cache_dir=str(tmp_path), max_bytes=None)
+    keys = [DiskCache.hash_key("page", idx) for idx in range(3)]
+
+    for (idx, key) in enumerate(keys):
+        store.put(key, "x" * 100)
+        # The recency is tracked by the mtime; make sure it differs
+        os.utime(store._entry_path(key), (1000 + idx, 1000 + idx))
+
+    # The oldest one gets used, so the second one is the least recently used now
+    assert store.get(keys[0]) is not None
+
+    store.max_bytes = sum(os.path.getsize(store._entry_path(key)) for key in (keys[0], keys[2]))
+    assert store.evict() == 1
+
+    assert store.get(keys[1]) is None
+    assert store.get(keys[0]) is not None and store.get(keys[2]) is not None
+
+
+def test_evicts_once_over_the_byte_budget(tmp_path):
+    store = DiskCache(cache_dir=str(tmp_path), max_bytes=500)
+
+    for idx in range(10):
+        store.put(DiskCache.hash_key("page", idx), "x" * 100)
+
+    assert sum(entry.stat().st_size for entry in store._iter_entries()) <= 500
+    assert store.stats()["evictions"] > 0
+
+
+def test_evict_drops_the_expired_entries(tmp_path, clock):
+    store = DiskCache(cache_dir=str(tmp_path), ttl=60)
+    old, fresh = DiskCache.hash_key("old"), DiskCache.hash_key("fresh")
+    store.put(old, "old")
+    store.put(fresh, "fresh")
+    os.utime(store._entry_path(old), (clock.now - 120, clock.now - 120))
+    os.utime(store._entry_path(fresh), (clock.now, clock.now))
+
+    assert store.evict() == 1
+    assert store.get(fresh) == "fresh"
+
+
+def test_bypass_disabled_delete_and_clear(tmp_path):
+    key = DiskCache.hash_key("esearch")
+
+    bypassing = DiskCache(cache_dir=str(tmp_path), bypass=True)
+    assert bypassing.put(key, "response")
+    # Stored, but never served
+    assert bypassing.get(key) is None
+
+    disabled = DiskCache(cache_dir=str(tmp_path), enabled=False)
+    assert disabled.get(key) is None
+    assert not disabled.put(DiskCache.hash_key("other"), "response")
+
+    store = DiskCache(cache_dir=str(tmp_path))
+    assert store.get(key) == "response"
+    assert store.delete(key)
+    assert not store.delete(key)
+
+    store.put(key, "response")
+    store.put(DiskCache.hash_key("other"), "response")
+    assert store.clear() == 2
+
+
+def test_survives_corrupt_entries(tmp_path):
+    store = DiskCache(cache_dir=str(tmp_path))
+    key = DiskCache.hash_key("esearch")
+    store.put(key, "response")
+
+    with open(store._entry_path(key), "w") as entry:
+        entry.write("{not json")
+
+    assert store.get(key) is None
+
+
+def test_response_keys_ignore_the_spelling_of_the_query():
+    assert normalize_term("Cancer+AND++human") == normalize_term("  cancer and human ") == "cancer and human"
+    assert ResponseCache.build_key("esummary", "Cancer", None, 0, 20) == ResponseCache.build_key(
+        "esummary", "cancer", "gds", 0, 20
+    )
+    assert ResponseCache.build_key("esummary", "cancer", "gds", 0, 20) != ResponseCache.build_key(
+        "esummary", "cancer", "gds", 20, 20
+    )
+
+
+class _Session:
+    def __init__(self, text):
+        self.text = text
+        self.requests = 0
+
+    def request(self, method, url, **kwargs):
+        self.requests += 1
+        return types.SimpleNamespace(text=self.text, status_code=200, raise_for_status=lambda: None)
+
+
+def test_pages_are_served_from_the_cache(tmp_path, monkeypatch):
+    session = _Session('{"result": {"uids": ["200001"], "200001": {"uid": "200001"}}}')
+    monkeypatch.setattr(client, "get_session", lambda: session)
+    monkeypatch.setattr(client, "get_rate_limiter", lambda: types.SimpleNamespace(acquire=lambda: 0.0))
+    monkeypatch.setattr(cache, "_response_cache", ResponseCache(cache_dir=str(tmp_path)))
+
+    first = fetching.fetch_from_pos(0, term="cancer", batch_size=20, query_env=("MCID_1", "1"))
+    # A different session of the same search shares the entries
+    second = fetching.fetch_from_pos(0, term="Cancer", batch_size=20, query_env=("MCID_2", "1"))
+
+    assert session.requests == 1
+    assert second == first and second.uid_count == 1
+    # No request, nothing to time
+    assert second.latency is None
+
+    fetching.fetch_from_pos(0, term="cancer", batch_size=20, query_env=("MCID_1", "1"), use_cache=False)
+    assert session.requests == 2
@@ -0,0 +1,76 @@
+import threading
+
+from app.core.download import DownloadEngine, iter_sources
+
+
+def _sources(count, pulled=None):
+    for idx in range(count):
+        if pulled is not None:
+            pulled.append(idx)
+        yield f"geo/series/GSE{idx}/", f"GSE{idx}"
+
+
+def test_downloads_every_item_and_reports_the_failures():
+    def _extract(addr, fname):
+        if fname == "GSE3":
+            raise ValueError("Failed to parse the results")
+        return fname.lower()
+
+    engine = DownloadEngine(extract=_extract, workers=3)
+    results = {result.fname: result for result in engine.run(_sources(10))}
+
+    assert sorted(results) == sorted(f"GSE{idx}" for idx in range(10))
+    assert results["GSE1"].extracted == "gse1" and results["GSE1"].error is None
+    assert isinstance(results["GSE3"].error, ValueError)
+    assert (engine.completed, engine.failed) == (9, 1)
+
+
+def test_downloads_run_concurrently():
+    # Deadlocks (and times out) unless all the workers are downloading at once
+    barrier = threading.Barrier(4, timeout=5)
+
+    engine = DownloadEngine(extract=lambda addr, fname: barrier.wait(), workers=4)
+
+    assert all(result.error is None for result in engine.run(_sources(8)))
+
+
+def test_results_come_in_completion_order():
+    slow_started = threading.Event()
+    release_slow = threading.Event()
+
+    def _extract(addr, fname):
+        if fname == "GSE0":
+            slow_started.set()
+            release_slow.wait(5)
+        else:
+            slow_started.wait(5)
+        return fname
+
+    engine = DownloadEngine(extract=_extract, workers=2)
+    results = engine.run(_sources(2))
+
+    assert next(results).fname == "GSE1"
+    release_slow.set()
+    assert next(results).fname == "GSE0"
+
+
+def test_sources_are_consumed_lazily():
+    pulled = []
+    engine = DownloadEngine(extract=lambda addr, fname: fname, workers=2, window=3)
+
+    results = engine.run(_sources(1000, pulled=pulled))
+    next(results)
+
+    # No more than the window until the consumer comes back for more
+    assert len(pulled) == 3
+    results.close()
+
+
+def test_batches_are_flattened_into_items():
+    batches = iter([
+        {"1": ("geo/series/GSE1/", "GSE1"), "2": ("geo/series/GSE2/", "GSE2")},
+        {},
+        {"3": ("geo/series/GSE3/", "GSE3")},
+    ])
+
+    assert [fname for (_, fname) in iter_sources(batches)] == ["GSE1", "GSE2", "GSE3"]
@@ -0,0 +1,139 @@
+import json
+import pickle
+
+import pytest
+
+from app.parsers.series_matrix import iter_series_matrix_rows
+from app.processing_backends.definitions.local import LocalProcessingBackend
+from app.utils.columnar import (
+    EncodedRow,
+    PaddedRow,
+    compact_json_default,
+    decode_rows,
+    encode_row,
+    materialize_rows,
+    row_from_json,
+)
+
+
+def test_encoded_row_behaves_like_the_decoded_tuple():
+    plain = ("x", "y", "x", "x", "y")
+    row = EncodedRow.encode(plain)
+
+    assert row.values == ("x", "y")
+    assert row.codes.tolist() == [0, 1, 0, 0, 1]
+    assert row == plain and plain == row
+    assert row == EncodedRow.encode(list(plain))
+    assert hash(row) == hash(plain)
+    assert row[1] == "y" and row[-1] == "y"
+    assert row[1:3] == plain[1:3]
+    assert row + ("z",) == plain + ("z",)
+    assert row.decode() == plain
+
+
+def test_encoded_row_code_width():
+    assert EncodedRow.encode(["a", "b"]).codes.typecode == "B"
+    assert EncodedRow.encode([str(idx) for idx in range(300)]).codes.typecode == "H"
+
+
+def test_encoded_row_pickles():
+    row = EncodedRow.encode(["x", "y", "x"])
+    padded = PaddedRow(row, length=5)
+
+    assert pickle.loads(pickle.dumps(row)) == row
+    assert pickle.loads(pickle.dumps(padded)) == padded
+
+
+def test_encode_row_thresholds():
+    repetitive = ("GPL1",) * 10
+    distinct = tuple(str(idx) for idx in range(10))
+
+    assert isinstance(encode_row(repetitive), EncodedRow)
+    assert encode_row(distinct) is distinct
+    assert encode_row(("one",)) == ("one",)
+
+    already_padded = PaddedRow(("a",), length=3)
+    assert encode_row(already_padded) is already_padded
+
+
+@pytest.mark.parametrize("row", [
+    ("a", "b"),
+    PaddedRow(("a", "b"), length=4),
+    EncodedRow.encode(("a", "b", "a", "a")),
+    PaddedRow(EncodedRow.encode(("a", "a")), length=5),
+])
+def test_compact_json_round_trip(row):
+    written = json.dumps(row, default=compact_json_default)
+    read_back = row_from_json(json.loads(written))
+
+    assert read_back == tuple(row)
+    assert type(read_back) is type(row)
+
+
+def test_compact_json_does_not_repeat_the_padding():
+    row = PaddedRow(("broadcast",), length=1000)
+
+    assert json.loads(json.dumps(row, default=compact_json_default)) == {"values": ["broadcast"], "length": 1000}
+
+
+@pytest.mark.parametrize("lazy_padding", [False, True])
+def test_encoded_path_matches_baseline(series_matrix, baseline_normalized, lazy_padding):
+    normalized = LocalProcessingBackend.normalize_item(
+        series_matrix,
+        encode_metadata=True,
+        lazy_padding=lazy_padding
+    )
+
+    source_name = normalized['Sample_source_name_ch1']
+    if lazy_padding:
+        # Encoded first, then padded out
+        assert isinstance(source_name, PaddedRow) and isinstance(source_name.values, EncodedRow)
+    else:
+        # Padded into the encoding
+        assert isinstance(source_name, EncodedRow)
+        assert source_name.codes.tolist() == [0, 0, 0, 0]
+
+    # Mostly distinct values; not worth encoding
+    assert not isinstance(normalized['Sample_title'], EncodedRow)
+    # Neither are the table rows
+    assert type(normalized[None]) is tuple
+    assert materialize_rows(normalized) == baseline_normalized
+
+
+@pytest.mark.parametrize("lazy_padding", [False, True])
+def test_compact_output_round_trip(tmp_path, series_matrix, baseline_normalized, lazy_padding):
+    normalized = LocalProcessingBackend.normalize_item(
+        series_matrix,
+        encode_metadata=True,
+        lazy_padding=lazy_padding
+    )
+    savepath = LocalProcessingBackend.save_normalized(normalized, file=tmp_path / "normalized.json", compact=True)
+
+    with open(savepath) as saved:
+        raw = saved.read()
+
+    # The encoded rows are written with their values once
+    assert raw.count("skin") == 1
+    if lazy_padding:
+        # And so are the broadcast ones
+        assert raw.count("A small series") == 1
+
+    # JSON object keys are strings
+    expected = {("null" if key is None else key): vals for (key, vals) in baseline_normalized.items()}
+    assert decode_rows(json.loads(raw)) == expected
+
+
+def test_columnar_encoded_metadata_round_trip(tmp_path, series_matrix):
+    pytest.importorskip("numpy")
+    from app.utils.columnar import ColumnarMatrix, build_columnar
+
+    matrix = build_columnar(
+        [((row.key, row.values) for row in iter_series_matrix_rows(series_matrix))],
+        encode_metadata=True
+    )
+    assert isinstance(matrix.metadata["Sample_source_name_ch1"], EncodedRow)
+
+    loaded = ColumnarMatrix.load(matrix.save(tmp_path / "GSE1.npz"))
+
+    assert loaded.metadata == matrix.metadata
+    assert isinstance(loaded.metadata["Sample_source_name_ch1"], EncodedRow)
@@ -0,0 +1,83 @@
+import types
+
+import pytest
+
+from app.core.fetch import fetching
+from app.core.search import esummary
+
+
+class FakeEnvManager:
+    def __init__(self, count):
+        self.count = count
+
+    def get(self, term, db=None, date_filter=None):
+        return types.SimpleNamespace(count=self.count)
+
+
+@pytest.fixture
+def requested_pages(monkeypatch):
+    """Records the (position, batch size) of every page requested, in place of the remote."""
+    pages = []
+
+    def _fetch_from_pos(position, term, db=None, batch_size=None, date_filter=None, streaming=False, **kwargs):
+        pages.append((position, batch_size))
+        return fetching.SearchBatch({}, uid_count=batch_size)
+
+    monkeypatch.setattr(fetching, "fetch_from_pos", _fetch_from_pos)
+    return pages
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+@pytest.mark.parametrize(("count", "batch_size", "expected"), [
+    (1, 10, [(0, 10)]),
+    (10, 10, [(0, 10)]),
+    (11, 10, [(0, 10), (10, 10)]),
+    (25, 10, [(0, 10), (10, 10), (20, 10)]),
+])
+def test_concurrent_pages_start_at_the_first_record(
+    monkeypatch, requested_pages, ordered, count, batch_size, expected
+):
+    monkeypatch.setattr(fetching, "get_query_env_manager", lambda: FakeEnvManager(count))
+
+    batches = list(fetching.fetch_all_concurrent("term", batch_size=batch_size, concurrency=2, ordered=ordered))
+
+    assert len(batches) == len(expected)
+    assert sorted(requested_pages) == expected
+
+
+def test_concurrent_pages_follow_the_new_batch_size(monkeypatch, requested_pages):
+    monkeypatch.setattr(fetching, "get_query_env_manager", lambda: FakeEnvManager(30))
+
+    fetcher = fetching.fetch_all_concurrent("term", batch_size=10, concurrency=1)
+    next(fetcher)
+    with pytest.raises(StopIteration):
+        while True:
+            fetcher.send(20)
+
+    assert requested_pages == [(0, 10), (10, 20)]
+
+
+def test_no_pages_for_no_results(monkeypatch, requested_pages):
+    monkeypatch.setattr(fetching, "get_query_env_manager", lambda: FakeEnvManager(0))
+
+    assert list(fetching.fetch_all_concurrent("term")) == []
+    assert requested_pages == []
+
+
+def test_sequential_pages_start_at_the_first_record(monkeypatch):
+    requested = []
+    page_sizes = iter([5, 5, 0])
+
+    def _fetch_from_pos(position, term, db=None, batch_size=None, date_filter=None, streaming=False, **kwargs):
+        requested.append((position, batch_size))
+        return fetching.SearchBatch({}, uid_count=next(page_sizes))
+
+    monkeypatch.setattr(fetching, "fetch_from_pos", _fetch_from_pos)
+
+    assert len(list(fetching.fetch_all("term", batch_size=5))) == 3
+    assert requested == [(0, 5), (5, 5), (10, 5)]
+
+
+def test_search_url_sends_the_first_offset():
+    assert "&retstart=0&" in esummary.build_search_url(webenv="env", query_key="1", retstart=0, retmax=5)
+    assert "&retstart=20&" in esummary.build_search_url(webenv="env", query_key="1", retstart=20, retmax=5)
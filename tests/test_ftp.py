@@ -0,0 +1,137 @@
+import gzip
+import random
+
+import pytest
+
+import app.constants as const
+from app.processing_backends.definitions.local import MetadataRowCollector
+from app.utils.ftp import RawReader, fetch_ftp, stream_ftp
+from app.utils.ftp_pool import FtpConnectionPool, absolute_ftp_path
+
+SERIES_DIRS = ["geo/series/GSE1nnn/GSE1/matrix/", "geo/series/GSE2nnn/GSE2/matrix/"]
+
+
+@pytest.fixture
+def served(ftp_server, series_matrix):
+    """Serves a series matrix file for each of SERIES_DIRS; returns the uncompressed text."""
+    for address in SERIES_DIRS:
+        accession = address.rstrip("/").split("/")[-2]
+        ftp_server.files[f"/{address}{accession}_series_matrix.txt.gz"] = gzip.compress(series_matrix.encode())
+    return series_matrix
+
+
+def _fetch(address, filename, pool):
+    """Fetches a file, handing back its decompressed text."""
+    local_copy, err = fetch_ftp(address, filename, pool=pool, reader_factory=RawReader)
+    if local_copy is None:
+        return None, err
+
+    with gzip.open(local_copy.path, "rt") as contents:
+        text = contents.read()
+    local_copy.release()
+    return text, err
+
+
+def _commands(server, since):
+    return [line.split(" ")[0] for line in server.commands[since:]]
+
+
+def test_paths_are_made_absolute():
+    assert absolute_ftp_path("geo/series/GSE1nnn/GSE1/matrix/") == "/geo/series/GSE1nnn/GSE1/matrix"
+    assert absolute_ftp_path("/geo//series/../series/") == "/geo/series"
+    assert absolute_ftp_path("") == "/"
+
+
+def test_redundant_commands_are_skipped(ftp_server):
+    client = ftp_server.connect()
+    since = len(ftp_server.commands)
+
+    client.cwd("/geo/series")
+    client.cwd("/geo/series/")
+    client.cwd("GSE1nnn")
+    client.voidcmd("TYPE I")
+    client.voidcmd("TYPE I")
+    client.sendcmd("TYPE A")
+
+    assert ftp_server.commands[since:] == ["CWD /geo/series", "CWD /geo/series/GSE1nnn", "TYPE I", "TYPE A"]
+    assert client.round_trips == len(ftp_server.commands)
+
+
+def test_items_reuse_the_logged_in_connection(ftp_server, served, listing_cache):
+    pool = FtpConnectionPool(size=2, client_builder=ftp_server.connect)
+
+    assert _fetch(SERIES_DIRS[0], "GSE1_", pool=pool) == (served, None)
+    since = len(ftp_server.commands)
+    assert _fetch(SERIES_DIRS[1], "GSE2_", pool=pool) == (served, None)
+
+    assert ftp_server.logins == 1
+    # No walking the directory tree; the listing and the download go by absolute paths
+    assert _commands(ftp_server, since) == ["TYPE", "PASV", "MLSD", "TYPE", "PASV", "RETR"]
+    assert ftp_server.commands[-1] == "RETR /geo/series/GSE2nnn/GSE2/matrix/GSE2_series_matrix.txt.gz"
+    assert pool.stats()["round_trips"] == len(ftp_server.commands)
+
+
+def test_nothing_is_fetched_from_an_empty_directory(ftp_server, listing_cache):
+    pool = FtpConnectionPool(size=1, client_builder=ftp_server.connect)
+
+    result, err = _fetch(SERIES_DIRS[0], "GSE1_", pool=pool)
+
+    # Nothing listed, nothing fetched
+    assert (result, err) == (None, None)
+    assert "RETR" not in _commands(ftp_server, 0)
+
+
+@pytest.fixture
+def large_file(ftp_server, monkeypatch):
+    """Serves a file large enough to break off midway; returns its uncompressed contents."""
+    monkeypatch.setattr(const, "DEFAULT_FTP_RETRY_BACKOFF", 0)
+    contents = "\n".join(f'"p{idx}"\t{random.random()}\t{random.random()}' for idx in range(20000))
+    ftp_server.files[f"/{SERIES_DIRS[0]}GSE1_series_matrix.txt.gz"] = gzip.compress(contents.encode())
+    return contents
+
+
+def _retrieved(server):
+    return [line for line in server.commands if line.split(" ")[0] in ("REST", "RETR")]
+
+
+def test_broken_transfers_are_resumed(ftp_server, large_file, listing_cache):
+    ftp_server.break_after = 50000
+    pool = FtpConnectionPool(size=1, client_builder=ftp_server.connect)
+
+    assert _fetch(SERIES_DIRS[0], "GSE1_", pool=pool) == (large_file, None)
+
+    target = f"/{SERIES_DIRS[0]}GSE1_series_matrix.txt.gz"
+    assert _retrieved(ftp_server) == [f"RETR {target}", "REST 50000", f"RETR {target}"]
+    # The broken connection was not reused
+    assert ftp_server.logins == 2
+
+
+def test_transfers_restart_if_the_server_cannot_resume(ftp_server, large_file, listing_cache):
+    ftp_server.break_after = 50000
+    ftp_server.supports_rest = False
+    pool = FtpConnectionPool(size=1, client_builder=ftp_server.connect)
+
+    # Had the received part been kept, the file would have come out garbled
+    assert _fetch(SERIES_DIRS[0], "GSE1_", pool=pool) == (large_file, None)
+
+    target = f"/{SERIES_DIRS[0]}GSE1_series_matrix.txt.gz"
+    assert _retrieved(ftp_server) == [f"RETR {target}", "REST 50000", f"RETR {target}"]
+
+
+def test_metadata_transfers_are_aborted_at_the_table(ftp_server, series_matrix, listing_cache):
+    header, _, _ = series_matrix.partition("!series_matrix_table_begin")
+    table = "\n".join(f'"p{idx}"\t{random.random()}\t{random.random()}\t{random.random()}' for idx in range(20000))
+    ftp_server.files[f"/{SERIES_DIRS[0]}GSE1_series_matrix.txt.gz"] = gzip.compress(
+        f"{header}!series_matrix_table_begin\n{table}\n!series_matrix_table_end\n".encode()
+    )
+    pool = FtpConnectionPool(size=1, client_builder=ftp_server.connect)
+
+    rows, err = stream_ftp(SERIES_DIRS[0], "GSE1_", sink_factory=MetadataRowCollector, pool=pool)
+
+    assert err is None
+    assert [key for (key, _) in rows][:2] == ["Series_title", "Series_geo_accession"]
+    assert "ABOR" in ftp_server.commands
+    # Aborted cleanly, so the connection is good for the next item
+    rows, err = stream_ftp(SERIES_DIRS[0], "GSE1_", sink_factory=MetadataRowCollector, pool=pool)
+    assert err is None and len(rows) > 0
+    assert ftp_server.logins == 1
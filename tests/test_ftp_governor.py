@@ -0,0 +1,150 @@
+import contextlib
+import ftplib
+import socket
+import threading
+
+import pytest
+
+from app.utils import ftp
+from app.utils.ftp import TransferIncomplete, fetch_ftp
+from app.utils.ftp_governor import FtpConcurrencyGovernor, is_backoff_error
+from app.utils.ftp_pool import FtpConnectError, FtpConnectionPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def _connect_error(cause):
+    try:
+        raise FtpConnectError("Could not connect") from cause
+    except FtpConnectError as E:
+        return E
+
+
+@pytest.mark.parametrize(("error", "backoff"), [
+    (ftplib.error_temp("421 Too many connections"), True),
+    (ftplib.error_temp("450 File unavailable"), True),
+    (_connect_error(ConnectionRefusedError()), True),
+    (_connect_error(socket.timeout()), True),
+    # The server let us in; these say nothing about its load
+    (TransferIncomplete("Received 10 of 20 bytes"), False),
+    (EOFError(), False),
+    (socket.timeout(), False),
+    (ConnectionResetError(), False),
+    (ftplib.error_perm("550 No such file"), False),
+    (ValueError("Failed to parse the results"), False),
+])
+def test_only_refusals_and_overload_back_off(error, backoff):
+    assert is_backoff_error(error) is backoff
+
+
+def _run_transfers(governor, clock, count, nbytes=1000, seconds=1.0, error=None):
+    for _ in range(count):
+        governor.acquire()
+        clock.now += seconds
+        governor.release(nbytes=nbytes, error=error)
+
+
+def test_limit_grows_per_round_and_halves_on_refusals():
+    clock = FakeClock()
+    governor = FtpConcurrencyGovernor(initial_limit=2, max_limit=8, clock=clock)
+
+    # A round is as many completions as the limit; the throughput holds, so the limit grows
+    _run_transfers(governor, clock, 2)
+    assert governor.limit == 3
+    _run_transfers(governor, clock, 3)
+    assert governor.limit == 4
+
+    governor.acquire()
+    governor.release(error=ftplib.error_temp("421 Too many connections"))
+    assert governor.limit == 2
+
+    governor.acquire()
+    governor.release(error=_connect_error(socket.timeout()))
+    assert governor.limit == 1
+
+    stats = governor.stats()
+    assert (stats["completed"], stats["refusals"], stats["timeouts"], stats["decreases"]) == (5, 1, 1, 2)
+
+
+def test_limit_holds_when_the_throughput_drops():
+    clock = FakeClock()
+    governor = FtpConcurrencyGovernor(initial_limit=2, max_limit=8, clock=clock)
+
+    _run_transfers(governor, clock, 2)
+    # Three times as slow per round
+    _run_transfers(governor, clock, 3, seconds=2.0)
+
+    assert governor.limit == 3
+
+
+def test_hard_failures_are_neither_completions_nor_refusals():
+    clock = FakeClock()
+    governor = FtpConcurrencyGovernor(initial_limit=2, max_limit=8, clock=clock)
+
+    _run_transfers(governor, clock, 4, error=ftplib.error_perm("550 No such file"))
+    _run_transfers(governor, clock, 1, error=TransferIncomplete("Received 10 of 20 bytes"))
+
+    assert governor.limit == 2
+    stats = governor.stats()
+    assert (stats["completed"], stats["failed"], stats["refusals"]) == (0, 5, 0)
+
+
+def test_acquire_waits_for_a_free_slot():
+    governor = FtpConcurrencyGovernor(initial_limit=1, max_limit=1)
+    governor.acquire()
+    acquired = threading.Event()
+
+    def _second():
+        governor.acquire()
+        acquired.set()
+
+    threading.Thread(target=_second, daemon=True).start()
+    assert not acquired.wait(0.1)
+
+    governor.release(nbytes=10)
+    assert acquired.wait(1.0)
+
+
+def test_pool_reports_refused_connections():
+    def _refused():
+        raise ConnectionRefusedError("Connection refused")
+
+    pool = FtpConnectionPool(size=1, client_builder=_refused)
+
+    with pytest.raises(FtpConnectError) as raised:
+        pool.acquire()
+    assert isinstance(raised.value.__cause__, ConnectionRefusedError)
+
+    # The slot is not lost
+    with pytest.raises(FtpConnectError):
+        pool.acquire(timeout=0.1)
+
+
+class FakePool:
+    @contextlib.contextmanager
+    def connection(self):
+        yield object()
+
+
+@pytest.mark.parametrize(("outcome", "counter"), [
+    ((None, ftplib.error_perm("550 No such file"), 0), "failed"),
+    ((None, ValueError("Failed to parse the results"), 0), "failed"),
+    (("contents", None, 100), "completed"),
+])
+def test_fetch_reports_the_outcome_to_the_governor(monkeypatch, outcome, counter):
+    governor = FtpConcurrencyGovernor(initial_limit=1, max_limit=4)
+    monkeypatch.setattr(ftp, "_fetch_with_client", lambda *args, **kwargs: outcome)
+
+    result, err = fetch_ftp("geo/series/GSE1nnn/GSE1/matrix/", "GSE1", pool=FakePool(), governor=governor)
+
+    assert (result, err) == outcome[:2]
+    stats = governor.stats()
+    assert stats[counter] == 1
+    assert stats["completed"] + stats["failed"] == 1
+    assert stats["in_flight"] == 0
@@ -0,0 +1,85 @@
+import gzip
+
+from app.utils.ftp import ftp_file_facts, ftp_listdir
+from app.utils.ftp_listing import FileFacts, ListingCache
+
+LISTING = [("GSE1_series_matrix.txt.gz", {"type": "file", "size": "1234", "modify": "20240101000000"})]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_listings_are_keyed_by_the_absolute_path():
+    listing_cache = ListingCache()
+    listing_cache.put("geo/series/GSE1nnn/GSE1/matrix/", LISTING)
+
+    assert listing_cache.get("/geo/series/GSE1nnn/GSE1/matrix") == tuple(LISTING)
+    assert listing_cache.get("geo/series/GSE2nnn/GSE2/matrix/") is None
+
+    listing_cache.invalidate("/geo/series/GSE1nnn/GSE1/matrix/")
+    assert listing_cache.get("geo/series/GSE1nnn/GSE1/matrix/") is None
+    assert listing_cache.stats() == dict(hits=1, misses=2, stores=1, evictions=0)
+
+
+def test_listings_expire():
+    clock = FakeClock()
+    listing_cache = ListingCache(ttl=60, clock=clock)
+    listing_cache.put("geo/series/", LISTING)
+
+    clock.now = 60
+    assert listing_cache.get("geo/series/") is not None
+    clock.now = 61
+    assert listing_cache.get("geo/series/") is None
+
+
+def test_least_recently_used_listings_are_evicted():
+    listing_cache = ListingCache(max_entries=2)
+    listing_cache.put("a", LISTING)
+    listing_cache.put("b", LISTING)
+    listing_cache.get("a")
+    listing_cache.put("c", LISTING)
+
+    assert listing_cache.get("b") is None
+    assert listing_cache.get("a") is not None and listing_cache.get("c") is not None
+    assert listing_cache.stats()["evictions"] == 1
+
+
+def test_listings_persist_across_runs(tmp_path):
+    ListingCache(persistent=True, cache_dir=str(tmp_path)).put("geo/series/", LISTING)
+
+    assert ListingCache(persistent=True, cache_dir=str(tmp_path)).get("geo/series/") == tuple(LISTING)
+    # Listings of another server are not mixed in
+    assert ListingCache(persistent=True, cache_dir=str(tmp_path), host="ftp.example.org").get("geo/series/") is None
+
+
+def test_disabled_cache_keeps_nothing():
+    listing_cache = ListingCache(enabled=False)
+
+    assert listing_cache.put("geo/series/", LISTING) == tuple(LISTING)
+    assert listing_cache.get("geo/series/") is None
+
+
+def test_file_facts_are_parsed_from_the_listing():
+    assert FileFacts.from_mlsd(*LISTING[0]) == FileFacts("GSE1_series_matrix.txt.gz", 1234, "20240101000000", "file")
+    assert FileFacts.from_mlsd("GSE1_family.xml.tgz", {"size": ""}).size is None
+
+
+def test_directories_are_listed_once(ftp_server, listing_cache):
+    body = gzip.compress(b"!Series_title")
+    ftp_server.files["/geo/series/GSE1nnn/GSE1/matrix/GSE1_series_matrix.txt.gz"] = body
+    client = ftp_server.connect()
+
+    first = ftp_listdir("geo/series/GSE1nnn/GSE1/matrix/", client=client)
+    facts = ftp_file_facts("/geo/series/GSE1nnn/GSE1/matrix", "GSE1_", client=client)
+
+    assert [name for (name, _) in first] == ["GSE1_series_matrix.txt.gz"]
+    assert [(fact.name, fact.size) for fact in facts] == [("GSE1_series_matrix.txt.gz", len(body))]
+    assert ftp_server.commands.count("MLSD /geo/series/GSE1nnn/GSE1/matrix") == 1
+
+    ftp_listdir("geo/series/GSE1nnn/GSE1/matrix/", client=client, use_cache=False)
+    assert ftp_server.commands.count("MLSD /geo/series/GSE1nnn/GSE1/matrix") == 2
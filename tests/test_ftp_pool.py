@@ -0,0 +1,149 @@
+import ftplib
+import threading
+
+import pytest
+
+from app.utils.ftp_pool import FtpConnectionPool
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeClient:
+    """A logged-in connection that answers NOOPs (or not) and records whether it was closed."""
+
+    def __init__(self, alive=True):
+        self.alive = alive
+        self.noops = 0
+        self.closed = False
+
+    def voidcmd(self, cmd):
+        self.noops += 1
+        if not self.alive:
+            raise EOFError()
+        return "200 NOOP ok"
+
+    def quit(self):
+        self.closed = True
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def clients():
+    """The connections made by the pool, in order."""
+    return []
+
+
+@pytest.fixture
+def make_pool(clients):
+    def _make_pool(**kwargs):
+        def _builder():
+            clients.append(FakeClient())
+            return clients[-1]
+
+        return FtpConnectionPool(client_builder=_builder, **kwargs)
+
+    return _make_pool
+
+
+def test_connections_are_reused(make_pool, clients):
+    pool = make_pool(size=2)
+
+    for _ in range(5):
+        with pool.connection() as client:
+            assert client is clients[0]
+
+    stats = pool.stats()
+    assert (stats["created"], stats["reused"], stats["idle"]) == (1, 4, 1)
+
+
+def test_acquire_waits_while_the_pool_is_exhausted(make_pool):
+    pool = make_pool(size=1)
+    client = pool.acquire()
+
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.05)
+
+    acquired = []
+    waiter = threading.Thread(target=lambda: acquired.append(pool.acquire(timeout=5)))
+    waiter.start()
+    pool.release(client)
+    waiter.join()
+
+    assert acquired == [client]
+
+
+def test_broken_connections_are_discarded(make_pool, clients):
+    pool = make_pool(size=1)
+
+    with pytest.raises(EOFError):
+        with pool.connection():
+            raise EOFError()
+
+    assert clients[0].closed
+    # Errors of the request itself leave the connection be
+    with pytest.raises(ftplib.error_perm):
+        with pool.connection():
+            raise ftplib.error_perm("550 No such file")
+
+    assert not clients[1].closed
+    assert pool.stats()["discarded"] == 1
+
+
+def test_idle_connections_are_checked_before_reuse(make_pool, clients):
+    clock = FakeClock()
+    pool = make_pool(size=2, idle_timeout=300, health_check_after=10, clock=clock)
+
+    with pool.connection():
+        pass
+    clock.now = 5
+    with pool.connection():
+        pass
+    # Used recently enough to be trusted
+    assert clients[0].noops == 0
+
+    clients[0].alive = False
+    clock.now = 20
+    with pool.connection() as client:
+        assert client is clients[1]
+
+    assert clients[0].closed
+    assert pool.stats()["health_check_failures"] == 1
+
+
+def test_stale_connections_are_closed(make_pool, clients):
+    clock = FakeClock()
+    pool = make_pool(size=2, idle_timeout=300, clock=clock)
+
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    clock.now = 200
+    pool.release(second)
+
+    clock.now = 400
+    assert pool.evict_idle() == 1
+    assert first.closed and not second.closed
+
+    clock.now = 600
+    with pool.connection() as client:
+        assert client is clients[2]
+    assert second.closed
+
+
+def test_close_closes_the_idle_connections(make_pool, clients):
+    pool = make_pool(size=2)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+
+    pool.close()
+
+    assert first.closed and not second.closed
+    assert pool.stats()["idle"] == 0
+
@@ -0,0 +1,123 @@
+import gzip
+
+import pytest
+
+from app.processing_backends.definitions.local import LocalProcessingBackend, RowCollector, SpooledRows
+from app.utils.ftp import StreamingReader
+from app.utils.gzstream import GzipLineDecoder, iter_gzip_lines
+
+TEXT = "\n".join(f"line{idx}\tvalue {idx}" for idx in range(2000))
+
+
+def chunked(data: bytes, chunk_size: int):
+    return [data[offset:offset + chunk_size] for offset in range(0, len(data), chunk_size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 1024, 1 << 20])
+def test_lines_match_the_decompressed_text(chunk_size):
+    data = gzip.compress(TEXT.encode("utf8"))
+
+    assert list(iter_gzip_lines(chunked(data, chunk_size))) == TEXT.split("\n")
+
+
+def test_trailing_newline_does_not_add_a_line():
+    data = gzip.compress(b"a\nb\n")
+
+    assert list(iter_gzip_lines([data])) == ["a", "b"]
+
+
+def test_multibyte_characters_split_across_chunks():
+    text = "zażółć\ngeślą jaźń"
+    data = gzip.compress(text.encode("utf8"))
+
+    assert list(iter_gzip_lines(chunked(data, 1))) == text.split("\n")
+
+
+@pytest.mark.parametrize("chunk_size", [3, 1 << 20])
+def test_multi_member_stream(chunk_size):
+    # A line may span two members, like in a file written in several gzip.open(..., 'ab') sessions
+    data = gzip.compress(b"a\nb\nhal") + gzip.compress(b"f\nc") + gzip.compress(b"\nd")
+
+    assert list(iter_gzip_lines(chunked(data, chunk_size))) == ["a", "b", "half", "c", "d"]
+
+
+def test_truncated_stream_raises():
+    data = gzip.compress(TEXT.encode("utf8"))
+
+    with pytest.raises(EOFError):
+        list(iter_gzip_lines([data[:len(data) // 2]]))
+
+    # Same as gzip itself
+    with pytest.raises(EOFError):
+        gzip.decompress(data[:len(data) // 2])
+
+
+def test_truncated_at_any_point_raises():
+    data = gzip.compress(b"abc\ndef\n")
+
+    for cut in range(1, len(data)):
+        with pytest.raises(EOFError):
+            list(iter_gzip_lines([data[:cut]]))
+
+
+def test_truncated_second_member_raises():
+    first = gzip.compress(b"a\nb\n")
+    second = gzip.compress(b"c\nd\n")
+
+    # Ending right between the members is a complete stream...
+    assert list(iter_gzip_lines([first])) == ["a", "b"]
+
+    # ...but not anywhere inside the second one
+    with pytest.raises(EOFError):
+        list(iter_gzip_lines([first + second[:len(second) - 4]]))
+
+
+def test_empty_stream():
+    assert list(iter_gzip_lines([])) == []
+
+
+def test_byte_counters():
+    raw = TEXT.encode("utf8")
+    data = gzip.compress(raw)
+    decoder = GzipLineDecoder()
+
+    for chunk in chunked(data, 100):
+        decoder.feed(chunk)
+    decoder.flush()
+
+    assert decoder.compressed_bytes == len(data)
+    assert decoder.decompressed_bytes == len(raw)
+
+
+def test_streaming_download_matches_baseline(series_matrix, baseline_normalized):
+    reader = StreamingReader(fname="GSE1_series_matrix.txt.gz", sink=RowCollector())
+
+    for chunk in chunked(gzip.compress(series_matrix.encode("utf8")), 7):
+        reader(chunk)
+
+    parsed = reader.finish()
+
+    assert isinstance(parsed, SpooledRows)
+    assert LocalProcessingBackend.normalize_item(parsed) == baseline_normalized
+
+
+def test_streaming_download_restarts_from_scratch(series_matrix, baseline_normalized):
+    data = gzip.compress(series_matrix.encode("utf8"))
+    reader = StreamingReader(sink=RowCollector(), spool=True)
+
+    reader(data[:len(data) // 2])
+    # A transfer that could not be resumed starts over
+    reader.reset()
+    reader(data)
+
+    assert reader.spool.tell() == len(data)
+    assert LocalProcessingBackend.normalize_item(reader.finish()) == baseline_normalized
+
+
+def test_truncated_download_has_no_result(series_matrix):
+    data = gzip.compress(series_matrix.encode("utf8"))
+    reader = StreamingReader(sink=RowCollector())
+
+    reader(data[:-10])
+
+    assert reader.finish() is None
@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from app.core.search import esearch, esummary
+from app.core.search.history import QueryEnvManager
+
+
+@pytest.mark.parametrize(("response", "expired"), [
+    ({"esummaryresult": ["Unable to obtain query #1"]}, True),
+    ({"error": "Cannot retrieve query from history"}, True),
+    ({"error": {"history": "Cannot retrieve history data. query_key: 1, WebEnv: MCID_1"}}, True),
+    # Malformed requests name the parameters too, but a fresh session would not fix them
+    ({"error": "Invalid query_key"}, False),
+    ({"error": "WebEnv parameter is required"}, False),
+    ({"esummaryresult": ["Invalid uid 123 at position=0"]}, False),
+    ({"result": {"uids": []}}, False),
+])
+def test_only_real_expiry_messages_count(response, expired):
+    raw = json.dumps(response)
+
+    assert esummary.is_query_env_expired(raw) is expired
+
+    parser = esummary.SearchStreamParser()
+    parser.parse([raw.encode("utf8")])
+    assert parser.is_query_env_expired() is expired
+
+
+def test_malformed_responses_are_not_expired():
+    assert not esummary.is_query_env_expired("")
+    assert not esummary.is_query_env_expired("<html>Bad Gateway</html>")
+    assert not esummary.is_query_env_expired("[]")
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def searches(monkeypatch):
+    """Counts the ESearch calls, handing out a new WebEnv for each."""
+    calls = []
+
+    def _get_query_info(term, db=None, date_filter=None):
+        calls.append((term, db, date_filter))
+        return f"MCID_{len(calls)}", "1", 42
+
+    monkeypatch.setattr(esearch, "get_query_info", _get_query_info)
+    return calls
+
+
+def test_sessions_are_reused_per_query(searches):
+    manager = QueryEnvManager(max_age=None)
+
+    first = manager.get("Cancer  AND human", db="gds")
+    # Trivially different spellings of the same query share the session
+    assert manager.get("cancer+and+human", db="gds") is first
+    assert (first.webenv, first.query_key, first.count) == ("MCID_1", "1", 42)
+
+    assert manager.get("cancer and human", db="pubmed").webenv == "MCID_2"
+    date_filter = esearch.DateFilter(mindate="2024/01/01", maxdate="2024/12/31")
+    assert manager.get("cancer and human", db="gds", date_filter=date_filter).webenv == "MCID_3"
+    assert len(searches) == 3
+    assert manager.refresh_count == 0
+
+
+def test_old_sessions_are_refreshed(searches):
+    clock = FakeClock()
+    manager = QueryEnvManager(max_age=60, clock=clock)
+
+    assert manager.get("cancer").webenv == "MCID_1"
+    clock.now = 30
+    assert manager.get("cancer").webenv == "MCID_1"
+    clock.now = 61
+    assert manager.get("cancer").webenv == "MCID_2"
+    assert manager.refresh_count == 1
+
+
+def test_expired_sessions_are_refreshed_once(searches):
+    manager = QueryEnvManager(max_age=None)
+    stale = manager.get("cancer")
+
+    refreshed = manager.refresh("cancer", stale_webenv=stale.webenv)
+    assert refreshed.webenv == "MCID_2"
+
+    # Another thread reporting the same stale session keeps the fresh one
+    assert manager.refresh("cancer", stale_webenv=stale.webenv) is refreshed
+    assert manager.refresh_count == 1
+
+    # Nothing to drop for a query never run
+    manager.invalidate("something else")
+    assert len(searches) == 2
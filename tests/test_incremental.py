@@ -0,0 +1,88 @@
+import datetime
+
+import pytest
+
+from app.core.fetch.incremental import QueryWatermark, load_watermark, only_new
+
+RUN_DATE = datetime.date(2024, 3, 31)
+
+
+def _batches(*batches):
+    """A batch coroutine over the given UIDs, each downloaded from its own location; records the sizes sent to it."""
+    sizes = []
+
+    def _source():
+        for uids in batches:
+            sizes.append((yield {uid: ("geo/series/GSEnnn/", f"GSE{uid}") for uid in uids}))
+
+    return _source(), sizes
+
+
+def test_first_run_is_a_full_run(tmp_path):
+    watermark = load_watermark("cancer", state_dir=str(tmp_path))
+
+    assert watermark.last_date is None and watermark.date_filter() is None
+    assert watermark.is_new("1")
+
+
+def test_later_runs_search_from_the_last_run(tmp_path):
+    watermark = load_watermark("cancer", state_dir=str(tmp_path))
+    watermark.commit(run_date=datetime.date(2024, 3, 1))
+
+    # Trivially different spellings of the query share the state
+    date_filter = load_watermark("Cancer ", state_dir=str(tmp_path)).date_filter(run_date=RUN_DATE)
+    assert (date_filter.mindate, date_filter.maxdate, date_filter.datetype) == ("2024/03/01", "2024/03/31", "pdat")
+
+    assert load_watermark("cancer", db="pubmed", state_dir=str(tmp_path)).last_date is None
+    assert load_watermark("cancer", datetype="mdat", state_dir=str(tmp_path)).last_date is None
+
+
+def test_unreadable_state_means_a_full_run(tmp_path):
+    watermark = QueryWatermark("cancer", state_dir=str(tmp_path))
+    with open(watermark.path, "w") as state_file:
+        state_file.write("{not json")
+
+    assert watermark.load().last_date is None
+
+
+def test_only_the_unseen_results_are_passed_through(tmp_path):
+    watermark = load_watermark("cancer", state_dir=str(tmp_path))
+    watermark.mark_seen(["1", "3"])
+    source, sizes = _batches(["1", "2"], ["3", "4"], ["5"])
+
+    fetcher = only_new(source, watermark=watermark)
+    assert list(next(fetcher)) == ["2"]
+    assert list(fetcher.send(50)) == ["4"]
+    assert list(next(fetcher)) == ["5"]
+    with pytest.raises(StopIteration):
+        next(fetcher)
+
+    # The new batch size reaches the source
+    assert sizes[0] == 50
+    assert sorted(uid for uids in watermark.pending.values() for uid in uids) == ["2", "4", "5"]
+
+
+def test_updates_are_passed_through_when_tracking_modifications(tmp_path):
+    watermark = load_watermark("cancer", datetype="mdat", state_dir=str(tmp_path))
+    watermark.mark_seen(["1"])
+    source, _ = _batches(["1", "2"])
+
+    assert list(next(only_new(source, watermark=watermark))) == ["1", "2"]
+
+
+def test_only_the_processed_results_are_committed(tmp_path):
+    watermark = load_watermark("cancer", state_dir=str(tmp_path))
+    source, _ = _batches(["1", "2"])
+    list(only_new(source, watermark=watermark))
+
+    # The download of GSE2 failed
+    watermark.acknowledge(("geo/series/GSEnnn/", "GSE1"))
+    watermark.commit(run_date=RUN_DATE)
+
+    reloaded = load_watermark("cancer", state_dir=str(tmp_path))
+    assert reloaded.seen_uids == {"1"}
+    # The date stays put, so that the next run searches for the failed one again
+    assert reloaded.last_date is None
+
+    reloaded.commit(run_date=RUN_DATE)
+    assert load_watermark("cancer", state_dir=str(tmp_path)).last_date == "2024/03/31"
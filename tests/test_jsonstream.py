@@ -0,0 +1,99 @@
+import json
+
+import pytest
+import requests
+
+from app.core.fetch import fetching
+from app.core.search import cache, esummary
+from app.core.search.cache import ResponseCache
+from app.utils.jsonstream import JsonStreamCursor
+
+RESPONSE = {
+    "header": {"type": "esummary", "version": "0.3"},
+    "result": {
+        "uids": ["200012345", "200000012"],
+        "200012345": {"uid": "200012345", "title": "Żółć – 12345", "ftplink": "ftp://ftp.ncbi.nlm.nih.gov/geo/series/GSE12nnn/GSE12345/", "n_samples": 123456},
+        "200000012": {"uid": "200000012", "title": "Short", "ftplink": "ftp://ftp.ncbi.nlm.nih.gov/geo/series/GSEnnn/GSE12/"},
+    },
+}
+
+
+def _chunked(text, size):
+    raw = text.encode("utf8")
+    return [raw[idx:idx + size] for idx in range(0, len(raw), size)]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 7, 1 << 20])
+def test_cursor_walks_the_document_across_chunk_boundaries(chunk_size):
+    # Single bytes split the multibyte characters and the numbers alike
+    cursor = JsonStreamCursor(_chunked(json.dumps(RESPONSE, ensure_ascii=False, indent=2), chunk_size))
+
+    parsed = {}
+    for top_key in cursor.iter_object():
+        if top_key != "result":
+            parsed[top_key] = cursor.decode_value()
+            continue
+        parsed[top_key] = {uid: cursor.decode_value() for uid in cursor.iter_object()}
+
+    assert parsed == RESPONSE
+    assert cursor.peek() is None
+
+
+def test_cursor_walks_empty_objects():
+    cursor = JsonStreamCursor(["{ }"])
+
+    assert list(cursor.iter_object()) == []
+
+
+def test_cursor_rejects_malformed_documents():
+    cursor = JsonStreamCursor([b'{"result": {"uids": ['])
+
+    with pytest.raises(ValueError):
+        for _ in cursor.iter_object():
+            cursor.decode_value()
+
+
+def test_parser_keeps_only_the_requested_fields():
+    parser = esummary.SearchStreamParser()
+
+    results = parser.parse(_chunked(json.dumps(RESPONSE), 5))
+
+    assert results == {uid: {"ftplink": record["ftplink"]} for (uid, record) in RESPONSE["result"].items() if uid != "uids"}
+    assert parser.complete
+    assert parser.errors == {}
+    # Readable as a regular response
+    assert esummary.parse_search_response(esummary.build_compact_response(results)) == results
+
+
+def test_parser_returns_nothing_for_a_malformed_stream():
+    parser = esummary.SearchStreamParser()
+    truncated = json.dumps(RESPONSE)[:-40]
+
+    assert parser.parse(_chunked(truncated, 16)) == {}
+    assert not parser.complete
+
+
+def test_parser_raises_when_the_connection_breaks_off():
+    def _broken_stream():
+        yield json.dumps(RESPONSE)[:100].encode("utf8")
+        raise requests.ConnectionError("Connection reset by peer")
+
+    parser = esummary.SearchStreamParser()
+    with pytest.raises(requests.ConnectionError):
+        parser.parse(_broken_stream())
+    assert not parser.complete
+
+
+@pytest.mark.parametrize(("body", "cached"), [
+    (json.dumps(RESPONSE), True),
+    (json.dumps(RESPONSE)[:-40], False),
+])
+def test_only_fully_streamed_pages_are_cached(tmp_path, monkeypatch, body, cached):
+    monkeypatch.setattr(cache, "_response_cache", ResponseCache(cache_dir=str(tmp_path)))
+    monkeypatch.setattr(esummary, "stream_search_results", lambda url, form_data=None: iter(_chunked(body, 64)))
+
+    batch = fetching.fetch_by_ids(["200012345", "200000012"], streaming=True)
+
+    assert bool(batch) is cached
+    assert batch.nbytes == len(body)
+    assert bool(list(cache.get_response_cache()._iter_entries())) is cached
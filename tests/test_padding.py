@@ -0,0 +1,98 @@
+import json
+import pickle
+
+import pytest
+
+from app.processing_backends.definitions.local import LocalProcessingBackend
+from app.utils.columnar import PaddedRow, index_rows, json_default, materialize_rows, pad_row
+
+
+def test_padded_row_behaves_like_the_padded_tuple():
+    row = PaddedRow(("a", "b"), length=4)
+    padded = ("a", "b", "a", "a")
+
+    assert len(row) == 4
+    assert tuple(row) == padded
+    assert row == padded and padded == row
+    assert row == PaddedRow(("a", "b"), length=4)
+    assert row != PaddedRow(("a", "b"), length=5)
+    assert row != ("a", "b", "a")
+    assert hash(row) == hash(padded)
+
+    assert [row[idx] for idx in range(-4, 4)] == list(padded + padded)
+    assert row[1:] == padded[1:]
+    assert row[::-1] == padded[::-1]
+    assert row + ("z",) == padded + ("z",)
+    assert row.materialize() == padded
+    assert pickle.loads(pickle.dumps(row)) == row
+
+    with pytest.raises(IndexError):
+        row[4]
+    with pytest.raises(IndexError):
+        row[-5]
+
+
+def test_padded_row_never_shrinks():
+    assert PaddedRow(("a", "b", "c"), length=2).materialize() == ("a", "b", "c")
+
+
+def test_pad_row():
+    row = ("a", "b")
+
+    assert pad_row(row, length=4) == ("a", "b", "a", "a")
+    assert pad_row(row, length=2) is row
+    assert pad_row(["a"], length=2) == ("a", "a")
+
+
+def test_rows_are_padded_into_tuples_by_default(series_matrix, baseline_normalized):
+    normalized = LocalProcessingBackend.normalize_item(series_matrix)
+
+    assert normalized == baseline_normalized
+    assert all(type(vals) is tuple for vals in normalized.values())
+    # Usable as any other tuples
+    assert json.loads(json.dumps({str(key): vals for (key, vals) in normalized.items()}))["Series_title"] == [
+        "A small series"
+    ] * 4
+    assert ("x",) + normalized["Series_title"] == ("x",) + ("A small series",) * 4
+
+
+def test_lazy_padding(series_matrix, baseline_normalized, tmp_path):
+    normalized = LocalProcessingBackend.normalize_item(series_matrix, lazy_padding=True)
+
+    assert isinstance(normalized["Series_title"], PaddedRow)
+    assert normalized["Series_title"].values == ("A small series",)
+    # The full-width rows are left as they are
+    assert type(normalized[None]) is tuple
+    assert normalized == baseline_normalized
+    assert materialize_rows(normalized) == baseline_normalized
+
+    # Written out in full, the same as the eagerly padded rows
+    savepath = LocalProcessingBackend.save_normalized(normalized, file=tmp_path / "normalized.json")
+    with open(savepath) as saved:
+        assert json.load(saved)["Series_title"] == ["A small series"] * 4
+
+
+def test_index_rows_pads_and_renames():
+    rows = [
+        ("key", ("a",)),
+        ("key", ("b", "c", "d")),
+        ("empty", ("", "")),
+        (None, ("p1", "1", "2")),
+    ]
+
+    assert index_rows([rows]) == {
+        "key": ("a", "a", "a"),
+        "key-2": ("b", "c", "d"),
+        None: ("p1", "1", "2"),
+    }
+    assert index_rows([rows], pad_lengths=False) == {
+        "key": ("a",),
+        "key-2": ("b", "c", "d"),
+        None: ("p1", "1", "2"),
+    }
+
+
+def test_json_default():
+    row = PaddedRow(("broadcast",), length=3)
+
+    assert json.loads(json.dumps(row, default=json_default)) == ["broadcast"] * 3
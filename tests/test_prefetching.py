@@ -0,0 +1,118 @@
+import contextlib
+import inspect
+import threading
+
+import pytest
+
+import app.constants as const
+from app.core import mainloop
+from app.core.fetch.prefetching import PrefetchingFetcher, prefetch
+
+
+class Source:
+    """A batch coroutine over numbered batches, recording the sizes sent to it and whether it was closed."""
+
+    def __init__(self, batches=5, fail_at=None):
+        self.batches = batches
+        self.fail_at = fail_at
+        self.requested = []
+        self.sizes = []
+        self.closed = threading.Event()
+
+    def __call__(self):
+        try:
+            for idx in range(self.batches):
+                if idx == self.fail_at:
+                    raise RuntimeError("search failed")
+                self.requested.append(idx)
+                new_size = yield {f"uid{idx}": ("addr", f"GSE{idx}")}
+                self.sizes.append(new_size)
+        finally:
+            self.closed.set()
+
+
+def test_yields_the_batches_in_order():
+    source = Source()
+
+    assert [list(batch) for batch in prefetch(source(), depth=2)] == [[f"uid{idx}"] for idx in range(5)]
+    assert source.closed.is_set()
+
+
+def test_is_lazy_and_bounded():
+    source = Source(batches=100)
+    fetcher = PrefetchingFetcher(source(), depth=2)
+
+    assert source.requested == []
+    next(fetcher)
+
+    # The consumer holds one batch, the queue two more, and the worker waits with another
+    fetcher.close()
+    assert len(source.requested) <= 4
+    assert source.closed.is_set()
+
+
+def test_forwards_the_new_batch_sizes():
+    source = Source(batches=3)
+    fetcher = prefetch(source(), depth=1)
+
+    next(fetcher)
+    fetcher.send(10)
+    with pytest.raises(StopIteration):
+        while True:
+            next(fetcher)
+
+    # The prefetched batches went out before the size changed
+    assert 10 in source.sizes
+
+
+def test_reraises_the_errors_of_the_source():
+    source = Source(fail_at=1)
+    fetcher = prefetch(source())
+
+    next(fetcher)
+    with pytest.raises(RuntimeError):
+        next(fetcher)
+    with pytest.raises(StopIteration):
+        next(fetcher)
+
+
+def test_closes_as_a_context_manager():
+    source = Source(batches=100)
+
+    with prefetch(source(), depth=3) as fetcher:
+        next(fetcher)
+
+    assert source.closed.is_set()
+    with pytest.raises(StopIteration):
+        next(fetcher)
+
+    # Closing one never started closes the source as well
+    unstarted = Source()()
+    prefetch(unstarted).close()
+    assert inspect.getgeneratorstate(unstarted) == inspect.GEN_CLOSED
+
+
+def test_prefetching_is_opt_in():
+    assert const.DEFAULT_SEARCH_PREFETCH == 0
+    assert mainloop.parse_app_args(ui_args={})[const.MAINARG_SEARCH_PREFETCH] == 0
+
+
+def test_fetcher_stops_with_the_exit_stack(monkeypatch):
+    source = Source(batches=100)
+    monkeypatch.setattr(mainloop, "fetch_all", lambda **kwargs: source())
+    app_args = {
+        const.MAINARG_DATABASE: const.DEFAULT_DB_VALUE,
+        const.MAINARG_QUERY: "cancer",
+        const.MAINARG_BATCH_SIZE: 1,
+        const.MAINARG_SEARCH_PREFETCH: 2,
+    }
+
+    with pytest.raises(KeyboardInterrupt):
+        with contextlib.ExitStack() as exit_stack:
+            fetcher = mainloop.get_fetcher(app_args=app_args, exit_stack=exit_stack)
+            next(fetcher)
+            # The consumer bailing out, e.g. on an error of its own
+            raise KeyboardInterrupt
+
+    assert isinstance(fetcher, PrefetchingFetcher)
+    assert source.closed.is_set()
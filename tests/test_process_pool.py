@@ -0,0 +1,122 @@
+import gzip
+import operator
+
+import pytest
+
+import app.utils.process_pool as process_pool
+from app.processing_backends.definitions.process_pool import (
+    Normalized,
+    ProcessPoolProcessingBackend,
+    normalize_in_worker,
+)
+from app.utils.ftp import LocalCopy
+from app.utils.process_pool import ProcessPool, dumps_shared, loads_shared
+
+shared_memory_only = pytest.mark.skipif(
+    not (process_pool.SHARED_MEMORY_SUPPORT and process_pool.PICKLE_BUFFER_SUPPORT),
+    reason="Needs shared memory and pickle protocol 5 (Python 3.8+)",
+)
+
+
+def assert_freed(shm_name):
+    with pytest.raises(FileNotFoundError):
+        process_pool.shared_memory.SharedMemory(name=shm_name)
+
+
+def test_plain_objects_round_trip():
+    obj = {"key": ("a", "b"), None: ("p1", "1")}
+    payload = dumps_shared(obj, min_shared_bytes=0)
+
+    # Nothing out of band in there
+    assert payload.shm_name is None
+    assert loads_shared(payload) == obj
+
+
+@shared_memory_only
+def test_large_buffers_go_through_shared_memory():
+    np = pytest.importorskip("numpy")
+    values = np.arange(100_000, dtype="float32").reshape(1000, 100)
+
+    payload = dumps_shared({"values": values, "ids": ["a"]}, min_shared_bytes=1024)
+
+    assert payload.shm_name is not None
+    assert payload.buffer_sizes == (values.nbytes,)
+    # The array data is not in the pickle
+    assert len(payload.header) < 1024
+
+    result = loads_shared(payload)
+
+    np.testing.assert_array_equal(result["values"], values)
+    assert result["ids"] == ["a"]
+    assert_freed(payload.shm_name)
+
+
+@shared_memory_only
+def test_several_buffers_keep_their_order():
+    np = pytest.importorskip("numpy")
+    arrays = [np.full(size, size, dtype="int64") for size in (10, 1, 1000)]
+
+    payload = dumps_shared(arrays, min_shared_bytes=0)
+    result = loads_shared(payload)
+
+    assert payload.buffer_sizes == tuple(arr.nbytes for arr in arrays)
+    for got, expected in zip(result, arrays):
+        np.testing.assert_array_equal(got, expected)
+    assert_freed(payload.shm_name)
+
+
+@shared_memory_only
+def test_small_buffers_travel_inline():
+    np = pytest.importorskip("numpy")
+    values = np.arange(10, dtype="float64")
+
+    payload = dumps_shared(values, min_shared_bytes=1024)
+
+    assert payload.shm_name is None
+    assert len(payload.inline_buffers) == 1
+    np.testing.assert_array_equal(loads_shared(payload), values)
+
+
+def test_fallback_without_shared_memory(monkeypatch):
+    np = pytest.importorskip("numpy")
+    monkeypatch.setattr(process_pool, "SHARED_MEMORY_SUPPORT", False)
+    values = np.arange(1000, dtype="float64")
+
+    payload = dumps_shared(values, min_shared_bytes=0)
+
+    assert payload.shm_name is None
+    assert payload.inline_buffers == ()
+    np.testing.assert_array_equal(loads_shared(payload), values)
+
+
+def test_process_pool_runs_in_a_worker():
+    pool = ProcessPool(workers=1)
+    try:
+        assert pool.run(operator.add, 2, 3) == 5
+    finally:
+        pool.close()
+
+
+def test_worker_path_matches_baseline(tmp_path, series_matrix, baseline_normalized):
+    gzipped = tmp_path / "GSE1_series_matrix.txt.gz"
+    gzipped.write_bytes(gzip.compress(series_matrix.encode("utf8")))
+
+    assert normalize_in_worker(str(gzipped), {}) == baseline_normalized
+
+    pool = ProcessPool(workers=1)
+    try:
+        assert pool.run(normalize_in_worker, str(gzipped), {}) == baseline_normalized
+    finally:
+        pool.close()
+
+
+def test_backend_normalizes_the_worker_result(tmp_path, series_matrix, baseline_normalized):
+    gzipped = tmp_path / "GSE1_series_matrix.txt.gz"
+    gzipped.write_bytes(gzip.compress(series_matrix.encode("utf8")))
+    local_copy = LocalCopy(str(gzipped), temporary=True)
+
+    extracted = Normalized(extracted=local_copy, normalized=normalize_in_worker(local_copy.path, {}))
+
+    assert ProcessPoolProcessingBackend.normalize_item(extracted) == baseline_normalized
+    # The downloaded copy is not needed any more
+    assert not gzipped.exists()
@@ -0,0 +1,85 @@
+import os
+
+import pytest
+
+from app.core.search import ratelimit
+from app.core.search.ratelimit import TokenBucket, build_eutils_limiter, get_bucket_path
+
+
+class FakeClock:
+    def __init__(self, now=1000.0):
+        self.now = now
+        self.slept = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+def test_spaces_the_requests_out():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=4, clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.25)
+    clock.now += 1.0
+    # Idle time does not pile up past the capacity
+    assert bucket.acquire() == 0.0
+    assert bucket.acquire() == pytest.approx(0.25)
+
+
+def test_allows_bursts_up_to_the_capacity():
+    clock = FakeClock()
+    bucket = TokenBucket(rate=2, capacity=3, clock=clock, sleep=clock.sleep)
+
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+
+
+def test_rejects_a_non_positive_rate():
+    with pytest.raises(ValueError):
+        TokenBucket(rate=0)
+
+
+@pytest.mark.skipif(not ratelimit.FCNTL_SUPPORT, reason="The state is only shared with fcntl")
+def test_buckets_share_the_state_file(tmp_path):
+    clock = FakeClock()
+    state_path = str(tmp_path / "eutils.bucket")
+    first = TokenBucket(rate=1, state_path=state_path, clock=clock, sleep=clock.sleep)
+    second = TokenBucket(rate=1, state_path=state_path, clock=clock, sleep=clock.sleep)
+
+    assert first.acquire() == 0.0
+    # The token is gone for the other process too
+    assert second.acquire() == pytest.approx(1.0)
+    assert oct(os.stat(state_path).st_mode & 0o777) == oct(0o600)
+
+
+def test_falls_back_to_the_process_state(tmp_path):
+    clock = FakeClock()
+    # Say, a file in a directory we cannot write to
+    bucket = TokenBucket(rate=1, state_path=str(tmp_path / "missing" / "eutils.bucket"), clock=clock, sleep=clock.sleep)
+
+    assert bucket.acquire() == 0.0
+    assert bucket.state_path is None
+    assert bucket.acquire() == pytest.approx(1.0)
+
+
+def test_bucket_paths_are_per_user_and_key(tmp_path, monkeypatch):
+    anonymous = get_bucket_path(lock_dir=str(tmp_path))
+    keyed = get_bucket_path(api_key="secret", lock_dir=str(tmp_path))
+
+    assert anonymous != keyed
+    assert "secret" not in keyed
+
+    monkeypatch.setattr(ratelimit, "_get_user_id", lambda: "someone-else")
+    assert get_bucket_path(lock_dir=str(tmp_path)) != anonymous
+
+
+def test_eutils_limiter(tmp_path):
+    assert build_eutils_limiter().rate == 3
+    assert build_eutils_limiter(api_key="secret").rate == 10
+    assert build_eutils_limiter(rate=5, burst=2, shared=False).capacity == 2
+    assert build_eutils_limiter(shared=False).state_path is None
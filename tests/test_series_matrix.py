@@ -0,0 +1,238 @@
+import json
+import os
+import tracemalloc
+import typing
+
+import pytest
+
+from app.parsers.series_matrix import (
+    SECTION_METADATA,
+    SECTION_SAMPLE,
+    SECTION_SERIES,
+    SECTION_TABLE,
+    SECTION_TABLE_HEADER,
+    STATE_EPILOGUE,
+    STATE_PREAMBLE,
+    STATE_TABLE,
+    SeriesMatrixParser,
+    iter_series_matrix_rows,
+    iter_text_lines,
+)
+from app.processing_backends.definitions.local import (
+    LocalProcessingBackend,
+    MetadataRowCollector,
+    RowCollector,
+    SpooledRows,
+)
+from app.utils.columnar import index_rows, iter_index_rows
+from app.utils.ftp import TransferStopped
+
+
+def test_text_path_matches_baseline(series_matrix, baseline_normalized):
+    assert LocalProcessingBackend.normalize_item(series_matrix) == baseline_normalized
+
+
+def test_parser_states_and_sections(series_matrix):
+    rows = []
+    parser = SeriesMatrixParser(sink=rows.append)
+    states = []
+
+    for line in iter_text_lines(series_matrix + '!Sample_epilogue_note\t"x"\n'):
+        parser.feed(line)
+        states.append(parser.state)
+
+    assert parser.state == STATE_EPILOGUE
+    assert parser.table_rows == 2
+
+    # The markers switch the state, but are not rows themselves
+    begin_idx = series_matrix.split("\n").index('!series_matrix_table_begin')
+    assert set(states[:begin_idx]) == {STATE_PREAMBLE}
+    assert states[begin_idx] == STATE_TABLE
+    assert all(row.key != 'series_matrix_table_begin' for row in rows)
+
+    sections = [(row.key, row.section) for row in rows]
+    assert sections == [
+        ('Series_title', SECTION_SERIES),
+        ('Series_geo_accession', SECTION_SERIES),
+        ('Series_summary', SECTION_SERIES),
+        ('Series_summary', SECTION_SERIES),
+        ('Sample_title', SECTION_SAMPLE),
+        ('Sample_source_name_ch1', SECTION_SAMPLE),
+        ('Sample_characteristics_ch1', SECTION_SAMPLE),
+        ('Sample_characteristics_ch1', SECTION_SAMPLE),
+        ('ID_REF', SECTION_TABLE_HEADER),
+        (None, SECTION_TABLE),
+        (None, SECTION_TABLE),
+        ('Sample_epilogue_note', SECTION_SAMPLE),
+    ]
+
+
+def test_parser_table_edge_cases():
+    rows = []
+    parser = SeriesMatrixParser(sink=rows.append)
+
+    for line in [
+        '!series_matrix_table_begin\n',
+        '"ID_REF"\t"GSM1"\n',
+        '!Series_inline_note\t"x"\n',
+        '"p1"\t1\n',
+        '!series_matrix_table_end\n',
+        'stray\tline\n',
+    ]:
+        parser.feed(line)
+
+    assert [(row.key, row.section) for row in rows] == [
+        ('ID_REF', SECTION_TABLE_HEADER),
+        ('Series_inline_note', SECTION_SERIES),
+        (None, SECTION_TABLE),
+        (None, SECTION_METADATA),
+    ]
+    # The newlines are not part of the values
+    assert rows[0].values == ('GSM1',)
+
+    parser.reset()
+    assert (parser.state, parser.lines, parser.table_rows) == (STATE_PREAMBLE, 0, 0)
+
+
+def test_iter_series_matrix_rows_accepts_text_and_lines(series_matrix):
+    from_text = list(iter_series_matrix_rows(series_matrix))
+    from_lines = list(iter_series_matrix_rows(series_matrix.split("\n")))
+
+    assert from_text == from_lines
+    assert len(from_text) == 11
+
+
+def test_iter_text_lines():
+    assert list(iter_text_lines("a\nb")) == ["a", "b"]
+    assert list(iter_text_lines("a\nb\n")) == ["a", "b", ""]
+    assert list(iter_text_lines("")) == [""]
+
+
+def big_series_matrix(probes: int, samples: int) -> typing.Iterator[str]:
+    yield '!Series_title\t"A large series"'
+    yield '!Sample_title\t' + '\t'.join(f'"s{idx}"' for idx in range(samples))
+    yield '!series_matrix_table_begin'
+    yield '"ID_REF"\t' + '\t'.join(f'"GSM{idx}"' for idx in range(samples))
+    for probe in range(probes):
+        yield f'"p{probe}"\t' + '\t'.join(f'{probe}.{idx}' for idx in range(samples))
+    yield '!series_matrix_table_end'
+
+
+def test_spooled_rows():
+    rows = SpooledRows()
+    rows.append(('key', ('a', 'b')))
+    rows.append((None, ('p1', '1')))
+
+    assert len(rows) == 2
+    # Re-iterable, and still open for more rows in between
+    assert list(rows) == [('key', ('a', 'b')), (None, ('p1', '1'))]
+    rows.append(('key', ('c',)))
+    assert list(rows)[-1] == ('key', ('c',))
+
+    rows.release()
+    assert not os.path.exists(rows.path)
+
+
+def test_row_collector_spools_to_disk(series_matrix):
+    collector = RowCollector()
+    for line in iter_text_lines(series_matrix):
+        collector(line)
+
+    spooled = collector.result()
+    assert isinstance(spooled, SpooledRows)
+    assert list(spooled) == [(row.key, row.values) for row in iter_series_matrix_rows(series_matrix)]
+
+    # A transfer starting over drops the rows parsed so far
+    collector.reset()
+    assert not os.path.exists(spooled.path)
+    assert len(collector.result()) == 0
+
+
+def test_metadata_collector_stops_at_the_table(series_matrix):
+    collector = MetadataRowCollector()
+
+    with pytest.raises(TransferStopped):
+        for line in iter_text_lines(series_matrix):
+            collector(line)
+
+    keys = [key for (key, _) in collector.result()]
+    assert keys[-1] == 'Sample_characteristics_ch1'
+    assert 'ID_REF' not in keys and None not in keys
+
+
+@pytest.mark.parametrize("options", [
+    {},
+    {"pad_lengths": False},
+    {"encode_metadata": True},
+    {"lazy_padding": True},
+    {"encode_metadata": True, "lazy_padding": True},
+])
+def test_iter_index_rows_matches_index_rows(series_matrix, options):
+    rows = [(row.key, row.values) for row in iter_series_matrix_rows(series_matrix)]
+
+    assert list(iter_index_rows(rows, **options)) == list(index_rows([rows], **options).items())
+
+    with pytest.raises(TypeError):
+        list(iter_index_rows(iter(rows), **options))
+
+
+@pytest.mark.parametrize("compact", [False, True])
+@pytest.mark.parametrize("options", [{}, {"encode_metadata": True, "lazy_padding": True}])
+def test_normalize_to_file_matches_save_normalized(tmp_path, series_matrix, compact, options):
+    collector = RowCollector()
+    for line in iter_text_lines(series_matrix):
+        collector(line)
+
+    streamed = LocalProcessingBackend.normalize_to_file(
+        collector.result(), file=tmp_path / "streamed.json", compact=compact, **options
+    )
+    saved = LocalProcessingBackend.save_normalized(
+        LocalProcessingBackend.normalize_item(series_matrix, **options),
+        file=tmp_path / "saved.json",
+        compact=compact
+    )
+
+    with open(streamed) as streamed_file, open(saved) as saved_file:
+        assert streamed_file.read() == saved_file.read()
+
+
+def test_streamed_rows_are_not_held_in_memory(tmp_path):
+    probes, samples = 5000, 20
+    collector = RowCollector()
+
+    tracemalloc.start()
+    try:
+        for line in big_series_matrix(probes, samples):
+            collector(line)
+        parsing_peak = tracemalloc.get_traced_memory()[1]
+
+        tracemalloc.reset_peak()
+        savepath = LocalProcessingBackend.normalize_to_file(collector.result(), file=tmp_path / "normalized.json")
+        writing_peak = tracemalloc.get_traced_memory()[1]
+
+    finally:
+        tracemalloc.stop()
+
+    output_size = os.path.getsize(savepath)
+    assert output_size > 2 * 1000 * 1000
+    # Neither stage comes anywhere close to holding the data in memory
+    assert parsing_peak < output_size / 8
+    assert writing_peak < output_size / 8
+
+    with open(savepath) as saved:
+        normalized = json.load(saved)
+
+    assert len(normalized) == probes + 3
+    assert normalized["Series_title"] == ["A large series"] * (samples + 1)
+    assert normalized[f"None-{probes}"] == [f"p{probes - 1}"] + [f"{probes - 1}.{idx}" for idx in range(samples)]
+
+
+def test_save_spooled_rows(tmp_path, series_matrix):
+    collector = RowCollector()
+    for line in iter_text_lines(series_matrix):
+        collector(line)
+
+    savepath = LocalProcessingBackend.save_extracted(collector.result(), file=tmp_path / "extracted.json")
+
+    with open(savepath) as saved:
+        assert saved.read() == json.dumps(list(collector.result()), indent=4)